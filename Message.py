@@ -17,20 +17,41 @@ class Message(ABC):
 
 class HandshakeMessage(Message):
     """
-    <19><BitTorrent protocol><0x0000000000000000><info_hash><peer_id>
+    <19><BitTorrent protocol><reserved><info_hash><peer_id>
     """
 
-    def __init__(self, info_hash: bytes, peer_id=None):
+    EXTENSION_PROTOCOL_BIT = 0x10  # reserved[5], BEP 10
+    FAST_EXTENSION_BIT = 0x04  # reserved[7], BEP 6
+
+    def __init__(self, info_hash: bytes, peer_id=None, reserved=None):
         self.info_hash = info_hash
         self.peer_id = peer_id if peer_id is not None else b'\x00' * 20
+        self.reserved = reserved if reserved is not None else HandshakeMessage.make_reserved()
+
+    @staticmethod
+    def make_reserved(extensions=True, fast=True) -> bytes:
+        reserved = bytearray(8)
+        if extensions:
+            reserved[5] |= HandshakeMessage.EXTENSION_PROTOCOL_BIT
+        if fast:
+            reserved[7] |= HandshakeMessage.FAST_EXTENSION_BIT
+        return bytes(reserved)
+
+    @property
+    def supports_extensions(self) -> bool:
+        return bool(self.reserved[5] & HandshakeMessage.EXTENSION_PROTOCOL_BIT)
+
+    @property
+    def supports_fast(self) -> bool:
+        return bool(self.reserved[7] & HandshakeMessage.FAST_EXTENSION_BIT)
 
     def encode(self):
-        return pack(f'!B19s8s20s20s', 19, b'BitTorrent protocol', b'\x00' * 8, self.info_hash, self.peer_id)
+        return pack(f'!B19s8s20s20s', 19, b'BitTorrent protocol', self.reserved, self.info_hash, self.peer_id)
 
     @staticmethod
     def decode(message):
         identifier_length, identifier, reserved, info_hash, peer_id = unpack('!B19s8s20s20s', message)
-        return HandshakeMessage(info_hash, peer_id)
+        return HandshakeMessage(info_hash, peer_id, reserved)
 
 
 class InterestedMessage(Message):
@@ -208,3 +229,102 @@ class NotInterestedMessage(Message):
             logging.error(f'При запросе на отсутсвие интереса был получен некорректный индентификатор: {message_id}')
         else:
             return NotInterestedMessage()
+
+
+class SuggestPieceMessage(Message):
+    """
+    <0005><13><piece_index>
+    """
+
+    def __init__(self, piece_index):
+        self.piece_index = piece_index
+
+    def encode(self):
+        return pack('!IBI', 5, 13, self.piece_index)
+
+    @staticmethod
+    def decode(message):
+        message_length, message_id, piece_index = unpack('!IBI', message)
+        return SuggestPieceMessage(piece_index)
+
+
+class HaveAllMessage(Message):
+    """
+    <0001><14>
+    """
+    def encode(self):
+        return pack('!IB', 1, 14)
+
+    @staticmethod
+    def decode(message):
+        message_length, message_id = unpack('!IB', message)
+        return HaveAllMessage()
+
+
+class HaveNoneMessage(Message):
+    """
+    <0001><15>
+    """
+    def encode(self):
+        return pack('!IB', 1, 15)
+
+    @staticmethod
+    def decode(message):
+        message_length, message_id = unpack('!IB', message)
+        return HaveNoneMessage()
+
+
+class RejectRequestMessage(Message):
+    """
+    <0013><16><index><byte_offset><block_len>
+    """
+
+    def __init__(self, index: int, byte_offset: int, block_len: int):
+        self.index = index
+        self.byte_offset = byte_offset
+        self.block_len = block_len
+
+    def encode(self):
+        return pack('!IBIII', 13, 16, self.index, self.byte_offset, self.block_len)
+
+    @staticmethod
+    def decode(message):
+        message_length, message_id, index, byte_offset, block_len = unpack('!IBIII', message)
+        return RejectRequestMessage(index, byte_offset, block_len)
+
+
+class AllowedFastMessage(Message):
+    """
+    <0005><17><piece_index>
+    """
+
+    def __init__(self, piece_index):
+        self.piece_index = piece_index
+
+    def encode(self):
+        return pack('!IBI', 5, 17, self.piece_index)
+
+    @staticmethod
+    def decode(message):
+        message_length, message_id, piece_index = unpack('!IBI', message)
+        return AllowedFastMessage(piece_index)
+
+
+class ExtendedMessage(Message):
+    """
+    <2 + len(payload)><20><extended_id><payload>
+    """
+
+    HANDSHAKE_ID = 0
+
+    def __init__(self, extended_id: int, payload: bytes):
+        self.extended_id = extended_id
+        self.payload = payload
+
+    def encode(self):
+        return pack(f'!IBB{len(self.payload)}s', 2 + len(self.payload), 20, self.extended_id, self.payload)
+
+    @staticmethod
+    def decode(message):
+        message_length, message_id, extended_id = unpack('!IBB', message[:6])
+        return ExtendedMessage(extended_id, message[6:4 + message_length])
@@ -0,0 +1,40 @@
+import pytest
+from unittest.mock import MagicMock
+from announce_scheduler import AnnounceScheduler
+from timer_scheduler import TimerScheduler
+
+
+@pytest.fixture
+def timers():
+    timers = TimerScheduler()
+    timers.time = MagicMock(return_value=100.0)
+    return timers
+
+
+class TestAnnounceScheduler:
+    @pytest.mark.asyncio
+    async def test_announces_are_spread(self, timers):
+        scheduler = AnnounceScheduler(timers, jitter=0, spacing=1)
+        whens = [scheduler.call_later(60, print).when for _ in range(5)]
+        assert whens == [160, 161, 162, 163, 164]
+
+        assert scheduler.call_later(61.5, print).when == 165
+        assert scheduler.call_later(30, print).when == 130
+        timers.close()
+
+    @pytest.mark.asyncio
+    async def test_jitter_never_shortens_interval(self, timers):
+        scheduler = AnnounceScheduler(timers, jitter=0.1, spacing=0)
+        whens = {scheduler.call_later(100, print).when for _ in range(50)}
+        assert all(200 <= when <= 210 for when in whens)
+        assert len(whens) > 1
+        timers.close()
+
+    @pytest.mark.asyncio
+    async def test_past_announces_are_forgotten(self, timers):
+        scheduler = AnnounceScheduler(timers, jitter=0, spacing=1)
+        scheduler.call_later(10, print)
+        timers.time.return_value = 200.0
+        assert scheduler.call_later(0, print).when == 200
+        assert len(scheduler._due) == 1
+        timers.close()
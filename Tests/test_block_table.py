@@ -0,0 +1,73 @@
+import pytest
+from block_table import BlockTable
+
+
+@pytest.fixture
+def table():
+    return BlockTable(4, max_requests=2)
+
+
+class TestBlockTable:
+    def test_request_and_receive(self, table):
+        assert table.next_missing() == 0
+        assert table.add_request(0, 1, 10, 5)
+        assert table.states[0] == BlockTable.PENDING
+        assert table.missing_count == 3
+        assert table.next_missing() == 1
+
+        assert table.remove_request(0, 1) == 10
+        assert table.states[0] == BlockTable.MISSING
+        assert table.next_missing() == 0
+
+        table.add_request(0, 1, 10, 5)
+        assert table.mark_received(0) == [1]
+        assert table.states[0] == BlockTable.RECEIVED
+        assert table.mark_received(0) == []
+        assert table.received_count == 1
+        assert not table.add_request(0, 2, 10, 5)
+
+    def test_request_slots(self, table):
+        assert table.add_request(1, 1, 0, 5)
+        assert not table.add_request(1, 1, 0, 5)
+        assert table.add_request(1, 2, 0, 5)
+        assert not table.add_request(1, 3, 0, 5)
+        assert table.requesters_of(1) == [1, 2]
+
+        table.remove_request(1, 1)
+        assert table.states[1] == BlockTable.PENDING
+        assert table.mark_received(1) == [2]
+
+    def test_remove_requester(self, table):
+        table.add_request(0, 1, 0, 5)
+        table.add_request(2, 1, 0, 5)
+        table.add_request(2, 2, 0, 5)
+
+        assert table.remove_requester(1) == [0, 2]
+        assert table.pending() == [2]
+        assert table.missing_count == 3
+
+    def test_deadlines(self, table):
+        table.add_request(0, 1, 0, 5)
+        table.add_request(1, 2, 0, 2)
+        assert table.next_deadline() == 2
+        assert table.expired(3) == [(1, 2)]
+        assert table.next_deadline() == 2
+        table.remove_request(1, 2)
+        assert table.next_deadline() == 5
+        assert table.expired(3) == []
+
+    def test_reset(self, table):
+        table.add_request(0, 1, 0, 5)
+        table.mark_received(1)
+        table.reset()
+        assert table.missing_count == 4
+        assert table.received_count == 0
+        assert table.next_missing() == 0
+        assert table.next_deadline() is None
+        assert not any(table.states)
+
+    def test_memory_footprint(self):
+        table = BlockTable(1024, max_requests=2)
+        size = sum(len(array) * array.itemsize for array in
+                   (table.states, table.requesters, table.requested_at, table.deadlines))
+        assert size < 40 * 1024
@@ -0,0 +1,95 @@
+import asyncio
+import pytest
+import Message
+from unittest.mock import MagicMock, AsyncMock
+from choker import Choker
+from peer_connection import PeerConnection
+
+
+def make_peer(ip, downloaded=0, uploaded=0, interested=True):
+    peer = MagicMock(PeerConnection)
+    peer.ip = ip
+    peer.is_active = True
+    peer.peer_interested = interested
+    peer.choked = True
+    peer.downloaded = downloaded
+    peer.uploaded = uploaded
+    peer.send_message_to_peer = AsyncMock(return_value=True)
+    return peer
+
+
+@pytest.fixture
+def peers():
+    return [make_peer(f'10.0.0.{i}', downloaded=i * 1000, uploaded=(10 - i) * 1000) for i in range(1, 6)]
+
+
+class TestChoker:
+    @pytest.mark.asyncio
+    async def test_downloading_ranks_by_download_rate(self, peers, monkeypatch):
+        choker = Choker(peers, MagicMock(), is_seeding=lambda: False, upload_slots=3)
+        monkeypatch.setattr(choker, 'pick_optimistic', lambda candidates: candidates[-1])
+
+        choker.rechoke()
+        await asyncio.sleep(0)
+
+        assert [peer.choked for peer in peers] == [False, True, True, False, False]
+        assert choker.optimistic_peer is peers[0]
+        assert isinstance(peers[4].send_message_to_peer.call_args[0][0], Message.UnChokedMessage)
+        peers[1].send_message_to_peer.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_seeding_ranks_by_upload_rate(self, peers, monkeypatch):
+        choker = Choker(peers, MagicMock(), is_seeding=lambda: True, upload_slots=3)
+        monkeypatch.setattr(choker, 'pick_optimistic', lambda candidates: None)
+
+        choker.rechoke()
+
+        assert [peer.choked for peer in peers] == [False, False, True, True, True]
+
+    @pytest.mark.asyncio
+    async def test_uninterested_peers_are_choked(self, peers):
+        peers[4].peer_interested = False
+        peers[4].choked = False
+        choker = Choker(peers, MagicMock(), is_seeding=lambda: False, upload_slots=10)
+
+        choker.rechoke()
+
+        assert peers[4].choked
+        assert not any(peer.choked for peer in peers[:4])
+
+    @pytest.mark.asyncio
+    async def test_optimistic_peer_is_kept_between_rounds(self, peers):
+        choker = Choker(peers, MagicMock(), is_seeding=lambda: False, upload_slots=2)
+        choker.rechoke()
+        optimistic = choker.optimistic_peer
+        assert optimistic is not None and optimistic is not peers[4]
+
+        choker.rechoke()
+        choker.rechoke()
+        assert choker.optimistic_peer is optimistic
+        assert not optimistic.choked
+
+    @pytest.mark.asyncio
+    async def test_interested_peer_gets_free_slot(self, peers):
+        choker = Choker(peers, MagicMock(), is_seeding=lambda: False, upload_slots=1)
+        choker.on_interest_changed(peers[0])
+        choker.on_interest_changed(peers[1])
+
+        assert not peers[0].choked
+        assert peers[1].choked
+
+    def test_auto_slots(self, peers):
+        choker = Choker(peers, MagicMock(), is_seeding=lambda: False, upload_slots=None)
+        assert choker.slots == 4
+        choker.upload_rate = 1024 * 1024
+        assert choker.slots == 20
+
+    def test_start_schedules_rechoke(self, peers):
+        timers = MagicMock()
+        choker = Choker(peers, timers, is_seeding=lambda: False)
+        choker.start()
+        choker.start()
+        timers.call_later.assert_called_once()
+
+        choker.close()
+        timers.call_later.return_value.cancel.assert_called_once()
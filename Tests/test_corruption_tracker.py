@@ -0,0 +1,85 @@
+import hashlib
+import pytest
+from unittest.mock import MagicMock
+from corruption_tracker import CorruptionTracker
+from hash_verifier import HashVerifier
+from piece_buffer import PieceBuffer
+
+
+@pytest.fixture
+def verifier():
+    verifier = HashVerifier(max_workers=1)
+    yield verifier
+    verifier.close()
+
+
+@pytest.fixture
+def tracker(verifier):
+    return CorruptionTracker(verifier, max_failures=2)
+
+
+def make_peer(ip):
+    peer = MagicMock()
+    peer.ip = ip
+    return peer
+
+
+def make_piece(blocks):
+    piece = PieceBuffer(sum(len(block) for block in blocks), block_length=4)
+    for index, block in enumerate(blocks):
+        piece.write(index * 4, block)
+    return piece
+
+
+class TestCorruptionTracker:
+    @pytest.mark.asyncio
+    async def test_single_sender_is_banned(self, tracker):
+        peer = make_peer('10.0.0.1')
+        listener = MagicMock()
+        tracker.ban_event.subscribe(listener)
+
+        await tracker.on_piece_failed(0, make_piece([b'aaaa', b'bbbb']), [peer, peer])
+
+        assert tracker.corruption_count(peer) == 1
+        assert tracker.is_banned(peer)
+        listener.assert_called_once_with('10.0.0.1')
+
+    @pytest.mark.asyncio
+    async def test_culprit_found_on_redownload(self, tracker):
+        good, bad, other = make_peer('10.0.0.1'), make_peer('10.0.0.2'), make_peer('10.0.0.3')
+
+        await tracker.on_piece_failed(0, make_piece([b'aaaa', b'XXXX']), [good, bad])
+        assert not tracker.banned
+        assert tracker.is_suspect(0, bad)
+        assert not tracker.is_suspect(1, bad)
+
+        await tracker.on_piece_passed(0, make_piece([b'aaaa', b'bbbb']))
+
+        assert tracker.is_banned(bad)
+        assert not tracker.is_banned(good)
+        assert tracker.corruption_count(bad) == 1
+        assert tracker.corruption_count(good) == 0
+        assert not tracker.is_suspect(0, bad)
+
+    @pytest.mark.asyncio
+    async def test_repeated_failures_ban_suspect(self, tracker):
+        bad = make_peer('10.0.0.2')
+        await tracker.on_piece_failed(0, make_piece([b'aaaa', b'XXXX']), [make_peer('10.0.0.1'), bad])
+        assert not tracker.is_banned(bad)
+
+        await tracker.on_piece_failed(1, make_piece([b'XXXX', b'cccc']), [bad, make_peer('10.0.0.3')])
+        assert tracker.is_banned(bad)
+        assert tracker.corruption_count(bad) == 0
+
+    @pytest.mark.asyncio
+    async def test_unknown_senders(self, tracker):
+        await tracker.on_piece_failed(0, make_piece([b'aaaa']), [None])
+        assert not tracker.banned
+        assert not tracker._failed_pieces
+
+
+class TestBlockDigests:
+    @pytest.mark.asyncio
+    async def test_block_digests(self, verifier):
+        digests = await verifier.block_digests(make_piece([b'aaaa', b'bb']))
+        assert digests == [hashlib.sha1(b'aaaa').digest(), hashlib.sha1(b'bb').digest()]
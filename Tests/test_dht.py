@@ -0,0 +1,157 @@
+import asyncio
+import bencode
+import pytest
+import configuration
+from contextlib import asynccontextmanager
+from unittest.mock import MagicMock, AsyncMock
+from dht import (DhtNode, DhtTracker, RoutingTable, TokenManager, encode_compact_nodes, decode_compact_nodes,
+                 ID_SPACE)
+from tracker_manager import TrackerManager
+from peer_store import PeerStore
+
+INFO_HASH = b'\x42' * 20
+
+
+def node_id(value: int) -> bytes:
+    return value.to_bytes(20, 'big')
+
+
+@asynccontextmanager
+async def dht_swarm(count, **kwargs):
+    first = await DhtNode.create('127.0.0.1', timers=MagicMock(), bootstrap_nodes=[], **kwargs)
+    nodes = [first] + [await DhtNode.create('127.0.0.1', timers=MagicMock(),
+                                            bootstrap_nodes=[('127.0.0.1', first.port)], **kwargs)
+                       for _ in range(count - 1)]
+    try:
+        for node in nodes[1:]:
+            await node.bootstrap()
+        yield nodes
+    finally:
+        for node in nodes:
+            node.close()
+
+
+def test_routing_table_splits_only_own_bucket():
+    table = RoutingTable(node_id(1), k=2)
+    far = [node_id(ID_SPACE - i) for i in range(1, 4)]
+    near = [node_id(i) for i in range(2, 5)]
+
+    assert all(table.add(id_, '10.0.0.1', 6881) for id_ in far[:2] + near)
+    assert not table.add(far[2], '10.0.0.1', 6881)
+
+    assert len(table.buckets) > 2
+    assert len(table) == 5
+    assert [node.id for node in table.closest(node_id(0), 3)] == near
+    assert not table.add(node_id(1), '10.0.0.1', 6881)
+
+
+def test_unresponsive_nodes_are_replaced():
+    table = RoutingTable(node_id(1), k=2)
+    first, second, third = (node_id(ID_SPACE - i) for i in range(1, 4))
+    table.add(first, '10.0.0.1', 6881)
+    table.add(second, '10.0.0.2', 6881)
+
+    table.on_failure(first)
+    assert table.add(third, '10.0.0.3', 6881)
+    assert table.get(first) is None
+
+    for _ in range(configuration.DHT_MAX_NODE_FAILURES):
+        table.on_failure(second)
+    assert table.get(second) is None
+
+
+def test_tokens_survive_one_rotation():
+    tokens = TokenManager()
+    token = tokens.token('10.0.0.1')
+    assert tokens.check('10.0.0.1', token)
+    assert not tokens.check('10.0.0.2', token)
+
+    tokens._rotated_at -= configuration.DHT_TOKEN_ROTATION
+    assert tokens.token('10.0.0.1') != token
+    assert tokens.check('10.0.0.1', token)
+
+    tokens._rotated_at -= configuration.DHT_TOKEN_ROTATION
+    assert not tokens.check('10.0.0.1', token)
+
+
+def test_compact_nodes_round_trip():
+    table = RoutingTable(node_id(1))
+    table.add(node_id(7), '10.0.0.7', 6881)
+    table.add(node_id(9), '192.168.0.9', 51413)
+    data = encode_compact_nodes(table.nodes())
+
+    assert len(data) == 52
+    assert decode_compact_nodes(data + b'\x00') == [(node_id(7), '10.0.0.7', 6881), (node_id(9), '192.168.0.9', 51413)]
+
+
+@pytest.mark.asyncio
+async def test_swarm_finds_announced_peers():
+    async with dht_swarm(12) as nodes:
+        assert all(len(node.table) > 0 for node in nodes)
+
+        assert await nodes[3].announce(INFO_HASH, 7000) == set()
+        holders = [node for node in nodes if node.stored_peers(INFO_HASH)]
+        assert holders and all(node.stored_peers(INFO_HASH) == [('127.0.0.1', 7000)] for node in holders)
+
+        assert await nodes[9].get_peers(INFO_HASH) == {('127.0.0.1', 7000)}
+
+
+@pytest.mark.asyncio
+async def test_bad_token_and_malformed_packets(monkeypatch):
+    monkeypatch.setattr(configuration, 'DHT_QUERY_TIMEOUT', .2)
+    async with dht_swarm(2) as (first, second):
+        address = ('127.0.0.1', first.port)
+        with pytest.raises(Exception, match='Bad token'):
+            await second.query(address, b'announce_peer', {b'info_hash': INFO_HASH, b'port': 7000,
+                                                          b'token': b'wrong'})
+        assert not first.stored_peers(INFO_HASH)
+
+        second.transport.sendto(b'garbage', address)
+        second.transport.sendto(bencode.encode({b't': b'aa', b'y': b'q', b'q': b'ping'}), address)
+        assert (await second.query(address, b'ping', {}))[b'id'] == first.id
+
+        with pytest.raises(asyncio.TimeoutError):
+            await second.query(('127.0.0.1', 9), b'ping', {})
+
+
+@pytest.mark.asyncio
+async def test_routing_table_persists(tmp_path):
+    async with dht_swarm(4) as nodes:
+        nodes[0].path = tmp_path / 'dht' / 'state.pickle'
+        node_ids = {node.id for node in nodes[1:]}
+
+    restored = DhtNode(path=nodes[0].path, bootstrap_nodes=[])
+    restored.load()
+    assert restored.id == nodes[0].id
+    assert {node.id for node in restored.table.nodes()} == node_ids
+
+
+@pytest.mark.asyncio
+async def test_dht_replaces_dead_trackers(monkeypatch):
+    torrent_data = MagicMock(torrent_name='test', info_hash=INFO_HASH, total_segments=8, trackers=[])
+    async with dht_swarm(6) as nodes:
+        await nodes[1].announce(INFO_HASH, 7000)
+        peer_store = PeerStore(INFO_HASH, 8)
+        manager = TrackerManager(torrent_data, AsyncMock(), 6881, use_http=False, peer_store=peer_store,
+                                 dht=nodes[4])
+        dead_tracker = AsyncMock()
+        dead_tracker.make_request = AsyncMock(side_effect=ConnectionError)
+        manager.tracker_clients.insert(0, dead_tracker)
+
+        async with manager:
+            await asyncio.wait_for(manager._peers_found.wait(), 5)
+            assert ('127.0.0.1', 7000) in peer_store
+            assert dead_tracker in manager._announce_timers
+
+        assert peer_store.candidates[('127.0.0.1', 7000)].source == 'dht'
+
+
+@pytest.mark.asyncio
+async def test_dht_without_nodes_is_a_bad_tracker(monkeypatch):
+    monkeypatch.setattr(configuration, 'DHT_QUERY_TIMEOUT', .1)
+    node = await DhtNode.create('127.0.0.1', timers=MagicMock(), bootstrap_nodes=[('127.0.0.1', 9)])
+    try:
+        with pytest.raises(ConnectionError):
+            await DhtTracker(node, INFO_HASH, 6881).make_request(None)
+    finally:
+        node.close()
@@ -0,0 +1,79 @@
+import gc
+import pytest
+from unittest.mock import MagicMock
+from event_bus import Event
+
+
+class Listener:
+    def __init__(self):
+        self.received = []
+
+    def on_event(self, *args):
+        self.received.append(args)
+
+
+@pytest.fixture
+def event():
+    return Event()
+
+
+class TestEvent:
+    def test_emit(self, event):
+        listener = Listener()
+        callback = MagicMock()
+        event.subscribe(listener.on_event)
+        event.subscribe(callback)
+
+        event.emit(1, 'peer')
+
+        assert listener.received == [(1, 'peer')]
+        callback.assert_called_once_with(1, 'peer')
+
+    def test_subscribe_twice(self, event):
+        listener = Listener()
+        event.subscribe(listener.on_event)
+        event.subscribe(listener.on_event)
+
+        event.emit()
+
+        assert len(listener.received) == 1
+        assert len(event) == 1
+
+    def test_unsubscribe(self, event):
+        listener = Listener()
+        other = Listener()
+        event.subscribe(listener.on_event)
+        event.subscribe(other.on_event)
+
+        event.unsubscribe(listener.on_event)
+        event.emit()
+
+        assert listener.on_event not in event
+        assert listener.received == []
+        assert other.received == [()]
+
+    def test_dead_listener_is_dropped(self, event):
+        listener = Listener()
+        event.subscribe(listener.on_event)
+        del listener
+        gc.collect()
+
+        assert len(event._listeners) == 0
+        event.emit()
+
+    def test_unsubscribe_during_emit(self, event):
+        second = MagicMock()
+        first = MagicMock(side_effect=lambda: event.unsubscribe(second))
+        event.subscribe(first)
+        event.subscribe(second)
+
+        event.emit()
+        event.emit()
+
+        assert first.call_count == 2
+        assert second.call_count == 1
+
+    def test_clear(self, event):
+        event.subscribe(MagicMock())
+        event.clear()
+        assert len(event) == 0
@@ -0,0 +1,13 @@
+from fast_extension import allowed_fast_set
+
+
+def test_allowed_fast_set_matches_bep_6():
+    info_hash = b'\xaa' * 20
+    assert allowed_fast_set('80.4.4.200', info_hash, 1313, 7) == [1059, 431, 808, 1217, 287, 376, 1188]
+    assert allowed_fast_set('80.4.4.200', info_hash, 1313, 9) == [1059, 431, 808, 1217, 287, 376, 1188, 353, 508]
+
+
+def test_allowed_fast_set_is_per_subnet_and_bounded():
+    info_hash = b'\xaa' * 20
+    assert allowed_fast_set('80.4.4.1', info_hash, 1313, 7) == allowed_fast_set('80.4.4.200', info_hash, 1313, 7)
+    assert sorted(allowed_fast_set('80.4.4.200', info_hash, 5, 10)) == [0, 1, 2, 3, 4]
@@ -166,6 +166,15 @@ class TestFileWriter:
             mock_file.read.assert_awaited_once_with(0, 1024)
             assert result == b'data'
 
+    @pytest.mark.asyncio
+    async def test_read_range_across_files(self, file_writer):
+        data = bytes(range(256)) * 12
+        with file_writer:
+            await file_writer.write_segment(0, data)
+            assert await file_writer.read_range(0, 1000, 100) == data[1000:1100]
+            assert await file_writer.read_range(0, 2000, 16) == data[2000:2016]
+            assert await file_writer.read_range(0, 0, 16) == data[:16]
+
     @pytest.mark.asyncio
     async def test_check_segment_download(self, file_writer, monkeypatch):
         with monkeypatch.context() as m:
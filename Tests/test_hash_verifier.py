@@ -0,0 +1,99 @@
+import asyncio
+import hashlib
+import pytest
+from unittest.mock import MagicMock
+from hash_verifier import HashVerifier
+from piece_buffer import PieceBuffer
+
+
+@pytest.fixture
+def data():
+    return bytes(range(256)) * 64
+
+
+@pytest.fixture
+def verifier():
+    verifier = HashVerifier(max_workers=2, max_pending=2)
+    yield verifier
+    verifier.close()
+
+
+def make_piece(data, inline_hash_limit=0):
+    piece = PieceBuffer(len(data), block_length=1024, inline_hash_limit=inline_hash_limit)
+    for offset in reversed(range(0, len(data), 1024)):
+        piece.write(offset, data[offset:offset + 1024])
+    return piece
+
+
+class TestHashVerifier:
+    @pytest.mark.asyncio
+    async def test_verify_data(self, verifier, data):
+        assert await verifier.verify(data, hashlib.sha1(data).digest())
+        assert not await verifier.verify(data, b'\x00' * 20)
+        assert verifier.verified_pieces == 1
+        assert verifier.failed_pieces == 1
+        assert verifier.verified_bytes == len(data)
+        assert verifier.pending == 0
+
+    @pytest.mark.asyncio
+    async def test_verify_piece_off_loop(self, verifier, data):
+        piece = make_piece(data)
+        assert piece.hashed_length == 0
+        assert await verifier.verify_piece(piece, hashlib.sha1(data).digest())
+        assert piece.hashed_length == len(data)
+        assert verifier.throughput > 0
+
+    @pytest.mark.asyncio
+    async def test_verify_hashed_piece_inline(self, verifier, data):
+        piece = make_piece(data, inline_hash_limit=len(data))
+        verifier._get_executor = MagicMock()
+        assert await verifier.verify_piece(piece, hashlib.sha1(data).digest())
+        verifier._get_executor.assert_not_called()
+
+    @pytest.mark.asyncio
+    async def test_incomplete_piece(self, verifier, data):
+        piece = PieceBuffer(len(data), block_length=1024)
+        assert not await verifier.verify_piece(piece, hashlib.sha1(data).digest())
+
+    @pytest.mark.asyncio
+    async def test_backpressure(self, verifier, data):
+        capacity_listener = MagicMock()
+        verifier.capacity_event.subscribe(capacity_listener)
+
+        tasks = [asyncio.create_task(verifier.verify(data, hashlib.sha1(data).digest())) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert verifier.pending == 3
+        assert not verifier.has_capacity
+
+        assert all(await asyncio.gather(*tasks))
+        assert verifier.has_capacity
+        assert capacity_listener.call_count == 3
+        assert verifier.max_latency >= verifier.average_latency > 0
+
+    @pytest.mark.asyncio
+    async def test_block_digests_are_accounted(self, verifier, data):
+        capacity_listener = MagicMock()
+        verifier.capacity_event.subscribe(capacity_listener)
+
+        tasks = [asyncio.create_task(verifier.block_digests(make_piece(data))) for _ in range(3)]
+        await asyncio.sleep(0)
+        assert verifier.pending == 3
+        assert not verifier.has_capacity
+
+        for digests in await asyncio.gather(*tasks):
+            assert digests == [hashlib.sha1(data[offset:offset + 1024]).digest()
+                               for offset in range(0, len(data), 1024)]
+        assert verifier.pending == 0
+        assert capacity_listener.call_count == 3
+        assert verifier.rehashed_pieces == 3
+        assert verifier.rehashed_bytes == 3 * len(data)
+        assert verifier.throughput > 0
+        assert verifier.max_latency >= verifier.average_latency > 0
+
+    @pytest.mark.asyncio
+    async def test_process_pool(self, data):
+        verifier = HashVerifier(max_workers=1, use_processes=True)
+        try:
+            assert await verifier.verify_piece(make_piece(data), hashlib.sha1(data).digest())
+        finally:
+            verifier.close()
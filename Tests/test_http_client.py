@@ -0,0 +1,135 @@
+import asyncio
+import gzip
+import socket
+import bencode
+import pytest
+from contextlib import asynccontextmanager
+from struct import pack
+from unittest.mock import MagicMock
+from aiohttp import web
+from http_client import HttpClient, ResponseTooLarge
+from tracker_client import HttpTrackerClient, TrackerEvent
+
+
+@asynccontextmanager
+async def http_server(routes):
+    connections = set()
+
+    @web.middleware
+    async def track_connections(request, handler):
+        connections.add(request.transport.get_extra_info('peername'))
+        return await handler(request)
+
+    app = web.Application(middlewares=[track_connections])
+    for path, handler in routes.items():
+        app.router.add_get(path, handler)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        yield f'http://127.0.0.1:{port}', connections
+    finally:
+        await runner.cleanup()
+
+
+async def hello(request):
+    return web.Response(body=b'hello')
+
+
+async def big(request):
+    return web.Response(body=b'x' * 4096)
+
+
+async def chunked(request):
+    response = web.StreamResponse()
+    await response.prepare(request)
+    for _ in range(4):
+        await response.write(b'x' * 1024)
+    await response.write_eof()
+    return response
+
+
+async def compressed(request):
+    assert 'gzip' in request.headers['Accept-Encoding']
+    return web.Response(body=gzip.compress(b'hello' * 100), headers={'Content-Encoding': 'gzip'})
+
+
+async def slow(request):
+    await asyncio.sleep(1)
+    return web.Response(body=b'late')
+
+
+async def announce(request):
+    assert request.query['event'] == 'started'
+    peers = socket.inet_aton('10.0.0.1') + pack('!H', 6881)
+    return web.Response(body=bencode.encode({'interval': 1800, 'peers': peers}))
+
+
+ROUTES = {'/hello': hello, '/big': big, '/chunked': chunked, '/gzip': compressed, '/announce': announce,
+          '/slow': slow}
+
+
+class TestHttpClient:
+    @pytest.mark.asyncio
+    async def test_connections_are_reused(self):
+        client = HttpClient()
+        async with http_server(ROUTES) as (url, connections):
+            for _ in range(5):
+                assert await client.get(url + '/hello') == (200, b'hello')
+            await client.close()
+        assert len(connections) == 1
+
+    @pytest.mark.asyncio
+    async def test_response_size_is_limited(self):
+        client = HttpClient(max_response_size=1024)
+        async with http_server(ROUTES) as (url, _):
+            with pytest.raises(ResponseTooLarge):
+                await client.get(url + '/big')
+            with pytest.raises(ResponseTooLarge):
+                await client.get(url + '/chunked')
+            assert await client.get(url + '/hello') == (200, b'hello')
+            await client.close()
+
+    @pytest.mark.asyncio
+    async def test_gzip(self):
+        client = HttpClient()
+        async with http_server(ROUTES) as (url, _):
+            assert await client.get(url + '/gzip') == (200, b'hello' * 100)
+            await client.close()
+
+    @pytest.mark.asyncio
+    async def test_session_timeout(self):
+        client = HttpClient(timeout=0.1)
+        async with http_server(ROUTES) as (url, _):
+            with pytest.raises(asyncio.TimeoutError):
+                await client.get(url + '/slow')
+            assert await client.get(url + '/slow', timeout=2) == (200, b'late')
+            await client.close()
+
+    @pytest.mark.asyncio
+    async def test_latency_per_url(self):
+        client = HttpClient()
+        async with http_server(ROUTES) as (url, _):
+            await client.get(url + '/hello', 'a=1')
+            await client.get(url + '/gzip')
+            await client.close()
+        assert set(client.latency) == {url + '/hello', url + '/gzip'}
+        assert all(latency > 0 for latency in client.latency.values())
+
+    @pytest.mark.asyncio
+    async def test_trackers_share_client(self):
+        client = HttpClient()
+        statistics = MagicMock(downloaded=0, uploaded=0, left=100)
+        async with http_server(ROUTES) as (url, connections):
+            trackers = [HttpTrackerClient(url + '/announce', b'\x01' * 20, b'\x02' * 20, 6881, statistics,
+                                          http_client=client) for _ in range(3)]
+            for tracker in trackers:
+                await tracker.make_request(TrackerEvent.STARTED)
+                assert tracker.new_peers.get_nowait() == ('10.0.0.1', 6881)
+                assert tracker.request_interval == 1800
+            assert trackers[0].latency is not None
+            assert not client.session.closed
+            await client.close()
+        assert len(connections) == 1
@@ -0,0 +1,77 @@
+import asyncio
+import socket
+import pytest
+import configuration
+from unittest.mock import MagicMock
+from local_discovery import LocalServiceDiscovery, LocalPeers, make_announce, parse_announce
+from tracker_client import TrackerEvent
+
+INFO_HASH = bytes(range(20))
+
+
+def free_udp_port():
+    with socket.socket(socket.AF_INET, socket.SOCK_DGRAM) as sock:
+        sock.bind(('', 0))
+        return sock.getsockname()[1]
+
+
+def test_announce_format():
+    message = make_announce(6881, [INFO_HASH], 'abc')
+    assert message == (b'BT-SEARCH * HTTP/1.1\r\nHost: 239.192.152.143:6771\r\nPort: 6881\r\n'
+                       b'Infohash: 000102030405060708090a0b0c0d0e0f10111213\r\ncookie: abc\r\n\r\n\r\n')
+    assert parse_announce(message) == (6881, [INFO_HASH], 'abc')
+
+
+def test_malformed_announces_are_ignored():
+    assert parse_announce(b'\xff\xfe') is None
+    assert parse_announce(b'GET / HTTP/1.1\r\nPort: 6881\r\n\r\n') is None
+    assert parse_announce(b'BT-SEARCH * HTTP/1.1\r\nPort: 0\r\nInfohash: ' + INFO_HASH.hex().encode()) is None
+    assert parse_announce(b'BT-SEARCH * HTTP/1.1\r\nport: 51413\r\ninfohash: zz\r\n'
+                          b'INFOHASH: ' + INFO_HASH.hex().upper().encode() + b'\r\n\r\n') == (51413, [INFO_HASH], None)
+
+
+def test_announces_are_rate_limited_per_torrent():
+    lsd = LocalServiceDiscovery()
+    lsd.transport = MagicMock()
+
+    assert lsd.announce(INFO_HASH, 6881)
+    assert not lsd.announce(INFO_HASH, 6881)
+    assert lsd.announce(b'\x01' * 20, 6881)
+    assert lsd.transport.sendto.call_count == 2
+
+    lsd._announced[INFO_HASH] -= configuration.LSD_MIN_ANNOUNCE_INTERVAL
+    assert lsd.announce(INFO_HASH, 6881)
+
+
+def test_own_announces_are_skipped():
+    lsd = LocalServiceDiscovery()
+    listener = MagicMock()
+    lsd.peer_event.subscribe(listener)
+
+    lsd.datagram_received(make_announce(6881, [INFO_HASH], lsd.cookie), ('192.168.1.2', 6771))
+    listener.assert_not_called()
+
+    lsd.datagram_received(make_announce(6881, [INFO_HASH], 'other'), ('192.168.1.3', 6771))
+    listener.assert_called_once_with(INFO_HASH, ('192.168.1.3', 6881))
+
+
+@pytest.mark.asyncio
+async def test_local_peers_find_each_other_over_multicast():
+    port = free_udp_port()
+    try:
+        first = await LocalServiceDiscovery.create(port=port)
+        second = await LocalServiceDiscovery.create(port=port)
+    except OSError as e:
+        pytest.skip(f'multicast is unavailable: {e}')
+
+    try:
+        peers = LocalPeers(second, INFO_HASH, 7000)
+        other_torrent = LocalPeers(second, b'\x01' * 20, 7000)
+        await LocalPeers(first, INFO_HASH, 6881).make_request(TrackerEvent.STARTED)
+
+        address = await asyncio.wait_for(peers.new_peers.get(), 2)
+        assert address[1] == 6881
+        assert other_torrent.new_peers.empty()
+    finally:
+        first.close()
+        second.close()
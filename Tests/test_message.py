@@ -81,13 +81,23 @@ def block_len(block):
 
 class TestMessages:
     def test_handshake_encode(self, info_hash, peer_id):
-        expected = pack(f'!B19s8s20s20s', 19, b'BitTorrent protocol', b'\x00' * 8, info_hash, peer_id)
+        expected = pack(f'!B19s8s20s20s', 19, b'BitTorrent protocol', b'\x00' * 5 + b'\x10\x00\x04', info_hash, peer_id)
         assert expected == Message.HandshakeMessage(info_hash, peer_id).encode()
 
     def test_handshake_decode(self, info_hash, peer_id):
         data = pack(f'!B19s8s20s20s', 19, b'BitTorrent protocol', b'\x00' * 8, info_hash, peer_id)
         expected = Message.HandshakeMessage.decode(data)
         assert expected.info_hash == info_hash and expected.peer_id == peer_id
+        assert not expected.supports_fast
+        assert not expected.supports_extensions
+
+    def test_handshake_fast_extension_bit(self, info_hash, peer_id):
+        decoded = Message.HandshakeMessage.decode(Message.HandshakeMessage(info_hash, peer_id).encode())
+        assert decoded.supports_fast
+        assert decoded.supports_extensions
+
+        reserved = Message.HandshakeMessage.make_reserved(extensions=False)
+        assert not Message.HandshakeMessage(info_hash, peer_id, reserved).supports_extensions
 
     def test_interested_encode(self):
         expected = pack('!IB', 1, 2)
@@ -216,4 +226,25 @@ class TestMessages:
         data = pack('!IB', 1, 2)
         with caplog.at_level(logging.ERROR):
             Message.NotInterestedMessage.decode(data)
-            assert 'При запросе на отсутсвие интереса был получен некорректный индентификатор: 2' in caplog.text
\ No newline at end of file
+            assert 'При запросе на отсутсвие интереса был получен некорректный индентификатор: 2' in caplog.text
+
+    def test_fast_extension_messages_round_trip(self):
+        assert Message.HaveAllMessage().encode() == pack('!IB', 1, 14)
+        assert Message.HaveNoneMessage().encode() == pack('!IB', 1, 15)
+        assert isinstance(Message.HaveAllMessage.decode(pack('!IB', 1, 14)), Message.HaveAllMessage)
+        assert isinstance(Message.HaveNoneMessage.decode(pack('!IB', 1, 15)), Message.HaveNoneMessage)
+
+        assert Message.SuggestPieceMessage(7).encode() == pack('!IBI', 5, 13, 7)
+        assert Message.SuggestPieceMessage.decode(pack('!IBI', 5, 13, 7)).piece_index == 7
+        assert Message.AllowedFastMessage(9).encode() == pack('!IBI', 5, 17, 9)
+        assert Message.AllowedFastMessage.decode(pack('!IBI', 5, 17, 9)).piece_index == 9
+
+        reject = Message.RejectRequestMessage.decode(Message.RejectRequestMessage(1, 16384, 16384).encode())
+        assert (reject.index, reject.byte_offset, reject.block_len) == (1, 16384, 16384)
+
+    def test_extended_message(self):
+        message = Message.ExtendedMessage(1, b'd5:addedi0ee')
+        assert message.encode() == pack('!IBB', 14, 20, 1) + b'd5:addedi0ee'
+
+        decoded = Message.ExtendedMessage.decode(message.encode())
+        assert (decoded.extended_id, decoded.payload) == (1, b'd5:addedi0ee')
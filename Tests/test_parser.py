@@ -82,10 +82,27 @@ class TestTorrentData:
         assert torrent.total_segments == ceil(49152 / 16384)
         assert torrent.files == [{'length': 20000, 'path': ['file1']}, {'length': 29152, 'path': ['file2']}]
 
-    def test_get_announce_list(self, mock_open_bencode, single_file_torrent_data):
+    def test_get_announce_tiers(self, mock_open_bencode, single_file_torrent_data):
         torrent = TorrentData("mocked_file.torrent")
-        assert torrent._get_announce_list(single_file_torrent_data) == ['http://tracker.example.com/announce']
+        assert torrent.tiers == [['http://tracker.example.com/announce']]
+
+        data = {'announce-list': [['http://a', 'http://b'], [], ['http://c']]}
+        tiers = torrent._get_announce_tiers(data)
+        assert len(tiers) == 2
+        assert sorted(tiers[0]) == ['http://a', 'http://b'] and tiers[1] == ['http://c']
+
+    def test_trackers_follow_tiers(self, mock_open_bencode, single_file_torrent_data):
+        single_file_torrent_data['announce-list'] = [[f'http://{i}' for i in range(10)], ['http://last']]
+        torrent = TorrentData("mocked_file.torrent")
+        assert torrent.trackers == [url for tier in torrent.tiers for url in tier]
 
     def test_get_files_list(self, mock_open_bencode, single_file_torrent_data):
         torrent = TorrentData("mocked_file.torrent")
-        assert torrent._get_files_list(single_file_torrent_data['info']) == [{'length': 49152, 'path': ['testfile']}]
\ No newline at end of file
+        assert torrent._get_files_list(single_file_torrent_data['info']) == [{'length': 49152, 'path': ['testfile']}]
+
+    def test_get_url_list(self, mock_open_bencode, single_file_torrent_data):
+        torrent = TorrentData("mocked_file.torrent")
+        assert torrent.url_list == []
+        assert torrent._get_url_list({'url-list': 'http://mirror.example.com/'}) == ['http://mirror.example.com/']
+        assert torrent._get_url_list({'url-list': [b'http://a.example.com/', '', 'http://b.example.com/']}) == [
+            'http://a.example.com/', 'http://b.example.com/']
@@ -1,11 +1,11 @@
 import asyncio
+import bencode
 import pytest
 import bitstring
 import Message
 import logging
-from unittest.mock import AsyncMock
+from unittest.mock import AsyncMock, MagicMock
 from struct import pack
-from pubsub import pub
 from peer_connection import PeerConnection
 
 
@@ -52,9 +52,9 @@ class TestPeerClass:
 
     def test_analyze_message_with_incorrect_message_index(self, caplog):
         with caplog.at_level(logging.ERROR):
-            result = PeerConnection.analyze_message(pack('!IB', 1, 20))
+            result = PeerConnection.analyze_message(pack('!IB', 1, 21))
             assert result is None
-            assert 'Некорректное сообщение, указан несуществующий id_message: 20' in caplog.text
+            assert 'Некорректное сообщение, указан несуществующий id_message: 21' in caplog.text
 
     @pytest.mark.asyncio
     async def test_connect_success(self, monkeypatch, info_hash):
@@ -141,11 +141,16 @@ class TestPeerClass:
         assert peer.choked is False
 
         mock_send = AsyncMock()
+        listener = MagicMock()
+        peer.interest_event.subscribe(listener)
         with monkeypatch.context() as m:
             peer.choked = True
             m.setattr(peer, 'send_message_to_peer', mock_send)
             peer.peer_interested = True
+            peer.peer_interested = True
             assert peer.peer_interested is True
+        mock_send.assert_not_called()
+        listener.assert_called_once_with(peer)
 
     def test_available_pieces(self, peer):
         peer.bitfield = bitstring.BitArray(bin='10')
@@ -155,19 +160,15 @@ class TestPeerClass:
     @pytest.mark.asyncio
     async def test_handle_got_piece(self, monkeypatch, peer):
         with monkeypatch.context() as m:
-            mock_pubsub = AsyncMock()
-            m.setattr(pub, 'sendMessage', mock_pubsub)
+            mock_listener = MagicMock()
+            peer.have_message_event.subscribe(mock_listener)
             mock_send = AsyncMock()
             m.setattr(peer, 'send_message_to_peer', mock_send)
             message = Message.HaveMessage(1)
             await peer.handle_got_piece(message)
         assert peer.bitfield[1] is True
         assert peer.interested is True
-        mock_pubsub.assert_called_once_with(
-            peer.have_message_event,
-            index=1,
-            peer=peer
-        )
+        mock_listener.assert_called_once_with(peer, 1)
 
         assert mock_send.call_count == 1
         assert isinstance(mock_send.call_args[0][0], Message.InterestedMessage)
@@ -176,49 +177,41 @@ class TestPeerClass:
     async def test_handle_available_piece(self, monkeypatch, peer):
         peer.bitfield = bitstring.BitArray(bin='00')
         with monkeypatch.context() as m:
-            mock_pubsub = AsyncMock()
-            m.setattr(pub, 'sendMessage', mock_pubsub)
+            mock_listener = MagicMock()
+            peer.bitfield_update_event.subscribe(mock_listener)
             mock_send = AsyncMock()
             m.setattr(peer, 'send_message_to_peer', mock_send)
             message = Message.PeerSegmentsMessage(bitstring.BitArray(bin='10'))
             await peer.handle_available_piece(message)
         assert peer.interested is True
         assert peer.bitfield == bitstring.BitArray(bin='10')
-        mock_pubsub.assert_called_once_with(
-            peer.bitfield_update_event,
-            peer=peer
-        )
+        mock_listener.assert_called_once_with(peer)
         assert mock_send.call_count == 1
         assert isinstance(mock_send.call_args[0][0], Message.InterestedMessage)
 
-    def test_handle_send_piece(self, peer, monkeypatch):
-        mock_pubsub = AsyncMock()
-        with monkeypatch.context() as m:
-            m.setattr(pub, 'sendMessage', mock_pubsub)
-            message = Message.SendPieceMessage(1, 1, b'Hi')
-            peer.handle_piece_receive(message)
-        mock_pubsub.assert_called_once_with(
-            peer.receive_event,
-            request=message,
-            peer=peer
-        )
+    def test_handle_send_piece(self, peer):
+        mock_listener = MagicMock()
+        peer.receive_event.subscribe(mock_listener)
+        message = Message.SendPieceMessage(1, 1, b'Hi')
+        peer.handle_piece_receive(message)
+        mock_listener.assert_called_once_with(message, peer)
+        assert peer.downloaded == 2
 
     @pytest.mark.asyncio
     async def test_handle_request(self, monkeypatch, peer):
-        peer.peer_choked = False
-        mock_pubsub = AsyncMock()
+        mock_listener = MagicMock()
+        peer.request_event.subscribe(mock_listener)
         with monkeypatch.context() as m:
-            m.setattr(pub, 'sendMessage', mock_pubsub)
             mock_send = AsyncMock()
             m.setattr(peer, 'send_message_to_peer', mock_send)
             peer.peer_interested = True
             message = Message.RequestsMessage(5, 1, 10)
             peer.handle_piece_request(message)
-        mock_pubsub.assert_called_once_with(
-            peer.request_event,
-            request=message,
-            peer=peer
-        )
+            mock_listener.assert_not_called()
+
+            peer.choked = False
+            peer.handle_piece_request(message)
+        mock_listener.assert_called_once_with(message, peer)
 
     def test_handle_handshake_buffer(self, peer, info_hash, peer_id):
         peer.buffer = Message.HandshakeMessage(info_hash, peer_id).encode()
@@ -364,4 +357,105 @@ class TestPeerClass:
             await peer.close()
             assert peer.is_active is False
             assert peer.reader is None
-            assert mock_writer_close.close.call_count == 1
\ No newline at end of file
+            assert mock_writer_close.close.call_count == 1
+    @pytest.mark.asyncio
+    async def test_close_clears_events(self, peer):
+        listener = MagicMock()
+        peer.receive_event.subscribe(listener)
+        peer.have_message_event.subscribe(listener)
+
+        await peer.close()
+
+        assert len(peer.receive_event) == 0
+        assert len(peer.have_message_event) == 0
+
+    def test_unchoke_event(self, peer):
+        listener = MagicMock()
+        peer.unchoke_event.subscribe(listener)
+        peer.peer_choked = False
+        peer.peer_choked = False
+        listener.assert_called_once_with(peer)
+
+    @pytest.mark.asyncio
+    async def test_read_socket_eof_disconnects(self, monkeypatch, peer):
+        listener = MagicMock()
+        peer.disconnect_event.subscribe(listener)
+        peer.is_active = True
+        reader = AsyncMock()
+        reader.read.return_value = b''
+        with monkeypatch.context() as m:
+            m.setattr(peer, 'reader', reader)
+            await peer.read_socket()
+        assert peer.is_active is False
+        listener.assert_called_once_with(peer)
+
+    @pytest.mark.asyncio
+    async def test_fast_extension_messages(self, monkeypatch, peer):
+        monkeypatch.setattr(peer, 'send_message_to_peer', AsyncMock())
+        rejected, allowed = MagicMock(), MagicMock()
+        peer.reject_event.subscribe(rejected)
+        peer.allowed_fast_event.subscribe(allowed)
+
+        await peer.handle_message(Message.HaveAllMessage())
+        assert not peer.bitfield.any(True)
+
+        peer.on_handshake(Message.HandshakeMessage(peer.info_hash))
+        assert peer.supports_fast
+        await peer.handle_message(Message.HaveAllMessage())
+        assert peer.bitfield[:2] == bitstring.BitArray(bin='11')
+        assert not peer.bitfield[2:].any(True)
+        assert peer.interested
+
+        reject = Message.RejectRequestMessage(1, 0, 16)
+        await peer.handle_message(reject)
+        rejected.assert_called_once_with(reject, peer)
+
+        assert not peer.can_request(1)
+        await peer.handle_message(Message.AllowedFastMessage(1))
+        await peer.handle_message(Message.AllowedFastMessage(7))
+        allowed.assert_called_once_with(peer, 1)
+        assert peer.can_request(1) and not peer.can_request(0)
+
+    @pytest.mark.asyncio
+    async def test_choked_request_is_rejected_unless_allowed_fast(self, monkeypatch, peer):
+        mock_send = AsyncMock()
+        monkeypatch.setattr(peer, 'send_message_to_peer', mock_send)
+        listener = MagicMock()
+        peer.request_event.subscribe(listener)
+        peer.on_handshake(Message.HandshakeMessage(peer.info_hash))
+        peer.granted_fast.add(1)
+
+        peer.handle_piece_request(Message.RequestsMessage(0, 0, 16))
+        peer.handle_piece_request(Message.RequestsMessage(1, 0, 16))
+        await asyncio.sleep(0)
+
+        assert isinstance(mock_send.call_args.args[0], Message.RejectRequestMessage)
+        assert mock_send.call_args.args[0].index == 0
+        assert listener.call_args.args[0].index == 1
+
+    @pytest.mark.asyncio
+    async def test_extended_handshake(self, monkeypatch, peer):
+        mock_send = AsyncMock(return_value=True)
+        monkeypatch.setattr(peer, 'send_message_to_peer', mock_send)
+        listener = MagicMock()
+        peer.extended_message_event.subscribe(listener)
+        peer.on_handshake(Message.HandshakeMessage(peer.info_hash))
+        assert peer.supports_extensions
+
+        await peer.send_extended_handshake(6889)
+        sent = mock_send.call_args.args[0]
+        assert sent.extended_id == 0
+        assert bencode.decode(sent.payload)['m'] == {'ut_pex': 1}
+        assert bencode.decode(sent.payload)['p'] == 6889
+
+        assert not await peer.send_extended_message('ut_pex', b'de')
+        handshake = bencode.encode({'m': {'ut_pex': 7, 'ut_metadata': 0}, 'p': 51413, 'v': 'Other 2.0'})
+        await peer.handle_message(Message.ExtendedMessage(0, handshake))
+        assert peer.extensions == {'ut_pex': 7}
+        assert peer.listen_port == 51413
+
+        assert await peer.send_extended_message('ut_pex', b'de')
+        assert mock_send.call_args.args[0].extended_id == 7
+
+        await peer.handle_message(Message.ExtendedMessage(1, b'de'))
+        listener.assert_called_once_with(peer, 'ut_pex', b'de')
@@ -0,0 +1,151 @@
+import asyncio
+import pytest
+import configuration
+import Message
+from contextlib import asynccontextmanager
+from unittest.mock import MagicMock, AsyncMock
+from peer_connection import PeerConnection
+from peer_connector import PeerConnector
+
+INFO_HASH = b'\x01' * 20
+
+
+@asynccontextmanager
+async def remote_peer(info_hash=INFO_HASH, respond=True):
+    async def on_connection(reader, writer):
+        await reader.readexactly(68)
+        if respond:
+            writer.write(Message.HandshakeMessage(info_hash, b'\x02' * 20).encode())
+            await writer.drain()
+        await reader.read()
+        writer.close()
+
+    server = await asyncio.start_server(on_connection, '127.0.0.1', 0)
+    try:
+        yield server.sockets[0].getsockname()[1]
+    finally:
+        server.close()
+
+
+def make_connector(**kwargs):
+    timers = MagicMock()
+    connector = PeerConnector(timers, **kwargs)
+    connected, failed = [], []
+    connector.connected_event.subscribe(connected.append)
+    connector.failed_event.subscribe(lambda peer, retrying: failed.append(peer))
+    return connector, connected, failed
+
+
+async def settle(connector):
+    while connector._tasks:
+        await asyncio.gather(*connector._tasks)
+
+
+@pytest.mark.asyncio
+async def test_connects_and_validates_handshake():
+    connector, connected, failed = make_connector()
+    async with remote_peer() as port:
+        peer = PeerConnection('127.0.0.1', 8, INFO_HASH, port)
+        connector.connect(peer)
+        assert connector.pending == 1
+        await settle(connector)
+
+        assert connected == [peer] and not failed
+        assert peer.handshake
+        assert connector.pending == 0
+        await peer.close()
+
+
+@pytest.mark.asyncio
+async def test_falls_back_to_tcp_after_utp_timeout(monkeypatch):
+    monkeypatch.setattr(configuration, 'CONNECT_TIMEOUT', .1)
+
+    async def utp_timeout(host, port):
+        await asyncio.sleep(.2)
+        raise asyncio.TimeoutError
+
+    connector, connected, failed = make_connector()
+    async with remote_peer() as port:
+        peer = PeerConnection('127.0.0.1', 8, INFO_HASH, port, transport=MagicMock(open_connection=utp_timeout))
+        connector.connect(peer)
+        await settle(connector)
+
+        assert connected == [peer] and not failed
+        await peer.close()
+
+
+@pytest.mark.asyncio
+async def test_wrong_info_hash_is_rejected_and_retried():
+    connector, connected, failed = make_connector()
+    async with remote_peer(info_hash=b'\x09' * 20) as port:
+        peer = PeerConnection('127.0.0.1', 8, INFO_HASH, port)
+        connector.connect(peer)
+        await settle(connector)
+
+    assert failed == [peer] and not connected
+    assert not peer.is_active
+    connector.timers.call_later.assert_called_once_with(configuration.CONNECT_RETRY_DELAY, connector.connect, peer)
+
+
+@pytest.mark.asyncio
+async def test_silent_peer_does_not_block_others(monkeypatch):
+    monkeypatch.setattr(configuration, 'HANDSHAKE_TIMEOUT', .2)
+    connector, connected, failed = make_connector()
+    async with remote_peer(respond=False) as silent_port, remote_peer() as good_port:
+        silent = [PeerConnection('127.0.0.1', 8, INFO_HASH, silent_port) for _ in range(5)]
+        good = PeerConnection('127.0.0.1', 8, INFO_HASH, good_port)
+        for peer in silent + [good]:
+            connector.connect(peer)
+
+        await asyncio.sleep(.1)
+        assert connected == [good]
+
+        await settle(connector)
+        assert failed == silent
+        await good.close()
+
+
+@pytest.mark.asyncio
+async def test_half_open_attempts_are_bounded():
+    connector, connected, failed = make_connector(max_half_open=2)
+    in_flight = []
+    release = asyncio.Event()
+
+    async def connect():
+        in_flight.append(1)
+        await release.wait()
+        return False
+
+    peers = []
+    for i in range(5):
+        peer = MagicMock(PeerConnection)
+        peer.ip, peer.port = f'10.0.0.{i}', 6881
+        peer.connect = connect
+        peers.append(peer)
+        connector.connect(peer)
+
+    await asyncio.sleep(0)
+    await asyncio.sleep(0)
+    assert len(in_flight) == 2
+    assert connector.pending == 5
+
+    release.set()
+    await settle(connector)
+    assert len(in_flight) == 5
+    assert failed == peers
+
+
+@pytest.mark.asyncio
+async def test_retry_backoff_is_exponential_and_limited():
+    connector, connected, failed = make_connector(max_attempts=3)
+    peer = MagicMock(PeerConnection)
+    peer.ip, peer.port = '10.0.0.1', 6881
+    peer.connect = AsyncMock(side_effect=OSError)
+
+    for _ in range(3):
+        connector.connect(peer)
+        await settle(connector)
+
+    delays = [call.args[0] for call in connector.timers.call_later.call_args_list]
+    assert delays == [configuration.CONNECT_RETRY_DELAY, 2 * configuration.CONNECT_RETRY_DELAY]
+    assert ('10.0.0.1', 6881) not in connector.failures
@@ -0,0 +1,96 @@
+import bencode
+import pytest
+from unittest.mock import MagicMock, AsyncMock
+from peer_connection import PeerConnection
+from peer_exchange import PeerExchange, encode_compact_peers, decode_compact_peers, CONNECTABLE_FLAG, SEED_FLAG
+from peer_store import PeerStore
+from requests_receiver import PeerReceiver
+
+INFO_HASH = b'\x01' * 20
+
+
+def make_peer(ip, port=6881, pex=True):
+    peer = PeerConnection(ip, 8, INFO_HASH, port)
+    peer.is_active = True
+    peer.send_message_to_peer = AsyncMock(return_value=True)
+    if pex:
+        peer.extensions['ut_pex'] = 3
+    return peer
+
+
+def sent_pex(peer):
+    messages = [call.args[0] for call in peer.send_message_to_peer.call_args_list]
+    assert all(message.extended_id == 3 for message in messages)
+    return [bencode.Bencode(encoding=None).decode(message.payload) for message in messages]
+
+
+@pytest.fixture
+def peers():
+    return []
+
+
+@pytest.fixture
+def pex(peers):
+    return PeerExchange(peers, PeerStore(INFO_HASH, 8, 6881), MagicMock(), max_peers=2)
+
+
+def test_compact_peers_round_trip():
+    addresses = [('10.0.0.1', 6881), ('192.168.1.20', 51413)]
+    assert encode_compact_peers(addresses) == b'\x0a\x00\x00\x01\x1a\xe1\xc0\xa8\x01\x14\xc8\xd5'
+    assert decode_compact_peers(encode_compact_peers(addresses) + b'\x01') == addresses
+
+
+@pytest.mark.asyncio
+async def test_updates_carry_only_the_difference(pex, peers):
+    first, second, seed = make_peer('10.0.0.1'), make_peer('10.0.0.2'), make_peer('10.0.0.3', pex=False)
+    seed.bitfield.set(True)
+    peers.extend([first, second, seed])
+
+    await pex.send_updates()
+
+    [message] = sent_pex(first)
+    assert decode_compact_peers(message[b'added']) == [('10.0.0.2', 6881), ('10.0.0.3', 6881)]
+    assert message[b'added.f'] == bytes([CONNECTABLE_FLAG, CONNECTABLE_FLAG | SEED_FLAG])
+    assert message[b'dropped'] == b''
+    seed.send_message_to_peer.assert_not_awaited()
+
+    peers.remove(second)
+    await pex.send_updates()
+    await pex.send_updates()
+
+    assert len(sent_pex(first)) == 2
+    assert decode_compact_peers(sent_pex(first)[1][b'dropped']) == [('10.0.0.2', 6881)]
+    assert sent_pex(first)[1][b'added'] == b''
+
+
+@pytest.mark.asyncio
+async def test_added_peers_are_limited_and_unknown_ports_skipped(pex, peers):
+    receiver = PeerReceiver(MagicMock(), ('10.0.0.9', 40000))
+    receiver.is_active = True
+    target = make_peer('10.0.0.1')
+    peers.extend([target, receiver] + [make_peer(f'10.0.1.{i}', pex=False) for i in range(3)])
+
+    await pex.send_updates()
+    assert decode_compact_peers(sent_pex(target)[0][b'added']) == [('10.0.1.0', 6881), ('10.0.1.1', 6881)]
+
+    receiver.listen_port = 6882
+    await pex.send_updates()
+    assert decode_compact_peers(sent_pex(target)[1][b'added']) == [('10.0.0.9', 6882), ('10.0.1.2', 6881)]
+    assert sent_pex(target)[1][b'added.f'] == bytes([0, CONNECTABLE_FLAG])
+
+
+def test_received_peers_go_to_the_store(pex):
+    sender = make_peer('10.0.0.1')
+    payload = bencode.encode({'added': encode_compact_peers([('10.0.0.5', 6881), ('10.0.0.6', 0)]),
+                              'added.f': b'\x10\x00'})
+
+    pex.on_message(sender, 'ut_pex', payload)
+    assert ('10.0.0.5', 6881) in pex.peer_store
+    assert len(pex.peer_store) == 1
+    assert pex.peer_store.candidates[('10.0.0.5', 6881)].source == 'pex'
+
+    pex.on_message(sender, 'ut_pex', bencode.encode({'added': encode_compact_peers([('10.0.0.7', 6881)])}))
+    assert ('10.0.0.7', 6881) not in pex.peer_store
+
+    pex.on_message(make_peer('10.0.0.2'), 'ut_pex', b'garbage')
+    assert len(pex.peer_store) == 1
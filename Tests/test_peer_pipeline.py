@@ -0,0 +1,47 @@
+import configuration
+from peer_pipeline import PeerPipeline
+
+
+class TestPeerPipeline:
+    def test_initial_values(self):
+        pipeline = PeerPipeline()
+        assert pipeline.depth == configuration.MIN_PIPELINE_DEPTH
+        assert pipeline.timeout == configuration.INITIAL_BLOCK_TIMEOUT
+
+    def test_timeout_follows_rtt(self):
+        pipeline = PeerPipeline()
+        for _ in range(50):
+            pipeline.on_block_received(configuration.BLOCK_LENGTH, 2, now=0)
+        assert abs(pipeline.srtt - 2) < 1e-6
+        assert configuration.MIN_BLOCK_TIMEOUT <= pipeline.timeout < 3
+
+    def test_timeout_backoff(self):
+        pipeline = PeerPipeline()
+        pipeline.on_block_received(configuration.BLOCK_LENGTH, 2, now=0)
+        timeout = pipeline.timeout
+        pipeline.on_timeout()
+        assert pipeline.timeout == min(timeout * 2, configuration.MAX_BLOCK_TIMEOUT)
+        pipeline.on_block_received(configuration.BLOCK_LENGTH, 2, now=1)
+        assert pipeline.timeout < timeout * 2
+
+    def test_depth_follows_bandwidth_delay_product(self):
+        pipeline = PeerPipeline()
+        rtt = 0.5
+        now = 0
+        for _ in range(100):
+            now += 0.1
+            pipeline.on_block_received(10 * configuration.BLOCK_LENGTH, rtt, now=now)
+
+        rate = 100 * configuration.BLOCK_LENGTH
+        assert abs(pipeline.rate - rate) / rate < 0.1
+        expected = rate * rtt * configuration.PIPELINE_BDP_FACTOR / configuration.BLOCK_LENGTH
+        assert abs(pipeline.depth - expected) / expected < 0.1
+
+    def test_depth_bounds(self):
+        pipeline = PeerPipeline()
+        pipeline.on_block_received(configuration.BLOCK_LENGTH, 0.001, now=0)
+        assert pipeline.depth >= configuration.MIN_PIPELINE_DEPTH
+
+        pipeline = PeerPipeline()
+        pipeline.on_block_received(10 ** 9, 10, now=100)
+        assert pipeline.depth == configuration.MAX_PIPELINE_DEPTH
@@ -0,0 +1,138 @@
+import asyncio
+import time
+import pytest
+import configuration
+from peer_store import PeerStore, canonical_priority, crc32c
+
+INFO_HASH = b'\x01' * 20
+
+
+@pytest.fixture
+def store(tmp_path):
+    return PeerStore(INFO_HASH, 8, 6881, path=tmp_path / 'peers' / 'torrent.peers')
+
+
+def test_crc32c():
+    assert crc32c(b'123456789') == 0xE3069283
+
+
+def test_canonical_priority_matches_bep_40():
+    assert canonical_priority(('123.213.32.10', 0), ('98.76.54.32', 0)) == 0xEC2D7224
+    assert canonical_priority(('123.213.32.10', 0), ('123.213.32.234', 0)) == 0x99568189
+    assert (canonical_priority(('123.213.32.10', 0), ('98.76.54.32', 0))
+            == canonical_priority(('98.76.54.32', 0), ('123.213.32.10', 0)))
+
+
+def test_sources_are_merged(store):
+    assert store.add('10.0.0.1', 6881, 'http://tracker')
+    assert not store.add('10.0.0.1', 6881, 'local')
+    assert store.add('10.0.0.1', 6882)
+
+    assert len(store) == 2
+    assert store.candidates[('10.0.0.1', 6881)].source == 'http://tracker'
+
+
+@pytest.mark.asyncio
+async def test_best_candidates_are_dispensed_first(store):
+    for i in range(1, 4):
+        store.add(f'10.0.0.{i}', 6881)
+    store.candidates[('10.0.0.1', 6881)].failures = 1
+    store.candidates[('10.0.0.3', 6881)].throughput = 1000
+
+    peers = [await store.get() for _ in range(3)]
+
+    assert [peer.ip for peer in peers] == ['10.0.0.3', '10.0.0.2', '10.0.0.1']
+    assert peers[0].info_hash == INFO_HASH
+    assert store.next_candidate() is None
+
+
+@pytest.mark.asyncio
+async def test_canonical_priority_orders_fresh_candidates(store):
+    store.set_own_ip('123.213.32.10')
+    store.add('98.76.54.32', 6881)
+    store.add('123.213.32.234', 6881)
+
+    assert (await store.get()).ip == '98.76.54.32'
+
+
+@pytest.mark.asyncio
+async def test_failed_candidate_backs_off(store, monkeypatch):
+    monkeypatch.setattr(configuration, 'CONNECT_RETRY_DELAY', .05)
+    store.add('10.0.0.1', 6881)
+    peer = await store.get()
+
+    store.on_connect_failed(peer, final=False)
+    assert store.next_candidate() is None
+
+    store.on_connect_failed(peer)
+    assert store.candidates[('10.0.0.1', 6881)].failures == 2
+    assert store.next_candidate() is None
+
+    retried = await asyncio.wait_for(store.get(), 1)
+    assert retried.ip == '10.0.0.1'
+
+
+@pytest.mark.asyncio
+async def test_get_waits_for_new_candidates(store):
+    getter = asyncio.create_task(store.get())
+    await asyncio.sleep(0)
+    assert not getter.done()
+
+    store.add('10.0.0.1', 6881)
+    assert (await asyncio.wait_for(getter, 1)).ip == '10.0.0.1'
+
+
+@pytest.mark.asyncio
+async def test_banned_and_disconnected_peers(store):
+    store.add('10.0.0.1', 6881)
+    store.add('10.0.0.2', 6881)
+    store.ban('10.0.0.1')
+
+    peer = await store.get()
+    assert peer.ip == '10.0.0.2'
+
+    store.on_connected(peer)
+    peer.downloaded = 10_000
+    store.on_disconnected(peer, retry_after=60)
+
+    candidate = store.candidates[('10.0.0.2', 6881)]
+    assert 0 < candidate.throughput <= 10_000
+    assert not candidate.in_use
+    assert store.next_candidate() is None
+
+
+def test_worst_candidate_is_evicted(tmp_path):
+    store = PeerStore(INFO_HASH, 8, max_candidates=2)
+    store.add('10.0.0.1', 6881)
+    store.add('10.0.0.2', 6881)
+    store.candidates[('10.0.0.1', 6881)].failures = 3
+
+    store.add('10.0.0.3', 6881)
+
+    assert set(store.candidates) == {('10.0.0.2', 6881), ('10.0.0.3', 6881)}
+
+
+def test_candidates_persist_across_sessions(store):
+    store.add('10.0.0.1', 6881)
+    store.add('10.0.0.2', 6881)
+    store.candidates[('10.0.0.1', 6881)].throughput = 500
+    store.candidates[('10.0.0.2', 6881)].last_seen = time.time() - configuration.PEER_CACHE_MAX_AGE - 1
+    store.save()
+
+    restored = PeerStore(INFO_HASH, 8, path=store.path)
+    restored.load()
+
+    assert set(restored.candidates) == {('10.0.0.1', 6881)}
+    candidate = restored.candidates[('10.0.0.1', 6881)]
+    assert candidate.throughput == 500
+    assert candidate.source == 'cache'
+
+
+def test_missing_or_corrupt_cache_is_ignored(store):
+    store.load()
+    assert not store
+
+    store.path.parent.mkdir(parents=True)
+    store.path.write_bytes(b'garbage')
+    store.load()
+    assert not store
@@ -0,0 +1,65 @@
+import hashlib
+import pytest
+from piece_buffer import PieceBuffer
+
+
+@pytest.fixture
+def data():
+    return bytes(range(256)) * 10
+
+
+@pytest.fixture
+def piece(data):
+    return PieceBuffer(len(data), block_length=1024)
+
+
+class TestPieceBuffer:
+    def test_in_order(self, piece, data):
+        for offset in range(0, len(data), 1024):
+            assert piece.write(offset, data[offset:offset + 1024])
+            assert piece.hashed_length == min(offset + 1024, len(data))
+        assert piece.is_complete
+        assert bytes(piece.data) == data
+        assert piece.digest() == hashlib.sha1(data).digest()
+        assert piece.verify(hashlib.sha1(data).digest())
+
+    def test_out_of_order(self, piece, data):
+        piece.write(2048, data[2048:])
+        assert piece.hashed_length == 0
+        piece.write(1024, data[1024:2048])
+        assert piece.hashed_length == 0
+        piece.write(0, data[:1024])
+        assert piece.hashed_length == len(data)
+        assert piece.verify(hashlib.sha1(data).digest())
+
+    def test_wrong_block(self, piece, data):
+        assert not piece.write(1, data[:1024])
+        assert not piece.write(0, data[:10])
+        assert not piece.write(2048, data[:1024])
+        assert not piece.write(len(data), b'')
+
+    def test_duplicate_block(self, piece, data):
+        assert piece.write(0, data[:1024])
+        assert not piece.write(0, b'x' * 1024)
+        assert bytes(piece.data[:1024]) == data[:1024]
+
+    def test_incomplete(self, piece, data):
+        piece.write(0, data[:1024])
+        assert not piece.is_complete
+        assert not piece.verify(hashlib.sha1(data).digest())
+        with pytest.raises(ValueError):
+            piece.digest()
+
+    def test_wrong_hash(self, piece, data):
+        for offset in range(0, len(data), 1024):
+            piece.write(offset, b'\x00' * len(data[offset:offset + 1024]))
+        assert not piece.verify(hashlib.sha1(data).digest())
+
+    def test_deferred_catch_up(self, data):
+        piece = PieceBuffer(len(data), block_length=1024, inline_hash_limit=1024)
+        piece.write(1024, data[1024:2048])
+        piece.write(2048, data[2048:])
+        piece.write(0, data[:1024])
+        assert piece.hashed_length == 0
+        assert piece.digest() == hashlib.sha1(data).digest()
+        assert piece.hashed_length == len(data)
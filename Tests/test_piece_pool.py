@@ -0,0 +1,34 @@
+from piece_pool import PiecePool
+
+
+class TestPiecePool:
+    def test_reuse(self):
+        pool = PiecePool()
+        piece, blocks = pool.acquire(2 ** 15)
+        piece.write(0, b'a' * 2 ** 14)
+        blocks.mark_received(0)
+        pool.release(piece, blocks)
+        assert pool.free_bytes == 2 ** 15
+
+        reused_piece, reused_blocks = pool.acquire(2 ** 15)
+        assert reused_piece is piece and reused_blocks is blocks
+        assert not reused_piece.has_block(0)
+        assert reused_blocks.received_count == 0
+        assert pool.free_bytes == 0
+
+    def test_different_length(self):
+        pool = PiecePool()
+        piece, blocks = pool.acquire(2 ** 15)
+        pool.release(piece, blocks)
+        other, _ = pool.acquire(2 ** 14)
+        assert other is not piece
+        assert other.length == 2 ** 14
+
+    def test_limit(self):
+        pool = PiecePool(max_free_bytes=2 ** 15)
+        records = [pool.acquire(2 ** 15) for _ in range(2)]
+        for record in records:
+            pool.release(*record)
+        assert pool.free_bytes == 2 ** 15
+        pool.clear()
+        assert pool.free_bytes == 0
@@ -3,7 +3,6 @@ import pytest
 import asyncio
 from peer_connection import PeerConnection
 from unittest.mock import AsyncMock, MagicMock, patch
-from pubsub import pub
 from requests_receiver import PeerReceiver, RequestsReceiver
 
 
@@ -27,9 +26,6 @@ class TestRequestsReceiver:
         mock_connect = AsyncMock(return_value=True)
         mock_run = AsyncMock()
         with monkeypatch.context() as m:
-            mock_pub_subscribe = MagicMock()
-            m.setattr(pub, "subscribe", mock_pub_subscribe)
-
             peer = PeerReceiver(sock=MagicMock(), address=("127.0.0.1", 8080))
 
             m.setattr(peer, 'connect', mock_connect)
@@ -50,15 +46,16 @@ class TestRequestsReceiver:
         mock_peer_receiver = AsyncMock()
         mock_peer_receiver.get_info_hash.return_value = "some_info_hash"
 
-        mock_pub_send = MagicMock()
+        mock_listener = MagicMock()
         with monkeypatch.context() as m:
-            m.setattr(pub, "sendMessage", mock_pub_send)
             m.setattr(PeerReceiver, "get_info_hash", mock_peer_receiver)
             receiver = RequestsReceiver()
+            receiver.new_peer_event.subscribe(mock_listener)
 
             await receiver.add_peer(MagicMock(), ("127.0.0.1", 8080))
 
             mock_peer_receiver.assert_called_once()
+            mock_listener.assert_called_once()
 
     def test_handle_handshake_for_buffer(self, monkeypatch):
         mock_handshake_message = MagicMock()
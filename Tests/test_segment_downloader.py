@@ -1,19 +1,25 @@
+import asyncio
+import hashlib
 import logging
+import Message
+import configuration
 
 import pytest
 from unittest.mock import MagicMock, AsyncMock
-from segment_downloader import SegmentDownloader, Segment
-from block import Block
+from segment_downloader import SegmentDownloader, Segment, SegmentDownloadStatus
+from block_table import BlockTable
+from piece_pool import PiecePool
 from peer_connection import PeerConnection
-from pubsub import pub
+from peer_pipeline import PeerPipeline
+from event_bus import Event
 
 
 @pytest.fixture
 def torrent_data():
     mock_torrent_data = MagicMock()
-    mock_torrent_data.segment_length = 1024
+    mock_torrent_data.segment_length = 5 * configuration.BLOCK_LENGTH
     mock_torrent_data.total_segments = 5
-    mock_torrent_data.total_length = 5000
+    mock_torrent_data.total_length = 25 * configuration.BLOCK_LENGTH - 1000
     mock_torrent_data.segments_hash = [b''] * 5
     return mock_torrent_data
 
@@ -36,13 +42,21 @@ def peers():
     mock_peer1.ip = "192.168.1.1"
     mock_peer1.is_active = True
     mock_peer1.send_message_to_peer = AsyncMock(return_value=True)
-    mock_peer1.receive_event = "peer1_receive_event"
+    mock_peer1.receive_event = Event()
+    mock_peer1.disconnect_event = Event()
+    mock_peer1.reject_event = Event()
+    mock_peer1.unchoke_event = Event()
+    mock_peer1.pipeline = PeerPipeline()
 
     mock_peer2 = MagicMock(PeerConnection)
     mock_peer2.ip = "192.168.1.2"
     mock_peer2.is_active = True
     mock_peer2.send_message_to_peer = AsyncMock(return_value=True)
-    mock_peer2.receive_event = "peer2_receive_event"
+    mock_peer2.receive_event = Event()
+    mock_peer2.disconnect_event = Event()
+    mock_peer2.reject_event = Event()
+    mock_peer2.unchoke_event = Event()
+    mock_peer2.pipeline = PeerPipeline()
 
     return [mock_peer1, mock_peer2]
 
@@ -55,60 +69,188 @@ def segment_downloader(torrent_data, file_writer, torrent_statistics, peers):
 
 class TestSegmentDownloader:
     @pytest.mark.asyncio
-    async def test_download_segment_failed_hash(self, segment_downloader, file_writer, torrent_data, monkeypatch):
-        mock_hash = MagicMock()
-        mock_hash.digest.return_value = b'\xFF' * 20  # Simulate wrong hash
-        monkeypatch.setattr('hashlib.sha1', lambda data: mock_hash)
-
-        segment_downloader.downloaded_blocks = {Block(0, i * Block.BLOCK_LENGTH, Block.BLOCK_LENGTH) for i in range(5)}
-        for block in segment_downloader.downloaded_blocks:
-            block.data = b'A' * Block.BLOCK_LENGTH
+    async def test_download_segment_failed_hash(self, segment_downloader, file_writer, torrent_data):
+        torrent_data.segments_hash[0] = b'\xFF' * 20
+        for i in range(5):
+            segment_downloader.piece.write(i * configuration.BLOCK_LENGTH, b'A' * configuration.BLOCK_LENGTH)
 
         await segment_downloader._download_segment()
 
+        assert segment_downloader.segment.status == SegmentDownloadStatus.FAILED
         file_writer.write_segment.assert_not_awaited()
 
     @pytest.mark.asyncio
-    async def test_check_tasks_completion(self, segment_downloader, peers):
-        block = Block(0, 0, Block.BLOCK_LENGTH)
-        block.status = Block.Missing
+    async def test_download_segment_success(self, segment_downloader, file_writer, torrent_data):
+        data = bytes(range(256)) * (5 * configuration.BLOCK_LENGTH // 256)
+        torrent_data.segments_hash[0] = hashlib.sha1(data).digest()
+        for offset in reversed(range(0, len(data), configuration.BLOCK_LENGTH)):
+            segment_downloader.piece.write(offset, data[offset:offset + configuration.BLOCK_LENGTH])
+
+        await segment_downloader._download_segment()
+
+        assert segment_downloader.segment.status == SegmentDownloadStatus.SUCCESS
+        assert bytes(file_writer.write_segment.call_args[0][1]) == data
+
+    def test_on_block_timeout(self, segment_downloader, peers):
+        peer = peers[0]
+        segment_downloader.blocks.add_request(0, segment_downloader._requester_ids[peer], 0, 1)
+        segment_downloader.in_flight[peer] = 1
+
+        segment_downloader.on_block_timeout(0, peer)
+
+        assert segment_downloader.blocks.states[0] == BlockTable.MISSING
+        assert segment_downloader.in_flight[peer] == 0
+        assert segment_downloader.peers_strikes[peer] == 1
+        assert segment_downloader._update_event.is_set()
+
+    def test_on_block_timeout_not_pending(self, segment_downloader, peers):
         peer = peers[0]
 
-        segment_downloader.tasks[peer].add(block)
+        segment_downloader.on_block_timeout(0, peer)
+
+        assert segment_downloader.peers_strikes[peer] == 0
+
+    @pytest.mark.asyncio
+    async def test_block_timeout_fires_from_timer(self, segment_downloader, peers):
+        peer = peers[0]
+        peer.pipeline = MagicMock()
+        peer.pipeline.timeout = 0.01
 
-        segment_downloader.check_tasks_completion()
+        assert await segment_downloader.request_block(4, peer)
+        await asyncio.sleep(0.05)
 
-        assert block in segment_downloader.missing_blocks
-        assert block not in segment_downloader.tasks[peer]
+        assert segment_downloader.blocks.states[4] == BlockTable.MISSING
         assert segment_downloader.peers_strikes[peer] == 1
 
     @pytest.mark.asyncio
-    async def test_request_block_success(self, segment_downloader, peers, monkeypatch):
-        block = Block(0, 0, Block.BLOCK_LENGTH)
+    async def test_request_block_success(self, segment_downloader, peers):
+        peer = peers[0]
+
+        assert await segment_downloader.request_block(0, peer)
+
+        assert segment_downloader.blocks.states[0] == BlockTable.PENDING
+        assert segment_downloader.blocks.requesters_of(0) == [segment_downloader._requester_ids[peer]]
+        assert segment_downloader.in_flight[peer] == 1
+        message = peer.send_message_to_peer.call_args[0][0]
+        assert (message.index, message.byte_offset, message.block_len) == (0, 0, configuration.BLOCK_LENGTH)
+
+    @pytest.mark.asyncio
+    async def test_request_block_send_failed(self, segment_downloader, peers):
         peer = peers[0]
+        peer.send_message_to_peer.return_value = False
+
+        assert not await segment_downloader.request_block(0, peer)
+
+        assert segment_downloader.blocks.states[0] == BlockTable.MISSING
+        assert segment_downloader.in_flight[peer] == 0
+
+    @pytest.mark.asyncio
+    async def test_request_missing_blocks(self, segment_downloader, peers):
+        await segment_downloader.request_missing_blocks()
 
-        monkeypatch.setattr(Block, 'change_status_to_missing', MagicMock())
+        assert all(segment_downloader.in_flight[peer] == peer.pipeline.depth for peer in peers)
+        assert segment_downloader.blocks.pending() == [0, 1, 2, 3]
+        assert segment_downloader.blocks.next_missing() == 4
 
-        await segment_downloader.request_block(block, peer)
+    @pytest.mark.asyncio
+    async def test_request_missing_blocks_skips_choked_peers(self, segment_downloader, peers):
+        peers[1].can_request.return_value = False
+
+        await segment_downloader.request_missing_blocks()
+
+        peers[1].can_request.assert_called_with(0)
+        assert segment_downloader.in_flight[peers[0]] == peers[0].pipeline.depth
+        assert segment_downloader.in_flight[peers[1]] == 0
+
+    @pytest.mark.asyncio
+    async def test_requests_resume_after_unchoke(self, segment_downloader, peers):
+        for peer in peers:
+            peer.peer_choked = False
+            peer.can_request = lambda index, peer=peer: not peer.peer_choked
+        segment_downloader.download_segment()
+        await asyncio.sleep(0)
+        assert all(segment_downloader.in_flight[peer] for peer in peers)
+
+        for peer in peers:
+            peer.peer_choked = True
+            segment_downloader.blocks.remove_requester(segment_downloader._requester_ids[peer])
+            segment_downloader.in_flight[peer] = 0
+            peer.send_message_to_peer.reset_mock()
+        segment_downloader._update_event.set()
+        await asyncio.sleep(0)
+        assert not any(peer.send_message_to_peer.called for peer in peers)
+        assert segment_downloader._choke_timer is not None
+
+        peers[0].peer_choked = False
+        peers[0].unchoke_event.emit(peers[0])
+        await asyncio.sleep(0)
+        assert segment_downloader.in_flight[peers[0]] == peers[0].pipeline.depth
+        assert not peers[1].send_message_to_peer.called
+
+        segment_downloader.close()
+        assert segment_downloader._choke_timer is None
+        assert segment_downloader.on_peer_unchoked not in peers[0].unchoke_event
+
+    @pytest.mark.asyncio
+    async def test_choked_peer_is_replaced(self, segment_downloader, peers, monkeypatch):
+        deletion_listener = MagicMock()
+        segment_downloader.peer_deletion_event.subscribe(deletion_listener)
+        peers[0].can_request.return_value = True
+        peers[1].can_request.return_value = False
+
+        await segment_downloader.check_peers_connection()
+        assert segment_downloader.peers == peers
+        deletion_listener.assert_not_called()
+
+        monkeypatch.setattr(configuration, 'UNCHOKE_TIMEOUT', 0)
+        await segment_downloader.check_peers_connection()
+        assert segment_downloader.peers == [peers[0]]
+        assert segment_downloader.on_peer_unchoked not in peers[1].unchoke_event
+        deletion_listener.assert_called_once_with(segment_downloader)
+        peers[1].close.assert_not_called()
+        segment_downloader.close()
+
+    @pytest.mark.asyncio
+    async def test_rejected_block_is_rescheduled(self, segment_downloader, peers):
+        peer = peers[0]
+        await segment_downloader.request_block(1, peer)
+
+        peer.reject_event.emit(Message.RejectRequestMessage(0, configuration.BLOCK_LENGTH, configuration.BLOCK_LENGTH), peer)
 
-        assert block.status == Block.Pending
-        assert block in segment_downloader.tasks[peer]
+        assert segment_downloader.blocks.states[1] == BlockTable.MISSING
+        assert segment_downloader.in_flight[peer] == 0
+        assert segment_downloader.peers_strikes[peer] == 0
+        assert segment_downloader._update_event.is_set()
 
     @pytest.mark.asyncio
     async def test_on_receive_block(self, segment_downloader, peers):
         peer = peers[0]
-        request = MagicMock()
-        request.index = 0
-        request.byte_offset = 0
-        request.data = b'fake_data'
+        await segment_downloader.request_block(0, peer)
+
+        segment_downloader.on_receive_block(request=Message.SendPieceMessage(0, 0, b'x' * configuration.BLOCK_LENGTH),
+                                            peer=peer)
+
+        assert segment_downloader.blocks.states[0] == BlockTable.RECEIVED
+        assert segment_downloader.in_flight[peer] == 0
+        assert segment_downloader.piece.has_block(0)
+
+    @pytest.mark.asyncio
+    async def test_on_receive_block_not_requested(self, segment_downloader, peers, caplog):
+        with caplog.at_level(logging.ERROR):
+            segment_downloader.on_receive_block(request=Message.SendPieceMessage(0, 0, b'x' * configuration.BLOCK_LENGTH),
+                                                peer=peers[0])
+        assert 'Получен блок, который не был запрошен' in caplog.text
+        assert not segment_downloader.piece.has_block(0)
 
-        block = Block(0, 0, Block.BLOCK_LENGTH)
-        segment_downloader.tasks[peer].add(block)
+    @pytest.mark.asyncio
+    async def test_on_receive_block_wrong_length(self, segment_downloader, peers):
+        peer = peers[0]
+        await segment_downloader.request_block(0, peer)
 
-        segment_downloader.on_receive_block(request=request, peer=peer)
+        segment_downloader.on_receive_block(request=Message.SendPieceMessage(0, 0, b'short'), peer=peer)
 
-        assert block in segment_downloader.downloaded_blocks
-        assert block not in segment_downloader.tasks[peer]
+        assert segment_downloader.blocks.states[0] == BlockTable.MISSING
+        assert segment_downloader.blocks.next_missing() == 0
 
     def test_on_receive_block_fail(self, segment_downloader, caplog):
         with caplog.at_level(logging.ERROR):
@@ -123,79 +265,195 @@ class TestSegmentDownloader:
         peer = peers[0]
         peer.is_active = True
         segment_downloader.peers_strikes[peer] = 2
-        segment_downloader.tasks[peer] = set()
         peer.close = AsyncMock()
 
         await segment_downloader.check_peers_connection()
 
         peer.close.assert_not_awaited()
         assert peer in segment_downloader.peers_strikes
-        assert peer in segment_downloader.tasks
+        assert peer in segment_downloader.in_flight
 
     @pytest.mark.asyncio
-    async def test_check_peers_connection_inactive_peer(self, segment_downloader, peers, monkeypatch):
+    async def test_check_peers_connection_inactive_peer(self, segment_downloader, peers):
         peer = peers[1]
         peer.is_active = False
-        segment_downloader.peers_strikes[peer] = 0
-        segment_downloader.tasks[peer] = set()
 
         peer.close = AsyncMock()
-        mock_send_message = MagicMock()
-        with monkeypatch.context() as m:
-            m.setattr(pub, 'sendMessage', mock_send_message)
+        mock_listener = MagicMock()
+        segment_downloader.peer_deletion_event.subscribe(mock_listener)
 
-            await segment_downloader.check_peers_connection()
+        await segment_downloader.check_peers_connection()
 
-            peer.close.assert_awaited_once()
-            assert peer not in segment_downloader.peers_strikes
-            assert peer not in segment_downloader.tasks
+        peer.close.assert_awaited_once()
+        assert peer not in segment_downloader.peers_strikes
+        assert peer not in segment_downloader.in_flight
+        assert segment_downloader.on_receive_block not in peer.receive_event
 
-            mock_send_message.assert_called_once_with(segment_downloader.peer_deletion_event,
-                                                      segment_downloader=segment_downloader)
+        mock_listener.assert_called_once_with(segment_downloader)
 
     @pytest.mark.asyncio
-    async def test_check_tasks_completion_block_retrieved(self, segment_downloader, peers, monkeypatch):
-        peer = peers[0]
-        block = MagicMock()
-        block.status = Block.Retrieved
-        segment_downloader.tasks[peer] = {block}
-
-        mock_downloaded_blocks = MagicMock()
-        mock_downloaded_blocks.add = MagicMock()
-        with monkeypatch.context() as m:
-            m.setattr(segment_downloader, 'downloaded_blocks', mock_downloaded_blocks)
+    async def test_check_peers_connection_returns_pending_blocks(self, segment_downloader, peers):
+        peer = peers[1]
+        peer.is_active = False
+        peer.close = AsyncMock()
+        await segment_downloader.request_block(3, peer)
 
-            segment_downloader.check_tasks_completion()
-            assert block not in segment_downloader.tasks[peer]
+        await segment_downloader.check_peers_connection()
 
-            mock_downloaded_blocks.add.assert_called_once_with(block)
-            assert segment_downloader.peers_strikes[peer] == 0
+        assert segment_downloader.blocks.states[3] == BlockTable.MISSING
+        assert segment_downloader.blocks.next_missing() == 0
 
-    def test_add_peer(self, segment_downloader, monkeypatch):
+    def test_add_peer(self, segment_downloader):
         peer = MagicMock()
-        peer.receive_event = "peer_event"
-
-        mock_subscribe = MagicMock()
-        monkeypatch.setattr(pub, 'subscribe', mock_subscribe)
+        peer.receive_event = Event()
+        peer.disconnect_event = Event()
+        peer.reject_event = Event()
+        peer.unchoke_event = Event()
 
         segment_downloader.add_peer(peer)
         assert segment_downloader.peers_strikes[peer] == 0
-        assert segment_downloader.tasks[peer] == set()
-        mock_subscribe.assert_called_once_with(segment_downloader.on_receive_block, peer.receive_event)
+        assert segment_downloader.in_flight[peer] == 0
+        assert segment_downloader._requester_ids[peer] == 3
+        assert segment_downloader.on_receive_block in peer.receive_event
 
-    def test_close(self, segment_downloader, monkeypatch):
-        block1 = MagicMock()
-        block1.status = Block.Pending
-        block2 = MagicMock()
-        block2.status = Block.Retrieved
+    def test_close_unsubscribes_from_peers(self, segment_downloader, peers):
+        segment_downloader.downloading_task = MagicMock()
+        assert segment_downloader.on_receive_block in peers[0].receive_event
 
-        peer = MagicMock()
-        segment_downloader.tasks[peer] = {block1, block2}
+        segment_downloader.close()
 
-        mock_downloading_task = MagicMock()
-        segment_downloader.downloading_task = mock_downloading_task
+        assert all(segment_downloader.on_receive_block not in peer.receive_event for peer in peers)
+        segment_downloader.downloading_task.cancel.assert_called_once()
+
+    @pytest.mark.asyncio
+    async def test_close_cancels_timeout_timer(self, segment_downloader, peers):
+        segment_downloader.downloading_task = MagicMock()
+        await segment_downloader.request_block(0, peers[0])
+        timer = segment_downloader._timeout_timer
 
         segment_downloader.close()
-        block1.close.assert_called_once()
-        block2.close.assert_not_called()
-        mock_downloading_task.cancel.assert_called_once()
+
+        assert timer.cancelled
+
+    @pytest.mark.asyncio
+    async def test_request_endgame_blocks(self, segment_downloader, peers):
+        for index in range(1, segment_downloader.blocks_count):
+            segment_downloader.blocks.mark_received(index)
+        await segment_downloader.request_block(0, peers[0])
+
+        segment_downloader.enter_endgame([])
+        await segment_downloader.request_endgame_blocks()
+
+        assert len(segment_downloader.blocks.requesters_of(0)) == 2
+        assert segment_downloader.in_flight[peers[1]] == 1
+        segment_downloader.torrent_stat.update_duplicate_requests.assert_called_once()
+        message = peers[1].send_message_to_peer.call_args[0][0]
+        assert isinstance(message, Message.RequestsMessage)
+
+        await segment_downloader.request_endgame_blocks()
+        assert peers[1].send_message_to_peer.call_count == 1
+
+    @pytest.mark.asyncio
+    async def test_on_receive_block_cancels_duplicates(self, segment_downloader, peers):
+        await segment_downloader.request_block(0, peers[0])
+        await segment_downloader.request_block(0, peers[1])
+        request = Message.SendPieceMessage(0, 0, b'a' * configuration.BLOCK_LENGTH)
+
+        segment_downloader.on_receive_block(request=request, peer=peers[0])
+        await asyncio.sleep(0)
+
+        assert segment_downloader.blocks.states[0] == BlockTable.RECEIVED
+        assert segment_downloader.in_flight[peers[1]] == 0
+        message = peers[1].send_message_to_peer.call_args[0][0]
+        assert isinstance(message, Message.CancelMessage)
+        assert (message.piece_index, message.byte_offset, message.block_len) == (0, 0, configuration.BLOCK_LENGTH)
+
+    def test_on_receive_duplicate_block(self, segment_downloader, peers):
+        segment_downloader.blocks.mark_received(0)
+
+        segment_downloader.on_receive_block(request=Message.SendPieceMessage(0, 0, b'abc'), peer=peers[1])
+
+        segment_downloader.torrent_stat.update_wasted.assert_called_once_with(3)
+
+    def test_last_block_length(self, torrent_data, file_writer, torrent_statistics, peers):
+        last_segment = SegmentDownloader(Segment(4), torrent_data=torrent_data, file_writer=file_writer,
+                                         torrent_statistics=torrent_statistics, peers=peers)
+        assert last_segment.blocks_count == 5
+        assert last_segment.block_length(4) == configuration.BLOCK_LENGTH - 1000
+        assert sum(last_segment.block_length(i) for i in range(5)) == 5 * configuration.BLOCK_LENGTH - 1000
+
+        full_segment = SegmentDownloader(Segment(0), torrent_data=torrent_data, file_writer=file_writer,
+                                         torrent_statistics=torrent_statistics, peers=peers)
+        assert all(full_segment.block_length(i) == configuration.BLOCK_LENGTH for i in range(5))
+
+    @pytest.mark.asyncio
+    async def test_request_block_uses_pipeline_timeout(self, segment_downloader, peers):
+        peer = peers[0]
+        peer.pipeline.on_block_received(configuration.BLOCK_LENGTH, 0.5)
+
+        await segment_downloader.request_block(0, peer)
+
+        blocks = segment_downloader.blocks
+        assert blocks.deadlines[0] - blocks.requested_at[0] == pytest.approx(peer.pipeline.timeout)
+        assert segment_downloader._timeout_deadline == blocks.deadlines[0]
+
+    @pytest.mark.asyncio
+    async def test_on_receive_block_updates_pipeline(self, segment_downloader, peers):
+        peer = peers[0]
+        await segment_downloader.request_block(0, peer)
+
+        segment_downloader.on_receive_block(request=Message.SendPieceMessage(0, 0, b'a' * configuration.BLOCK_LENGTH),
+                                            peer=peer)
+
+        assert peer.pipeline.srtt is not None
+        assert peer.pipeline.rate > 0
+
+    @pytest.mark.asyncio
+    async def test_piece_returned_to_pool(self, torrent_data, file_writer, torrent_statistics, peers):
+        pool = PiecePool()
+        downloader = SegmentDownloader(Segment(0), torrent_data=torrent_data, file_writer=file_writer,
+                                       torrent_statistics=torrent_statistics, peers=peers, pool=pool)
+        piece = downloader.piece
+        for i in range(5):
+            downloader.piece.write(i * configuration.BLOCK_LENGTH, b'A' * configuration.BLOCK_LENGTH)
+
+        await downloader._download_segment()
+
+        assert downloader.piece is None
+        reused = SegmentDownloader(Segment(1), torrent_data=torrent_data, file_writer=file_writer,
+                                   torrent_statistics=torrent_statistics, peers=peers, pool=pool)
+        assert reused.piece is piece
+        assert not reused.piece.is_complete
+
+    @pytest.mark.asyncio
+    async def test_piece_returned_to_pool_on_close(self, torrent_data, file_writer, torrent_statistics, peers):
+        pool = PiecePool()
+        downloader = SegmentDownloader(Segment(0), torrent_data=torrent_data, file_writer=file_writer,
+                                       torrent_statistics=torrent_statistics, peers=peers, pool=pool)
+        piece = downloader.piece
+        downloader.download_segment()
+        await asyncio.sleep(0)
+
+        downloader.close()
+        downloader.close()
+        assert downloader.piece is None
+        assert pool.free_bytes == piece.length
+        reused = SegmentDownloader(Segment(1), torrent_data=torrent_data, file_writer=file_writer,
+                                   torrent_statistics=torrent_statistics, peers=peers, pool=pool)
+        assert reused.piece is piece
+
+    @pytest.mark.asyncio
+    async def test_failed_piece_is_attributed(self, segment_downloader, peers, torrent_data):
+        torrent_data.segments_hash[0] = b'\xFF' * 20
+        for index in range(5):
+            peer = peers[index % 2]
+            await segment_downloader.request_block(index, peer)
+            segment_downloader.on_receive_block(
+                request=Message.SendPieceMessage(0, index * configuration.BLOCK_LENGTH, b'A' * configuration.BLOCK_LENGTH), peer=peer)
+        assert segment_downloader.block_senders() == [peers[0], peers[1], peers[0], peers[1], peers[0]]
+
+        await segment_downloader._download_segment()
+
+        assert segment_downloader.segment.status == SegmentDownloadStatus.FAILED
+        assert segment_downloader.corruption.is_suspect(0, peers[0])
+        assert segment_downloader.corruption.is_suspect(0, peers[1])
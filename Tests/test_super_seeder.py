@@ -0,0 +1,88 @@
+import asyncio
+import bitstring
+import pytest
+import Message
+from unittest.mock import MagicMock, AsyncMock
+from peer_connection import PeerConnection
+from segment_downloader import Segment
+from super_seeder import SuperSeeder
+
+
+def make_peer(ip, bits='0000'):
+    peer = MagicMock(PeerConnection)
+    peer.ip = ip
+    peer.bitfield = bitstring.BitArray(bin=bits)
+    peer.check_for_piece = lambda index: peer.bitfield[index]
+    peer.send_message_to_peer = AsyncMock(return_value=True)
+    return peer
+
+
+def revealed_pieces(peer):
+    return [call.args[0].piece_index for call in peer.send_message_to_peer.call_args_list
+            if isinstance(call.args[0], Message.HaveMessage)]
+
+
+@pytest.fixture
+def segments():
+    return [Segment(i) for i in range(4)]
+
+
+@pytest.fixture
+def seeder(segments):
+    return SuperSeeder(segments)
+
+
+class TestSuperSeeder:
+    @pytest.mark.asyncio
+    async def test_reveals_rarest_distinct_pieces(self, seeder, segments):
+        segments[0].add_peer(make_peer('10.0.0.9', '1000'))
+        first, second = make_peer('10.0.0.1'), make_peer('10.0.0.2')
+
+        seeder.add_peer(first)
+        seeder.add_peer(second)
+        await asyncio.sleep(0)
+
+        assert revealed_pieces(first) == [1]
+        assert revealed_pieces(second) == [2]
+        assert seeder.can_upload(first, 1)
+        assert not seeder.can_upload(first, 2)
+
+    @pytest.mark.asyncio
+    async def test_next_piece_after_propagation(self, seeder):
+        first, second = make_peer('10.0.0.1'), make_peer('10.0.0.2')
+        seeder.add_peer(first)
+        seeder.add_peer(second)
+
+        first.bitfield[0] = True
+        seeder.on_have(first, 0)
+        await asyncio.sleep(0)
+        assert revealed_pieces(first) == [0]
+
+        second.bitfield[0] = True
+        seeder.on_have(second, 0)
+        await asyncio.sleep(0)
+        assert revealed_pieces(first) == [0, 2]
+        assert seeder.propagated == 1
+
+    @pytest.mark.asyncio
+    async def test_single_peer_does_not_stall(self, seeder):
+        peer = make_peer('10.0.0.1')
+        seeder.add_peer(peer)
+        peer.bitfield[0] = True
+        seeder.on_have(peer, 0)
+        await asyncio.sleep(0)
+
+        assert revealed_pieces(peer) == [0, 1]
+
+    @pytest.mark.asyncio
+    async def test_bitfield_with_revealed_piece(self, seeder):
+        peer = make_peer('10.0.0.1')
+        seeder.add_peer(peer)
+        peer.bitfield = bitstring.BitArray(bin='1100')
+        seeder.on_bitfield(peer)
+        await asyncio.sleep(0)
+
+        assert revealed_pieces(peer) == [0, 2]
+
+        seeder.remove_peer(peer)
+        assert not seeder.can_upload(peer, 0)
@@ -0,0 +1,81 @@
+import asyncio
+import logging
+import pytest
+from unittest.mock import MagicMock
+from timer_scheduler import TimerScheduler
+
+
+@pytest.fixture
+def timers():
+    scheduler = TimerScheduler()
+    yield scheduler
+    scheduler.close()
+
+
+class TestTimerScheduler:
+    @pytest.mark.asyncio
+    async def test_call_later_order(self, timers):
+        fired = []
+        timers.call_later(0.03, fired.append, 3)
+        timers.call_later(0.01, fired.append, 1)
+        timers.call_later(0.02, fired.append, 2)
+
+        await asyncio.sleep(0.1)
+        assert fired == [1, 2, 3]
+        assert len(timers) == 0
+
+    @pytest.mark.asyncio
+    async def test_single_loop_handle(self, timers, monkeypatch):
+        loop = asyncio.get_running_loop()
+        mock_call_at = MagicMock(wraps=loop.call_at)
+        monkeypatch.setattr(loop, 'call_at', mock_call_at)
+
+        for i in range(100):
+            timers.call_later(10 + i, MagicMock())
+
+        assert mock_call_at.call_count == 1
+        assert len(timers) == 100
+
+    @pytest.mark.asyncio
+    async def test_cancel(self, timers):
+        callback = MagicMock()
+        timer = timers.call_later(0.01, callback)
+        timer.cancel()
+        timer.cancel()
+
+        await asyncio.sleep(0.05)
+        callback.assert_not_called()
+        assert len(timers) == 0
+
+    @pytest.mark.asyncio
+    async def test_cancelled_timers_are_compacted(self, timers):
+        created = [timers.call_later(100, MagicMock()) for _ in range(TimerScheduler.COMPACTION_THRESHOLD * 4)]
+        for timer in created[1:]:
+            timer.cancel()
+
+        assert len(timers) == 1
+        assert len(timers._heap) < TimerScheduler.COMPACTION_THRESHOLD * 2
+
+    @pytest.mark.asyncio
+    async def test_callback_can_reschedule(self, timers):
+        fired = []
+
+        def callback(count):
+            fired.append(count)
+            if count < 3:
+                timers.call_later(0.01, callback, count + 1)
+
+        timers.call_later(0.01, callback, 1)
+        await asyncio.sleep(0.15)
+        assert fired == [1, 2, 3]
+
+    @pytest.mark.asyncio
+    async def test_failed_callback_does_not_stop_others(self, timers, caplog):
+        callback = MagicMock()
+        timers.call_later(0.01, MagicMock(side_effect=ValueError('boom')))
+        timers.call_later(0.01, callback)
+
+        with caplog.at_level(logging.ERROR):
+            await asyncio.sleep(0.05)
+            assert 'boom' in caplog.text
+        callback.assert_called_once()
@@ -0,0 +1,342 @@
+import asyncio
+import socket
+import bitstring
+import pytest
+import configuration
+import Message
+from unittest.mock import MagicMock, AsyncMock
+from event_bus import Event
+from peer_connection import PeerConnection
+from segment_downloader import SegmentDownloadStatus
+from torrent_downloader import Downloader
+from torrent_statistics import TorrentStatistics
+from peer_store import PeerStore
+from requests_receiver import PeerReceiver
+
+
+@pytest.fixture
+def torrent():
+    mock_torrent = MagicMock()
+    mock_torrent.total_segments = 8
+    mock_torrent.segment_length = 1024
+    mock_torrent.total_length = 8 * 1024
+    mock_torrent.url_list = []
+    mock_torrent.info_hash = b'\xaa' * 20
+    return mock_torrent
+
+
+@pytest.fixture
+def downloader(torrent):
+    file_writer = AsyncMock()
+    file_writer.check_segment_download.return_value = False
+    return Downloader(torrent, file_writer, TorrentStatistics(torrent.total_length, torrent.total_segments),
+                      PeerStore(b'\x00' * 20, torrent.total_segments))
+
+
+def make_peer(ip, bits, choked=False):
+    peer = MagicMock(PeerConnection)
+    peer.ip = ip
+    peer.port = 6881
+    peer.is_active = True
+    peer.peer_choked = choked
+    peer.bitfield = bitstring.BitArray(bin=bits)
+    for event in ('receive_event', 'request_event', 'bitfield_update_event', 'have_message_event',
+                  'unchoke_event', 'disconnect_event', 'interest_event', 'cancel_event', 'reject_event',
+                  'suggest_event', 'allowed_fast_event', 'extended_message_event'):
+        setattr(peer, event, Event())
+    peer.supports_fast = peer.supports_extensions = False
+    peer.allowed_fast, peer.granted_fast = set(), set()
+    peer.can_request = lambda index: not peer.peer_choked or index in peer.allowed_fast
+    return peer
+
+
+class TestDownloader:
+    def test_start_segment_downloads_fills_all_slots(self, downloader, monkeypatch):
+        start = MagicMock()
+        monkeypatch.setattr(downloader, 'start_segment_download', start)
+        peers = [make_peer(f'10.0.0.{i}', '11111111') for i in range(8)]
+        for peer in peers:
+            downloader.get_bitfield_from_peer(peer)
+
+        downloader.start_segment_downloads()
+
+        assert start.call_count == configuration.MAX_SEGMENTS_DOWNLOADING_SIMULTANEOUSLY
+        started = [call.args[0].id for call in start.call_args_list]
+        assert len(set(started)) == len(started)
+
+    def test_choked_peers_are_not_used(self, downloader, monkeypatch):
+        start = MagicMock()
+        monkeypatch.setattr(downloader, 'start_segment_download', start)
+        peer = make_peer('10.0.0.1', '11111111', choked=True)
+        downloader.get_bitfield_from_peer(peer)
+
+        downloader.start_segment_downloads()
+        start.assert_not_called()
+
+        peer.peer_choked = False
+        downloader.on_peer_unchoked(peer)
+        downloader.start_segment_downloads()
+        assert start.call_count == 1
+
+    def test_rarest_segment_first(self, downloader, monkeypatch):
+        start = MagicMock()
+        monkeypatch.setattr(downloader, 'start_segment_download', start)
+        downloader.get_bitfield_from_peer(make_peer('10.0.0.1', '11000000'))
+        downloader.get_bitfield_from_peer(make_peer('10.0.0.2', '10000000'))
+
+        assert downloader.try_find_rarest_segment() == (1, True)
+
+    @pytest.mark.asyncio
+    async def test_download_reacts_to_bitfield(self, downloader, monkeypatch):
+        start = MagicMock()
+        monkeypatch.setattr(downloader, 'start_segment_download', start)
+        monkeypatch.setattr(downloader, 'peer_connection_task', AsyncMock())
+        task = asyncio.create_task(downloader.download_torrent(seed=False))
+        await asyncio.sleep(0)
+        await asyncio.sleep(0)
+        start.assert_not_called()
+
+        downloader.get_bitfield_from_peer(make_peer('10.0.0.1', '00000001'))
+        await asyncio.sleep(0)
+
+        assert start.call_count == 1
+        assert downloader.available_segments[7].status == SegmentDownloadStatus.PENDING
+        task.cancel()
+
+    @pytest.mark.asyncio
+    async def test_block_peer_frees_slot(self, downloader):
+        peer = make_peer('10.0.0.1', '11111111')
+        peer.close = AsyncMock()
+        downloader.active_peers.append(peer)
+        downloader.get_bitfield_from_peer(peer)
+        downloader._wakeup.clear()
+
+        downloader.on_peer_lost(peer)
+        await asyncio.sleep(0)
+
+        assert peer not in downloader.active_peers
+        assert all(peer not in segment.peers for segment in downloader.available_segments)
+        assert downloader._peer_slot_freed.is_set()
+        assert downloader._wakeup.is_set()
+
+    def test_replace_peer_without_candidates_restarts_segment(self, downloader):
+        segment_downloader = MagicMock()
+        segment_downloader.segment = downloader.available_segments[2]
+        segment_downloader.segment.status = SegmentDownloadStatus.PENDING
+        segment_downloader.peers = []
+        downloader._segment_downloaders.append(segment_downloader)
+
+        downloader.replace_peer(segment_downloader)
+
+        segment_downloader.close.assert_called_once()
+        assert segment_downloader not in downloader._segment_downloaders
+        assert segment_downloader.segment.status == SegmentDownloadStatus.NOT_STARTED
+
+    @pytest.mark.asyncio
+    async def test_banned_peer_is_dropped(self, downloader):
+        peer = make_peer('10.0.0.1', '11111111')
+        downloader.active_peers.append(peer)
+        downloader.get_bitfield_from_peer(peer)
+
+        downloader.corruption.ban('10.0.0.1')
+        await asyncio.sleep(0)
+
+        assert peer not in downloader.active_peers
+        peer.close.assert_awaited_once()
+
+        downloader.connector.connect = MagicMock()
+        downloader.peer_store.add('10.0.0.1', 6881)
+        assert not await downloader._add_peer_from_store()
+        downloader.connector.connect.assert_not_called()
+        assert downloader.peer_store.candidates[('10.0.0.1', 6881)].banned
+
+    @pytest.mark.asyncio
+    async def test_banned_incoming_peer_is_rejected(self, downloader):
+        downloader.corruption.ban('10.0.0.1')
+        peer = make_peer('10.0.0.1', '11111111')
+
+        assert not await downloader.add_peer(peer)
+        peer.connect.assert_not_called()
+        peer.close.assert_awaited_once()
+        assert peer not in downloader.active_peers
+
+    @pytest.mark.asyncio
+    async def test_banned_peer_receiver_is_closed(self, downloader):
+        downloader.corruption.ban('10.0.0.1')
+        ours, theirs = socket.socketpair()
+        theirs.setblocking(False)
+        peer = PeerReceiver(ours, ('10.0.0.1', 6881))
+        assert await peer.connect()
+        peer.run_task = asyncio.create_task(asyncio.sleep(10))
+
+        assert not await downloader.add_peer(peer)
+        await asyncio.sleep(0)
+        assert peer.run_task.cancelled()
+        assert not peer.is_active
+        assert await asyncio.get_running_loop().sock_recv(theirs, 1) == b''
+        theirs.close()
+
+    def test_suspect_peers_are_used_last(self, downloader):
+        suspect, trusted = make_peer('10.0.0.1', '11111111'), make_peer('10.0.0.2', '11111111')
+        downloader.corruption._failed_pieces[3] = [([], [suspect])]
+
+        assert downloader.trusted_first(3, [suspect, trusted]) == [trusted, suspect]
+        assert downloader.trusted_first(2, [suspect, trusted]) == [suspect, trusted]
+
+    @pytest.mark.asyncio
+    async def test_super_seeding_hides_bitfield(self, downloader, monkeypatch):
+        monkeypatch.setattr(configuration, 'SUPER_SEEDING', True)
+        downloader.segments_left = 0
+        for i in range(8):
+            downloader.torrent_statistics.update_bitfield(i, True)
+        peer = make_peer('10.0.0.1', '00000000')
+        peer.check_for_piece = lambda index: peer.bitfield[index]
+        peer.send_message_to_peer = AsyncMock(return_value=True)
+
+        await downloader._send_bitfield_to_peer_task(peer)
+        await asyncio.sleep(0)
+
+        bitfield_message, have_message = [call.args[0] for call in peer.send_message_to_peer.call_args_list]
+        assert not bitfield_message.segments.any(True)
+        assert isinstance(have_message, Message.HaveMessage)
+
+        downloader.on_request_piece(Message.RequestsMessage(have_message.piece_index + 1, 0, 16), peer)
+        assert peer not in downloader.upload_queues
+
+    @pytest.mark.asyncio
+    async def test_seed_sends_have_all_and_allowed_fast(self, downloader):
+        downloader.segments_left = 0
+        for i in range(8):
+            downloader.torrent_statistics.update_bitfield(i, True)
+        peer = make_peer('10.0.0.1', '00000000')
+        peer.supports_fast = True
+        peer.send_message_to_peer = AsyncMock(return_value=True)
+
+        await downloader._send_bitfield_to_peer_task(peer)
+
+        messages = [call.args[0] for call in peer.send_message_to_peer.call_args_list]
+        assert isinstance(messages[0], Message.HaveAllMessage)
+        assert all(isinstance(message, Message.AllowedFastMessage) for message in messages[1:])
+        assert peer.granted_fast == {message.piece_index for message in messages[1:]}
+        assert len(peer.granted_fast) == 8
+
+    def test_allowed_fast_pieces_are_downloaded_while_choked(self, downloader, monkeypatch):
+        start = MagicMock()
+        monkeypatch.setattr(downloader, 'start_segment_download', start)
+        peer = make_peer('10.0.0.1', '11111111', choked=True)
+        peer.check_for_piece = lambda index: peer.bitfield[index]
+        downloader.get_bitfield_from_peer(peer)
+
+        peer.allowed_fast.add(5)
+        downloader.on_allowed_fast(peer, 5)
+        downloader.start_segment_downloads()
+
+        start.assert_called_once()
+        assert start.call_args.args[0].id == 5
+
+    def test_suggested_piece_is_preferred(self, downloader):
+        peers = [make_peer(f'10.0.0.{i}', '11000000') for i in range(3)]
+        for peer in peers:
+            peer.check_for_piece = lambda index, peer=peer: peer.bitfield[index]
+            downloader.get_bitfield_from_peer(peer)
+        downloader.get_bitfield_from_peer(make_peer('10.0.0.9', '01000000'))
+
+        downloader.on_suggest_piece(peers[0], 1)
+
+        assert downloader.try_find_rarest_segment() == (1, True)
+
+    @pytest.mark.asyncio
+    async def test_seed_to_seed_connections_are_pruned(self, downloader):
+        seed, leecher = make_peer('10.0.0.1', '11111111'), make_peer('10.0.0.2', '01000000')
+        seed.interested = leecher.interested = False
+        leecher.peer_interested = True
+        downloader.active_peers.extend([seed, leecher])
+
+        downloader.prune_peers()
+        await asyncio.sleep(0)
+        assert seed in downloader.active_peers
+
+        for segment in downloader.available_segments:
+            segment.status = SegmentDownloadStatus.SUCCESS
+        downloader.segments_left = 0
+        downloader.prune_peers()
+        await asyncio.sleep(0)
+
+        assert downloader.active_peers == [leecher]
+        seed.close.assert_awaited_once()
+        assert downloader.is_pruned(seed)
+
+    @pytest.mark.asyncio
+    async def test_mutually_uninterested_peers_are_pruned(self, downloader, monkeypatch):
+        clock = [1000.0]
+        monkeypatch.setattr('time.monotonic', lambda: clock[0])
+        downloader.available_segments[0].status = SegmentDownloadStatus.SUCCESS
+        peer = make_peer('10.0.0.1', '10000000')
+        peer.interested = True
+        peer.peer_interested = False
+        peer.send_message_to_peer = AsyncMock(return_value=True)
+        downloader.active_peers.append(peer)
+
+        downloader.prune_peers()
+        await asyncio.sleep(0)
+        assert peer in downloader.active_peers
+        assert not peer.interested
+        assert isinstance(peer.send_message_to_peer.call_args.args[0], Message.NotInterestedMessage)
+
+        clock[0] += configuration.UNINTERESTED_PEER_TIMEOUT
+        downloader.prune_peers()
+        await asyncio.sleep(0)
+        assert peer not in downloader.active_peers
+        assert downloader._peer_slot_freed.is_set()
+
+        reconnecting = make_peer('10.0.0.1', '10000000')
+        assert not await downloader.add_peer(reconnecting)
+        reconnecting.connect.assert_not_called()
+
+        clock[0] += configuration.PRUNED_PEER_RECONNECT_DELAY
+        assert not downloader.is_pruned(reconnecting)
+
+    @pytest.mark.asyncio
+    async def test_interest_resets_pruning_countdown(self, downloader, monkeypatch):
+        clock = [1000.0]
+        monkeypatch.setattr('time.monotonic', lambda: clock[0])
+        peer = make_peer('10.0.0.1', '00000000')
+        peer.interested = False
+        peer.peer_interested = False
+        downloader.active_peers.append(peer)
+
+        downloader.prune_peers()
+        clock[0] += configuration.UNINTERESTED_PEER_TIMEOUT - 1
+        peer.peer_interested = True
+        downloader.prune_peers()
+        peer.peer_interested = False
+        clock[0] += 2
+        downloader.prune_peers()
+        await asyncio.sleep(0)
+
+        assert peer in downloader.active_peers
+
+    @pytest.mark.asyncio
+    async def test_queued_peers_are_handed_to_connector(self, downloader):
+        downloader.connector.connect = MagicMock()
+        downloader.peer_store.add('10.0.0.1', 6881)
+
+        assert await downloader._add_peer_from_store()
+        peer = downloader.connector.connect.call_args.args[0]
+        assert (peer.ip, peer.port) == ('10.0.0.1', 6881)
+
+    @pytest.mark.asyncio
+    async def test_register_peer_respects_peer_limit(self, downloader, monkeypatch):
+        monkeypatch.setattr(configuration, 'MAX_PEER_COUNT', 1)
+        first, second = make_peer('10.0.0.1', '11111111'), make_peer('10.0.0.2', '11111111')
+        for peer in (first, second):
+            peer.send_message_to_peer = AsyncMock(return_value=True)
+            peer.last_message_sent = peer.last_message_received = 0
+
+        assert downloader.register_peer(first)
+        assert not downloader.register_peer(second)
+        await asyncio.sleep(0)
+
+        assert downloader.active_peers == [first]
+        second.close.assert_awaited_once()
+        downloader.close()
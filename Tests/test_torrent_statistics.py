@@ -16,4 +16,11 @@ class TestTorrentStatistics:
     def test_bitfield_update(self):
         torrent_stat = TorrentStatistics(200, 10)
         torrent_stat.update_bitfield(1, True)
-        assert torrent_stat.bitfield[1] == True
\ No newline at end of file
+        assert torrent_stat.bitfield[1] == True
+
+    def test_update_wasted(self):
+        torrent_stat = TorrentStatistics(200, 10)
+        torrent_stat.update_wasted(20)
+        torrent_stat.update_duplicate_requests()
+        assert torrent_stat.wasted == 20
+        assert torrent_stat.duplicate_requests == 1
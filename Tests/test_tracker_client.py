@@ -1,4 +1,4 @@
-from tracker_client import LocalConnections, HttpTrackerClient, TrackerEvent
+from tracker_client import HttpTrackerClient, TrackerEvent
 from unittest.mock import AsyncMock
 from struct import pack
 import pytest
@@ -7,11 +7,6 @@ import socket
 import logging
 
 
-@pytest.fixture
-def local_connection():
-    return LocalConnections()
-
-
 @pytest.fixture
 def http_tracker():
     client = HttpTrackerClient(
@@ -49,7 +44,8 @@ class TestTrackerClient:
 
         http_tracker._parse_response(response)
 
-        assert http_tracker.request_interval == 900
+        assert http_tracker.request_interval == 1800
+        assert http_tracker.min_interval == 900
         assert http_tracker.tracker_id == 'idid'
         assert http_tracker._peers == {('192.168.1.1', 6881), ('192.168.1.2', 6881)}
 
@@ -79,28 +75,10 @@ class TestTrackerClient:
                 assert 'Timeout error while close connection with tracker' in caplog.text
 
     @pytest.mark.asyncio
-    async def test_add_peer_local(self, local_connection):
-        await local_connection._add_peer('127.0.0.1')
-        element = await local_connection.new_peers.get()
-        assert element == ('127.0.0.1', 52656)
-        assert local_connection.new_peers.empty()
-
-    @pytest.mark.asyncio
-    async def test_add_peer_repeat_local(self, local_connection):
-        local_connection._peers.add('127.0.0.1')
-        await local_connection._add_peer('127.0.0.1')
-        assert local_connection.new_peers.empty()
-
-    @pytest.mark.asyncio
-    async def test_close_local(self, local_connection):
-        await local_connection.close()
-        assert True
-
-    @pytest.mark.asyncio
-    async def test_make_request(self, local_connection):
-        local_connection._add_peer = AsyncMock()
-        await local_connection.make_request(None)
-        assert local_connection._add_peer.call_count == 200
-        expected_calls = [local_connection.ip_start + '.' + str(i) for i in range(200)]
-        actual_calls = [call.args[0] for call in local_connection._add_peer.call_args_list]
-        assert actual_calls == expected_calls
+    async def test_close_http_tracker_unreachable(self, http_tracker, monkeypatch, caplog):
+        mock_make_request = AsyncMock(side_effect=ConnectionError('status code 502'))
+        with caplog.at_level(logging.ERROR):
+            with monkeypatch.context() as m:
+                m.setattr(http_tracker, 'make_request', mock_make_request)
+                await http_tracker.close()
+                assert 'Unable to send stop event to "http://example.com/announce"' in caplog.text
@@ -3,6 +3,8 @@ import asyncio
 from unittest.mock import AsyncMock, MagicMock
 from tracker_manager import TrackerManager, HttpTrackerClient, BadTorrentTrackers
 import tracker_client
+from local_discovery import LocalServiceDiscovery, LocalPeers
+from dht import DhtTracker
 
 
 @pytest.fixture
@@ -31,14 +33,14 @@ class TestTrackerManager:
             pass
 
         with monkeypatch.context() as m:
-            mock_http_tracker = AsyncMock(HttpTrackerClient)
-            mock_http_tracker.make_request = AsyncMock(side_effect=mock_make_request)
+            mock_http_tracker = make_tracker('http://a', mock_make_request)
 
             m.setattr('tracker_manager.HttpTrackerClient', mock_http_tracker)
             tracker_manager.tracker_clients.append(mock_http_tracker)
 
             async with tracker_manager:
                 mock_http_tracker.make_request.assert_called_once_with(tracker_client.TrackerEvent.STARTED)
+                assert mock_http_tracker in tracker_manager._announce_timers
 
     @pytest.mark.asyncio
     async def test_aenter_fail(self, tracker_manager):
@@ -55,39 +57,36 @@ class TestTrackerManager:
                 pass
 
         assert str(excinfo.value) == "Torrent file had no stable trackers"
-        assert failing_tracker in excinfo.value.bad_trackers
-        assert len(tracker_manager.tracker_clients) == 0
+        assert excinfo.value.bad_trackers == [failing_tracker, failing_tracker_second]
+        assert not tracker_manager._announce_timers
 
     @pytest.mark.asyncio
     async def test_aexit(self, tracker_manager, caplog):
         mock_tracker = AsyncMock()
         mock_tracker.close = AsyncMock()
-        mock_update_task = AsyncMock()
-        mock_update_task.cancel = AsyncMock()
-        mock_update_task.__await__ = AsyncMock(return_value=iter([None]))
-        tracker_manager.update_task = mock_update_task
+        mock_tracker.request_interval = 60
+        mock_tracker.min_interval = None
+        mock_tracker.new_peers = asyncio.Queue()
         tracker_manager.tracker_clients = [mock_tracker]
 
-        tracker_manager.create_peers_update_task()
-
-        assert isinstance(tracker_manager.update_task, asyncio.Task)
+        tracker_manager.schedule_peers_update()
+        assert mock_tracker in tracker_manager._announce_timers
 
         await tracker_manager.__aexit__(None, None, None)
         mock_tracker.close.assert_called_once()
+        assert not tracker_manager._announce_timers
+        assert len(tracker_manager.timers) == 0
         assert len(caplog.records) == 0
 
     @pytest.mark.asyncio
     async def test_aexit_with_exception(self, tracker_manager, caplog):
         mock_tracker = AsyncMock()
         mock_tracker.close = AsyncMock()
-        mock_update_task = AsyncMock()
-        mock_update_task.cancel = AsyncMock()
-        mock_update_task.__await__ = AsyncMock(return_value=iter([None]))
-        tracker_manager.update_task = mock_update_task
+        mock_tracker.request_interval = 60
+        mock_tracker.min_interval = None
+        mock_tracker.new_peers = asyncio.Queue()
         tracker_manager.tracker_clients = [mock_tracker]
-        tracker_manager.create_peers_update_task()
-
-        assert isinstance(tracker_manager.update_task, asyncio.Task)
+        tracker_manager.schedule_peers_update()
 
         exc_type = ValueError
         exc_val = ValueError("Test exception")
@@ -97,44 +96,38 @@ class TestTrackerManager:
         assert f'Got exception of type - "{exc_type}", with value - "{exc_val}" while working with trackers' in caplog.text
 
     @pytest.mark.asyncio
-    async def test_update_peers(self, monkeypatch, tracker_manager):
-        async def mock_make_request(event):
-            pass
+    async def test_update_peers(self, tracker_manager):
+        mock_http_tracker = AsyncMock(HttpTrackerClient)
+        mock_http_tracker.request_interval = 0.05
+        mock_http_tracker.new_peers = asyncio.Queue()
+        mock_http_tracker.new_peers.put_nowait(("127.0.0.1", 6881))
+        tracker_manager.tracker_clients.append(mock_http_tracker)
 
-        async def mock_get_nowait():
-            return ("127.0.0.1", 6881)
+        tracker_manager.schedule_peers_update()
+        assert len(tracker_manager.peer_store) == 1
+        mock_http_tracker.make_request.assert_not_called()
 
-        with monkeypatch.context() as m:
-            mock_http_tracker = AsyncMock(HttpTrackerClient)
-
-            mock_new_peers = AsyncMock()
-            mock_new_peers.empty.return_value = False
-            mock_new_peers.get_nowait = AsyncMock(side_effect=mock_get_nowait)
+        mock_http_tracker.new_peers.put_nowait(("127.0.0.1", 6881))
+        mock_http_tracker.new_peers.put_nowait(("127.0.0.2", 6881))
+        await asyncio.sleep(0.2)
 
-            mock_http_tracker.make_request = AsyncMock(side_effect=mock_make_request)
-            mock_http_tracker.new_peers = mock_new_peers
+        mock_http_tracker.make_request.assert_called_with(tracker_client.TrackerEvent.CHECK)
+        assert mock_http_tracker.make_request.call_count >= 2
+        assert len(tracker_manager.peer_store) == 2
 
-            m.setattr('tracker_manager.HttpTrackerClient', mock_http_tracker)
-            tracker_manager.tracker_clients.append(mock_http_tracker)
-
-            tracker_manager.create_peers_update_task()
-            await asyncio.sleep(1)
-
-            mock_http_tracker.make_request.assert_called_with(tracker_client.TrackerEvent.CHECK)
-            assert tracker_manager.available_peers.qsize() == 0
-
-            tracker_manager.update_task.cancel()
+        await tracker_manager.__aexit__(None, None, None)
 
     @pytest.mark.asyncio
-    async def test_create_peers_update_task(self, monkeypatch, tracker_manager):
-        with monkeypatch.context() as m:
-            mock_update_peers = AsyncMock()
-            m.setattr(tracker_manager, '_update_peers', mock_update_peers)
+    async def test_update_peers_failed_announce(self, tracker_manager):
+        mock_http_tracker = AsyncMock(HttpTrackerClient)
+        mock_http_tracker.request_interval = 60
+        mock_http_tracker.new_peers = asyncio.Queue()
+        mock_http_tracker.make_request = AsyncMock(side_effect=ConnectionError)
 
-            tracker_manager.create_peers_update_task()
+        await tracker_manager._update_peers(mock_http_tracker)
 
-            assert tracker_manager.update_task is not None
-            assert mock_update_peers.call_count == 1
+        assert mock_http_tracker in tracker_manager._announce_timers
+        await tracker_manager.__aexit__(None, None, None)
 
     def test_add_tracker_http(self, monkeypatch, tracker_manager):
         class MockHttpTrackerClient:
@@ -147,6 +140,202 @@ class TestTrackerManager:
             assert tracker_manager.tracker_clients[0].url == 'http://tracker.example.com'
 
     def test_add_tracker_local(self, tracker_manager):
+        tracker_manager._add_tracker('local')
+        assert not tracker_manager.tracker_clients
+
+        tracker_manager.lsd = LocalServiceDiscovery()
         tracker_manager._add_tracker('local')
         assert len(tracker_manager.tracker_clients) == 1
-        assert type(tracker_manager.tracker_clients[0]) is tracker_client.LocalConnections
\ No newline at end of file
+        assert type(tracker_manager.tracker_clients[0]) is LocalPeers
+
+    def test_local_peers_are_collected_immediately(self, tracker_manager):
+        tracker_manager.lsd = LocalServiceDiscovery()
+        tracker_manager._add_tracker('local')
+
+        tracker_manager.lsd.peer_event.emit(b'\x12' * 20, ('192.168.1.5', 6881))
+        tracker_manager.lsd.peer_event.emit(b'\x13' * 20, ('192.168.1.6', 6881))
+
+        assert set(tracker_manager.peer_store.candidates) == {('192.168.1.5', 6881)}
+        assert tracker_manager.peer_store.candidates[('192.168.1.5', 6881)].source == 'local'
+
+def make_tracker(url, side_effect=None):
+    tracker = AsyncMock(HttpTrackerClient)
+    tracker.url = url
+    tracker.request_interval = 1800
+    tracker.min_interval = None
+    tracker.new_peers = asyncio.Queue()
+    tracker.make_request = AsyncMock(side_effect=side_effect)
+    return tracker
+
+
+def add_tier(tracker_manager, tier, *trackers):
+    for tracker in trackers:
+        tracker_manager.tracker_clients.append(tracker)
+        tracker_manager._tier_of[tracker] = tier
+
+
+class TestAnnounceTiers:
+    @pytest.mark.asyncio
+    async def test_only_first_working_tracker_of_tier_is_started(self, tracker_manager):
+        first, second, third = make_tracker('http://a'), make_tracker('http://b'), make_tracker('http://c')
+        first.make_request.side_effect = ConnectionError
+        other_tier = make_tracker('http://d')
+        add_tier(tracker_manager, 0, first, second, third)
+        add_tier(tracker_manager, 1, other_tier)
+
+        async with tracker_manager:
+            assert tracker_manager.tiers == [[second, third, first], [other_tier]]
+            third.make_request.assert_not_called()
+            other_tier.make_request.assert_called_once_with(tracker_client.TrackerEvent.STARTED)
+
+            tracker_manager.schedule_peers_update()
+            assert set(tracker_manager._announce_timers) == {second, other_tier}
+
+    @pytest.mark.asyncio
+    async def test_failover_and_promotion(self, tracker_manager):
+        first, second, third = make_tracker('http://a'), make_tracker('http://b'), make_tracker('http://c')
+        add_tier(tracker_manager, 0, first, second, third)
+        tracker_manager._unannounced = {second, third}
+
+        first.make_request.side_effect = ConnectionError
+        await tracker_manager._update_peers(first)
+        assert set(tracker_manager._announce_timers) == {second}
+
+        tracker_manager._announce_timers.pop(second).cancel()
+        await tracker_manager._update_peers(second)
+        second.make_request.assert_called_once_with(tracker_client.TrackerEvent.STARTED)
+        assert tracker_manager.tiers == [[second, first, third]]
+        assert set(tracker_manager._announce_timers) == {second}
+        await tracker_manager.__aexit__(None, None, None)
+
+    @pytest.mark.asyncio
+    async def test_failed_tier_backs_off(self, tracker_manager):
+        first, second = make_tracker('http://a', ConnectionError), make_tracker('http://b', ConnectionError)
+        add_tier(tracker_manager, 0, first, second)
+
+        await tracker_manager._update_peers(first)
+        assert tracker_manager._announce_timers[second].when - tracker_manager.timers.time() < 1
+
+        await tracker_manager._update_peers(second)
+        assert tracker_manager._announce_timers[first].when - tracker_manager.timers.time() > 20
+        await tracker_manager.__aexit__(None, None, None)
+
+    @pytest.mark.asyncio
+    async def test_announces_early_with_few_peers(self, tracker_manager):
+        tracker = make_tracker('http://a')
+        tracker.min_interval = 900
+        assert tracker_manager._announce_delay(tracker) == 900
+
+        for port in range(20):
+            tracker_manager.peer_store.add('10.0.0.1', port)
+            tracker_manager.peer_store.candidates[('10.0.0.1', port)].in_use = True
+        assert tracker_manager._announce_delay(tracker) == 1800
+
+    @pytest.mark.asyncio
+    async def test_completed_is_sent_once(self, torrent_data):
+        statistics = MagicMock(left=100)
+        tracker_manager = TrackerManager(torrent_data, statistics, port=6881)
+        tracker = make_tracker('http://a')
+        add_tier(tracker_manager, 0, tracker)
+
+        async with tracker_manager:
+            tracker_manager.schedule_peers_update()
+            await tracker_manager.announce_completed()
+            tracker.make_request.assert_called_once_with(tracker_client.TrackerEvent.STARTED)
+
+            statistics.left = 0
+            await tracker_manager.announce_completed()
+            await tracker_manager.announce_completed()
+            tracker.make_request.assert_called_with(tracker_client.TrackerEvent.COMPLETED)
+            assert tracker.make_request.call_count == 2
+            assert tracker in tracker_manager._announce_timers
+
+    @pytest.mark.asyncio
+    async def test_startup_waits_only_for_first_peers(self, tracker_manager):
+        dead = make_tracker('http://dead', asyncio.TimeoutError)
+        slow_started = asyncio.Event()
+
+        async def slow_request(event):
+            slow_started.set()
+            await asyncio.sleep(10)
+
+        slow = make_tracker('http://slow', slow_request)
+        fast = make_tracker('http://fast')
+        fast.new_peers.put_nowait(('10.0.0.1', 6881))
+        add_tier(tracker_manager, 0, dead, fast)
+        add_tier(tracker_manager, 1, slow)
+
+        async with tracker_manager:
+            assert slow_started.is_set()
+            assert ('10.0.0.1', 6881) in tracker_manager.peer_store
+            assert tracker_manager.tiers == [[fast, dead], [slow]]
+            assert slow in tracker_manager._starting
+
+            tracker_manager.schedule_peers_update()
+            assert set(tracker_manager._announce_timers) == {fast}
+        assert not tracker_manager.update_tasks
+
+    @pytest.mark.asyncio
+    async def test_slow_tracker_is_demoted(self, tracker_manager, monkeypatch):
+        monkeypatch.setattr('configuration.TRACKER_STARTUP_TIMEOUT', .05)
+
+        async def hang(event):
+            await asyncio.sleep(10)
+
+        slow, backup = make_tracker('http://slow', hang), make_tracker('http://backup')
+        add_tier(tracker_manager, 0, slow, backup)
+
+        async with tracker_manager:
+            backup.make_request.assert_called_once_with(tracker_client.TrackerEvent.STARTED)
+            assert tracker_manager.tiers == [[backup, slow]]
+            assert slow in tracker_manager._unannounced
+
+    @pytest.mark.asyncio
+    async def test_completed_on_download_event(self, torrent_data):
+        statistics = MagicMock(left=100)
+        tracker_manager = TrackerManager(torrent_data, statistics, port=6881)
+        tracker = make_tracker('http://a')
+        add_tier(tracker_manager, 0, tracker)
+
+        async with tracker_manager:
+            statistics.left = 0
+            tracker_manager.on_download_completed(MagicMock())
+            await asyncio.gather(*tracker_manager.update_tasks)
+            tracker.make_request.assert_called_with(tracker_client.TrackerEvent.COMPLETED)
+
+    @pytest.mark.asyncio
+    async def test_dht_has_no_startup_timeout(self, tracker_manager, monkeypatch):
+        monkeypatch.setattr('configuration.TRACKER_STARTUP_TIMEOUT', .05)
+        dht = AsyncMock(DhtTracker)
+        dht.request_interval = 1800
+        dht.new_peers = asyncio.Queue()
+
+        async def bootstrap(event):
+            await asyncio.sleep(.1)
+            dht.new_peers.put_nowait(('10.0.0.1', 6881))
+
+        dht.make_request = AsyncMock(side_effect=bootstrap)
+        tracker_manager.tracker_clients.append(dht)
+        dead = make_tracker('http://dead', ConnectionError)
+        add_tier(tracker_manager, 0, dead)
+
+        async with tracker_manager:
+            assert not tracker_manager._peers_found.is_set()
+            await asyncio.wait_for(tracker_manager._peers_found.wait(), 1)
+            assert ('10.0.0.1', 6881) in tracker_manager.peer_store
+            assert dht not in tracker_manager._unannounced
+            assert dht in tracker_manager._announce_timers
+
+    @pytest.mark.asyncio
+    async def test_local_peers_are_not_a_stable_tracker(self, tracker_manager):
+        tracker_manager.lsd = LocalServiceDiscovery()
+        tracker_manager.lsd.transport = MagicMock()
+        tracker_manager._add_tracker('local')
+        dead = make_tracker('http://dead', ConnectionError)
+        add_tier(tracker_manager, 0, dead)
+
+        with pytest.raises(BadTorrentTrackers) as excinfo:
+            async with tracker_manager:
+                pass
+        assert excinfo.value.bad_trackers == [dead]
+        tracker_manager.lsd.transport.sendto.assert_called_once()
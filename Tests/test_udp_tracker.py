@@ -0,0 +1,153 @@
+import asyncio
+import socket
+import struct
+import pytest
+from contextlib import asynccontextmanager
+from unittest.mock import MagicMock
+from tracker_client import UdpTrackerClient, UdpTrackerSocket, TrackerEvent
+from tracker_manager import TrackerManager
+
+INFO_HASH = b'\x12' * 20
+PEERS = [('10.0.0.1', 6881), ('10.0.0.2', 6882)]
+
+
+class StandInTracker(asyncio.DatagramProtocol):
+    """Minimal BEP 15 tracker: answers connect, announce and scrape, can drop the first packets"""
+
+    def __init__(self, drop=0):
+        self.drop = drop
+        self.connection_ids = set()
+        self.connects = 0
+        self.announces = []  # (event, port)
+        self.transport = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        if self.drop:
+            self.drop -= 1
+            return
+        connection_id, action, transaction_id = struct.unpack('!QII', data[:16])
+        header = struct.pack('!II', action, transaction_id)
+        if action == UdpTrackerSocket.CONNECT:
+            assert connection_id == UdpTrackerSocket.PROTOCOL_ID
+            self.connects += 1
+            connection_id = 1000 + self.connects
+            self.connection_ids.add(connection_id)
+            self.transport.sendto(header + struct.pack('!Q', connection_id), address)
+        elif connection_id not in self.connection_ids:
+            self.transport.sendto(struct.pack('!II', UdpTrackerSocket.ERROR, transaction_id) + b'bad connection id',
+                                  address)
+        elif action == UdpTrackerSocket.ANNOUNCE:
+            info_hash, peer_id, downloaded, left, uploaded, event, ip, key, num_want, port = \
+                struct.unpack('!20s20sQQQIIIiH', data[16:98])
+            if info_hash != INFO_HASH:
+                self.transport.sendto(struct.pack('!II', UdpTrackerSocket.ERROR, transaction_id) + b'unknown torrent',
+                                      address)
+                return
+            self.announces.append((event, port))
+            peers = b''.join(socket.inet_aton(ip) + struct.pack('!H', port) for ip, port in PEERS)
+            self.transport.sendto(header + struct.pack('!III', 1800, 1, 1) + peers, address)
+        elif action == UdpTrackerSocket.SCRAPE:
+            self.transport.sendto(header + struct.pack('!III', 5, 10, 3), address)
+
+
+@asynccontextmanager
+async def stand_in_tracker(drop=0):
+    tracker = StandInTracker(drop)
+    transport, _ = await asyncio.get_running_loop().create_datagram_endpoint(lambda: tracker,
+                                                                           local_addr=('127.0.0.1', 0))
+    udp_socket = await UdpTrackerSocket.create('127.0.0.1', timeout=0.05, max_retries=3)
+    try:
+        yield f'udp://127.0.0.1:{transport.get_extra_info("sockname")[1]}/announce', tracker, udp_socket
+    finally:
+        udp_socket.close()
+        transport.close()
+
+
+def make_client(url, udp_socket, info_hash=INFO_HASH):
+    return UdpTrackerClient(url, info_hash, '-PC0001-123456789012', 6881,
+                            MagicMock(downloaded=0, uploaded=0, left=100), udp_socket)
+
+
+class TestUdpTracker:
+    def test_bad_url(self):
+        with pytest.raises(ValueError):
+            make_client('udp://tracker.example.com/announce', None)
+
+    @pytest.mark.asyncio
+    async def test_announce(self):
+        async with stand_in_tracker() as (url, tracker, udp_socket):
+            client = make_client(url, udp_socket)
+            await client.make_request(TrackerEvent.STARTED)
+
+            assert tracker.announces == [(2, 6881)]
+            assert client.request_interval == 1800
+            assert {client.new_peers.get_nowait() for _ in PEERS} == set(PEERS)
+
+            await client.make_request(TrackerEvent.CHECK)
+            assert client.new_peers.empty()
+            assert tracker.connects == 1
+
+    @pytest.mark.asyncio
+    async def test_connection_id_is_shared_and_expires(self, monkeypatch):
+        async with stand_in_tracker() as (url, tracker, udp_socket):
+            first, second = make_client(url, udp_socket), make_client(url, udp_socket)
+            await first.make_request(TrackerEvent.STARTED)
+            await second.make_request(TrackerEvent.STARTED)
+            assert tracker.connects == 1
+
+            monkeypatch.setattr('configuration.UDP_TRACKER_CONNECTION_TTL', -1)
+            udp_socket._connections.clear()
+            await first.make_request(TrackerEvent.CHECK)
+            await first.make_request(TrackerEvent.CHECK)
+            assert tracker.connects == 3
+
+    @pytest.mark.asyncio
+    async def test_retransmission(self):
+        async with stand_in_tracker(drop=2) as (url, tracker, udp_socket):
+            client = make_client(url, udp_socket)
+            await client.make_request(TrackerEvent.STARTED)
+            assert tracker.announces == [(2, 6881)]
+
+    @pytest.mark.asyncio
+    async def test_no_answer(self):
+        async with stand_in_tracker(drop=100) as (url, tracker, udp_socket):
+            client = make_client(url, udp_socket)
+            with pytest.raises(ConnectionError, match='did not answer'):
+                await client.make_request(TrackerEvent.STARTED)
+            assert not udp_socket._transactions
+
+    @pytest.mark.asyncio
+    async def test_error_response(self):
+        async with stand_in_tracker() as (url, tracker, udp_socket):
+            client = make_client(url, udp_socket, info_hash=b'\x13' * 20)
+            with pytest.raises(ConnectionError, match='unknown torrent'):
+                await client.make_request(TrackerEvent.STARTED)
+
+    @pytest.mark.asyncio
+    async def test_scrape(self):
+        async with stand_in_tracker() as (url, tracker, udp_socket):
+            assert await make_client(url, udp_socket).scrape() == (5, 10, 3)
+
+    @pytest.mark.asyncio
+    async def test_close_sends_stopped(self):
+        async with stand_in_tracker() as (url, tracker, udp_socket):
+            client = make_client(url, udp_socket)
+            await client.make_request(TrackerEvent.STARTED)
+            await client.close()
+            assert tracker.announces[-1] == (3, 6881)
+            assert udp_socket.transport is not None
+
+    @pytest.mark.asyncio
+    async def test_tracker_manager(self):
+        async with stand_in_tracker() as (url, tracker, udp_socket):
+            torrent_data = MagicMock(torrent_name='test', info_hash=INFO_HASH, total_segments=10, tiers=[[url]])
+            manager = TrackerManager(torrent_data, MagicMock(downloaded=0, uploaded=0, left=100), 6881,
+                                     udp_socket=udp_socket)
+            async with manager:
+                assert type(manager.tracker_clients[0]) is UdpTrackerClient
+                manager.schedule_peers_update()
+                assert set(manager.peer_store.candidates) == set(PEERS)
+            assert [event for event, _ in tracker.announces] == [2, 3]
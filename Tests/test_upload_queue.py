@@ -0,0 +1,117 @@
+import asyncio
+import pytest
+import Message
+from unittest.mock import MagicMock, AsyncMock
+from torrent_statistics import TorrentStatistics
+from upload_queue import UploadQueue
+
+
+@pytest.fixture
+def peer():
+    peer = MagicMock()
+    peer.ip = '10.0.0.1'
+    peer.choked = False
+    peer.is_active = True
+    peer.granted_fast = set()
+    peer.send_message_to_peer = AsyncMock(return_value=True)
+    return peer
+
+
+@pytest.fixture
+def file_writer():
+    file_writer = AsyncMock()
+    file_writer.read_range.side_effect = lambda index, begin, length: bytes(range(256))[begin:begin + length]
+    return file_writer
+
+
+@pytest.fixture
+def statistics():
+    statistics = TorrentStatistics(1024, 4)
+    statistics.update_bitfield(0, True)
+    statistics.update_bitfield(1, True)
+    return statistics
+
+
+@pytest.fixture
+def queue(peer, file_writer, statistics):
+    return UploadQueue(peer, file_writer, statistics, max_requests=3)
+
+
+def sent_blocks(peer):
+    return [(call.args[0].index, call.args[0].byte_offset, call.args[0].data)
+            for call in peer.send_message_to_peer.call_args_list]
+
+
+class TestUploadQueue:
+    @pytest.mark.asyncio
+    async def test_batches_reads_per_piece(self, queue, peer, file_writer, statistics):
+        for request in (Message.RequestsMessage(0, 0, 16), Message.RequestsMessage(1, 0, 16),
+                        Message.RequestsMessage(0, 16, 16)):
+            assert queue.push(request)
+        await queue._task
+
+        assert file_writer.read_range.await_count == 2
+        file_writer.read_range.assert_any_await(0, 0, 32)
+        assert sent_blocks(peer) == [(0, 0, bytes(range(16))), (0, 16, bytes(range(16, 32))),
+                                     (1, 0, bytes(range(16)))]
+        assert statistics.uploaded == 48
+
+    @pytest.mark.asyncio
+    async def test_limit_and_validation(self, queue):
+        assert not queue.push(Message.RequestsMessage(2, 0, 16))
+        assert not queue.push(Message.RequestsMessage(0, 0, 2 ** 20))
+        for offset in range(3):
+            assert queue.push(Message.RequestsMessage(0, offset * 16, 16))
+        assert queue.push(Message.RequestsMessage(0, 0, 16))
+        assert not queue.push(Message.RequestsMessage(0, 64, 16))
+        assert len(queue) == 3
+        assert queue.rejected == 3
+        queue.close()
+
+    @pytest.mark.asyncio
+    async def test_cancel(self, queue, peer):
+        queue.push(Message.RequestsMessage(0, 0, 16))
+        queue.push(Message.RequestsMessage(1, 0, 16))
+        queue.cancel(Message.CancelMessage(1, 0, 16))
+        await queue._task
+
+        assert sent_blocks(peer) == [(0, 0, bytes(range(16)))]
+
+    @pytest.mark.asyncio
+    async def test_cancel_while_reading(self, queue, peer, file_writer):
+        read_started = asyncio.Event()
+
+        async def slow_read(index, begin, length):
+            read_started.set()
+            await asyncio.sleep(0.01)
+            return bytes(length)
+        file_writer.read_range.side_effect = slow_read
+
+        queue.push(Message.RequestsMessage(0, 0, 16))
+        queue.push(Message.RequestsMessage(0, 16, 16))
+        await read_started.wait()
+        queue.cancel(Message.CancelMessage(0, 0, 16))
+        await queue._task
+
+        assert [block[:2] for block in sent_blocks(peer)] == [(0, 16)]
+
+    @pytest.mark.asyncio
+    async def test_choked_peer_queue_is_dropped(self, queue, peer):
+        peer.choked = True
+        queue.push(Message.RequestsMessage(0, 0, 16))
+        await queue._task
+
+        peer.send_message_to_peer.assert_not_awaited()
+        assert len(queue) == 0
+
+    @pytest.mark.asyncio
+    async def test_choked_peer_gets_allowed_fast_pieces(self, queue, peer):
+        peer.choked = True
+        peer.granted_fast = {1}
+        queue.push(Message.RequestsMessage(0, 0, 16))
+        queue.push(Message.RequestsMessage(1, 0, 16))
+        await queue._task
+
+        assert [block[:2] for block in sent_blocks(peer)] == [(1, 0)]
+        rejected = peer.reject_request.call_args.args[0]
+        assert (rejected.index, rejected.byte_offset, rejected.block_len) == (0, 0, 16)
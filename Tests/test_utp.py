@@ -0,0 +1,199 @@
+import asyncio
+import os
+import pytest
+import configuration
+from contextlib import asynccontextmanager
+from unittest.mock import MagicMock, AsyncMock, patch
+from peer_connection import PeerConnection
+from utp import Packet, UtpConnection, UtpSocket, ST_DATA, ST_STATE, ST_FIN, SEQ_MASK
+
+
+class LossySocket(UtpSocket):
+    """Drops the first transmission of every drop_every-th data packet"""
+
+    def __init__(self, drop_every):
+        super().__init__()
+        self.drop_every = drop_every
+        self.data_packets = 0
+        self.dropped = 0
+
+    def send(self, data, address):
+        packet = Packet.decode(data)
+        if packet.type == ST_DATA:
+            self.data_packets += 1
+            if self.data_packets % self.drop_every == 0:
+                self.dropped += 1
+                return
+        super().send(data, address)
+
+
+@asynccontextmanager
+async def loopback(client=None):
+    received = asyncio.Queue()
+
+    async def on_connection(reader, writer):
+        received.put_nowait(await reader.read())
+        writer.close()
+
+    server = await UtpSocket.create('127.0.0.1', 0)
+    server.start_server(on_connection)
+    if client is None:
+        client = await UtpSocket.create('127.0.0.1', 0)
+    else:
+        await asyncio.get_running_loop().create_datagram_endpoint(lambda: client, local_addr=('127.0.0.1', 0))
+    try:
+        yield client, server, received
+    finally:
+        client.close()
+        server.close()
+        client.timers.close()
+        server.timers.close()
+
+
+def make_connection():
+    utp_socket = MagicMock()
+    connection = UtpConnection(utp_socket, ('127.0.0.1', 6881), 10, 11)
+    connection.state = UtpConnection.CONNECTED
+    connection.connected.set_result(True)
+    return connection, utp_socket
+
+
+def test_packet_round_trip():
+    packet = Packet(ST_DATA, 1234, 7, 5, window=65536, timestamp=42, timestamp_diff=17, sack=b'\x05\x00\x00\x00',
+                    payload=b'payload')
+
+    decoded = Packet.decode(packet.encode())
+
+    assert (decoded.type, decoded.connection_id, decoded.seq_nr, decoded.ack_nr) == (ST_DATA, 1234, 7, 5)
+    assert (decoded.window, decoded.timestamp, decoded.timestamp_diff) == (65536, 42, 17)
+    assert decoded.sack == b'\x05\x00\x00\x00'
+    assert decoded.payload == b'payload'
+
+
+def test_packet_decode_rejects_garbage():
+    with pytest.raises(ValueError):
+        Packet.decode(b'\x01\x02')
+    with pytest.raises(ValueError):
+        Packet.decode(b'\xf1' + bytes(19))
+
+
+@pytest.mark.asyncio
+async def test_loopback_transfer():
+    data = os.urandom(300_000)
+    async with loopback() as (client, server, received):
+        reader, writer = await client.open_connection('127.0.0.1', server.port)
+        writer.write(data)
+        await writer.drain()
+        writer.close()
+
+        assert await asyncio.wait_for(received.get(), 10) == data
+        assert await asyncio.wait_for(reader.read(), 10) == b''
+
+
+@pytest.mark.asyncio
+async def test_transfer_recovers_lost_packets():
+    data = os.urandom(200_000)
+    async with loopback(LossySocket(drop_every=10)) as (client, server, received):
+        reader, writer = await client.open_connection('127.0.0.1', server.port)
+        writer.write(data)
+        writer.close()
+
+        assert await asyncio.wait_for(received.get(), 20) == data
+        assert client.dropped > 0
+
+
+@pytest.mark.asyncio
+async def test_connect_timeout(monkeypatch):
+    monkeypatch.setattr(configuration, 'UTP_CONNECT_TIMEOUT', .2)
+    silent = await UtpSocket.create('127.0.0.1', 0)
+    client = await UtpSocket.create('127.0.0.1', 0)
+    try:
+        with pytest.raises(asyncio.TimeoutError):
+            await client.open_connection('127.0.0.1', silent.port)
+        assert not client.connections
+    finally:
+        client.close()
+        silent.close()
+        client.timers.close()
+
+
+@pytest.mark.asyncio
+async def test_out_of_order_data_is_reassembled_and_selectively_acked():
+    connection, _ = make_connection()
+    connection.ack_nr = 100
+
+    connection._process_data(Packet(ST_DATA, 10, 103, 0, payload=b'c'))
+    connection._process_data(Packet(ST_DATA, 10, 102, 0, payload=b'b'))
+
+    assert connection.ack_nr == 100
+    assert connection._selective_ack() == b'\x03\x00\x00\x00'
+
+    connection._process_data(Packet(ST_DATA, 10, 101, 0, payload=b'a'))
+    connection._process_data(Packet(ST_FIN, 10, 104, 0))
+
+    assert connection.ack_nr == 104
+    assert connection._selective_ack() == b''
+    assert await connection.reader.read() == b'abc'
+
+
+@pytest.mark.asyncio
+async def test_sequence_numbers_wrap_around():
+    connection, _ = make_connection()
+    connection.ack_nr = SEQ_MASK - 1
+
+    connection._process_data(Packet(ST_DATA, 10, 0, 0, payload=b'b'))
+    connection._process_data(Packet(ST_DATA, 10, SEQ_MASK, 0, payload=b'a'))
+
+    assert connection.ack_nr == 0
+    assert connection.reader._buffer == b'ab'
+
+
+@pytest.mark.asyncio
+async def test_selective_ack_triggers_fast_retransmit():
+    connection, utp_socket = make_connection()
+    connection.max_window = connection.peer_window = 10 * configuration.UTP_PACKET_SIZE
+    connection.write(bytes(5 * configuration.UTP_PACKET_SIZE))
+    first_seq = min(connection._in_flight)
+    sent = utp_socket.send.call_count
+
+    connection._process_ack(Packet(ST_STATE, 11, 0, first_seq, window=2 ** 20, sack=b'\x07\x00\x00\x00'))
+
+    assert set(connection._in_flight) == {(first_seq + 1) & SEQ_MASK}
+    assert connection.retransmitted == 1
+    assert Packet.decode(utp_socket.send.call_args_list[sent].args[0]).seq_nr == (first_seq + 1) & SEQ_MASK
+    assert connection.max_window < 6 * configuration.UTP_PACKET_SIZE
+    connection._shutdown()
+
+
+@pytest.mark.asyncio
+async def test_ledbat_window_follows_queuing_delay():
+    connection, _ = make_connection()
+    connection.max_window = 100_000
+
+    connection._update_window(1_000, 10_000)
+    assert connection.queuing_delay == 0
+    assert connection.max_window > 100_000
+
+    grown = connection.max_window
+    connection._update_window(1_000 + 300_000, 10_000)
+    assert connection.queuing_delay == pytest.approx(.3)
+    assert connection.max_window < grown
+
+    for _ in range(1000):
+        connection._update_window(1_000 + 300_000, 10_000)
+    assert connection.max_window == configuration.UTP_MIN_WINDOW
+
+
+@pytest.mark.asyncio
+async def test_peer_connection_falls_back_to_tcp():
+    transport = MagicMock()
+    transport.open_connection = AsyncMock(side_effect=asyncio.TimeoutError)
+    peer = PeerConnection('127.0.0.1', 8, b'\x00' * 20, 6881, transport=transport)
+    streams = (MagicMock(), MagicMock())
+
+    with patch('asyncio.open_connection', AsyncMock(return_value=streams)) as open_connection:
+        assert await peer.connect()
+
+    transport.open_connection.assert_awaited_once_with('127.0.0.1', 6881)
+    open_connection.assert_awaited_once_with('127.0.0.1', 6881)
+    assert (peer.reader, peer.writer) == streams
@@ -0,0 +1,199 @@
+import asyncio
+import hashlib
+import pytest
+from contextlib import asynccontextmanager
+from unittest.mock import MagicMock, AsyncMock
+from aiohttp import web
+from segment_downloader import SegmentDownloadStatus
+from torrent_downloader import Downloader
+from torrent_statistics import TorrentStatistics
+from web_seed import WebSeed, WebSeedError
+from http_client import HttpClient
+
+SEGMENT_LENGTH = 1024
+FILES = [('file1.bin', 1500), ('sub dir/file2.bin', 2000), ('file3.bin', 596)]
+
+
+@pytest.fixture
+def content():
+    return bytes(range(256)) * 16
+
+
+@pytest.fixture
+def torrent(tmp_path, content):
+    root = tmp_path / 'mirror' / 'test torrent'
+    offset = 0
+    files = []
+    for name, length in FILES:
+        path = root / name
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_bytes(content[offset:offset + length])
+        offset += length
+        files.append({'length': length, 'path': name.split('/')})
+
+    torrent = MagicMock()
+    torrent.torrent_name = 'test torrent'
+    torrent.files = files
+    torrent.segment_length = SEGMENT_LENGTH
+    torrent.total_length = len(content)
+    torrent.total_segments = len(content) // SEGMENT_LENGTH
+    torrent.segments_hash = [hashlib.sha1(content[i:i + SEGMENT_LENGTH]).digest()
+                             for i in range(0, len(content), SEGMENT_LENGTH)]
+    torrent.url_list = []
+    return torrent
+
+
+@asynccontextmanager
+async def mirror(directory):
+    requests = []
+
+    @web.middleware
+    async def count_requests(request, handler):
+        requests.append(request.headers.get('Range'))
+        return await handler(request)
+
+    app = web.Application(middlewares=[count_requests])
+    app.router.add_static('/', directory)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    port = runner.addresses[0][1]
+    try:
+        yield f'http://127.0.0.1:{port}/', requests
+    finally:
+        await runner.cleanup()
+
+
+@asynccontextmanager
+async def broken_mirror(root, status):
+    async def whole_file(request):
+        return web.Response(status=status, body=(root / request.match_info['path']).read_bytes())
+
+    app = web.Application()
+    app.router.add_get('/{path:.*}', whole_file)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', 0)
+    await site.start()
+    try:
+        yield f'http://127.0.0.1:{runner.addresses[0][1]}/'
+    finally:
+        await runner.cleanup()
+
+
+class TestWebSeed:
+    def test_file_url(self, torrent):
+        assert WebSeed('http://mirror/', torrent).file_url(torrent.files[1]) == \
+               'http://mirror/test%20torrent/sub%20dir/file2.bin'
+
+        torrent.files = torrent.files[:1]
+        assert WebSeed('http://mirror/data.bin', torrent).file_url(torrent.files[0]) == 'http://mirror/data.bin'
+        assert WebSeed('http://mirror/', torrent).file_url(torrent.files[0]) == 'http://mirror/test%20torrent'
+
+    def test_file_ranges(self, torrent):
+        ranges = WebSeed('http://mirror/', torrent).file_ranges(1024, 2048)
+        assert [(start, size) for _, start, size in ranges] == [(1024, 476), (0, 1572)]
+
+    @pytest.mark.asyncio
+    async def test_fetch_across_files(self, tmp_path, torrent, content):
+        async with mirror(tmp_path / 'mirror') as (url, requests):
+            web_seed = WebSeed(url, torrent)
+            try:
+                assert await web_seed.fetch_segments(1, 3) == content[1024:4096]
+                assert requests == ['bytes=1024-1499', 'bytes=0-1999', 'bytes=0-595']
+                assert web_seed.downloaded == 3072
+            finally:
+                await web_seed.close()
+
+    @pytest.mark.asyncio
+    async def test_range_ignored(self, tmp_path, torrent, content):
+        http_client = HttpClient(max_response_size=1024)
+        async with broken_mirror(tmp_path / 'mirror', 200) as url:
+            web_seed = WebSeed(url, torrent, http_client=http_client)
+            try:
+                assert await web_seed.fetch(1024, 1000) == content[1024:2024]
+            finally:
+                await http_client.close()
+
+    @pytest.mark.asyncio
+    async def test_oversized_response(self, tmp_path, torrent):
+        http_client = HttpClient()
+        async with broken_mirror(tmp_path / 'mirror', 206) as url:
+            web_seed = WebSeed(url, torrent, http_client=http_client)
+            try:
+                with pytest.raises(WebSeedError):
+                    await web_seed.fetch(0, 100)
+            finally:
+                await http_client.close()
+
+    @pytest.mark.asyncio
+    async def test_fetch_missing_file(self, tmp_path, torrent):
+        async with mirror(tmp_path) as (url, _):
+            web_seed = WebSeed(url, torrent)
+            try:
+                with pytest.raises(WebSeedError):
+                    await web_seed.fetch(0, 100)
+            finally:
+                await web_seed.close()
+
+
+class TestWebSeedDownload:
+    @pytest.mark.asyncio
+    async def test_download_from_mirror(self, tmp_path, torrent, content):
+        file_writer = AsyncMock()
+        file_writer.check_segment_download.return_value = False
+        statistics = TorrentStatistics(torrent.total_length, torrent.total_segments)
+
+        async with mirror(tmp_path / 'mirror') as (url, _):
+            torrent.url_list = [url]
+            downloader = Downloader(torrent, file_writer, statistics, asyncio.Queue())
+            completed = []
+            downloader.completed_event.subscribe(completed.append)
+            try:
+                await asyncio.wait_for(downloader.download_torrent(seed=False), 5)
+                assert completed == [downloader]
+            finally:
+                downloader.close()
+                await asyncio.gather(*downloader._web_seed_tasks, return_exceptions=True)
+
+        assert all(segment.status == SegmentDownloadStatus.SUCCESS for segment in downloader.available_segments)
+        assert statistics.downloaded == len(content)
+        written = {call.args[0]: bytes(call.args[1]) for call in file_writer.write_segment.call_args_list}
+        assert b''.join(written[i] for i in range(torrent.total_segments)) == content
+
+    @pytest.mark.asyncio
+    async def test_corrupt_segment_is_released(self, tmp_path, torrent):
+        torrent.segments_hash[1] = b'\x00' * 20
+        downloader = Downloader(torrent, AsyncMock(), TorrentStatistics(torrent.total_length, 4), asyncio.Queue())
+        async with mirror(tmp_path / 'mirror') as (url, _):
+            web_seed = WebSeed(url, torrent)
+            try:
+                run = downloader.take_segment_run(2)
+                assert [segment.id for segment in run] == [0, 1]
+                assert not await downloader.download_from_web_seed(web_seed, run)
+            finally:
+                await web_seed.close()
+
+        assert run[0].status == SegmentDownloadStatus.SUCCESS
+        assert run[1].status == SegmentDownloadStatus.NOT_STARTED
+        assert web_seed.failures == 1
+        assert web_seed.corrupt_segments == {1}
+        assert downloader.segments_left == 3
+        assert [segment.id for segment in downloader.take_segment_run(4, exclude=web_seed.corrupt_segments)] == [2, 3]
+
+    @pytest.mark.asyncio
+    async def test_corrupt_segment_is_not_refetched(self, tmp_path, torrent, monkeypatch):
+        monkeypatch.setattr('configuration.WEB_SEED_RETRY_DELAY', .01)
+        torrent.segments_hash[1] = b'\x00' * 20
+        downloader = Downloader(torrent, AsyncMock(), TorrentStatistics(torrent.total_length, 4), asyncio.Queue())
+        async with mirror(tmp_path / 'mirror') as (url, requests):
+            web_seed = WebSeed(url, torrent)
+            task = asyncio.create_task(downloader.web_seed_task(web_seed))
+            await asyncio.sleep(.3)
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+        assert downloader.segments_left == 1
+        assert downloader.available_segments[1].status == SegmentDownloadStatus.NOT_STARTED
+        assert len(requests) <= 6
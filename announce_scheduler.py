@@ -0,0 +1,34 @@
+import bisect
+import random
+import configuration
+
+from timer_scheduler import TimerScheduler, Timer
+
+
+class AnnounceScheduler:
+    """
+    Session-wide timing of tracker announces. Delays get a random positive jitter and announces
+    of all torrents are kept at least `spacing` seconds apart, so trackers never see a burst from one client.
+    """
+
+    def __init__(self, timers: TimerScheduler = None, jitter=configuration.ANNOUNCE_JITTER,
+                 spacing=configuration.ANNOUNCE_SPACING):
+        self.timers = timers if timers is not None else TimerScheduler()
+        self.jitter = jitter
+        self.spacing = spacing
+        self._due = []  # sorted times of pending announces
+
+    def call_later(self, delay, callback, *args) -> Timer:
+        now = self.timers.time()
+        del self._due[:bisect.bisect_left(self._due, now)]
+
+        when = self._free_slot(now + delay * (1 + random.uniform(0, self.jitter)))
+        bisect.insort(self._due, when)
+        return self.timers.call_at(when, callback, *args)
+
+    def _free_slot(self, when) -> float:
+        for due in self._due[bisect.bisect_left(self._due, when - self.spacing):]:
+            if due >= when + self.spacing:
+                break
+            when = due + self.spacing
+        return when
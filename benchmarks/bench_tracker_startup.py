@@ -0,0 +1,98 @@
+"""
+Time to first peer at startup for a torrent whose announce-list has dead and slow trackers before a good one:
+the previous sequential STARTED announces compared with the concurrent TrackerManager startup.
+Run from the project root: python -m benchmarks.bench_tracker_startup
+"""
+import asyncio
+import socket
+import struct
+import time
+from unittest.mock import MagicMock
+
+import bencode
+from aiohttp import web
+
+import configuration
+from http_client import HttpClient
+from tracker_client import HttpTrackerClient, TrackerEvent
+from tracker_manager import TrackerManager
+
+DEAD_TRACKERS = 4
+SLOW_TRACKERS = 3
+SLOW_DELAY = .5
+STARTUP_TIMEOUT = 1
+INFO_HASH = b'\x12' * 20
+
+
+async def run_trackers():
+    async def dead(request):
+        await asyncio.sleep(60)
+        return web.Response(status=504)
+
+    async def slow(request):
+        await asyncio.sleep(SLOW_DELAY)
+        return web.Response(body=bencode.encode({'interval': 1800, 'peers': b''}))
+
+    async def good(request):
+        peers = socket.inet_aton('10.0.0.1') + struct.pack('!H', 6881)
+        return web.Response(body=bencode.encode({'interval': 1800, 'peers': peers}))
+
+    app = web.Application()
+    app.router.add_get('/dead', dead)
+    app.router.add_get('/slow', slow)
+    app.router.add_get('/good', good)
+    runner = web.AppRunner(app, shutdown_timeout=0)
+    await runner.setup()
+    tiers = []
+    for path in ['/dead'] * DEAD_TRACKERS + ['/slow'] * SLOW_TRACKERS + ['/good']:
+        site = web.TCPSite(runner, '127.0.0.1', 0)  # a port per tracker, as trackers are separate hosts
+        await site.start()
+        tiers.append([f'http://127.0.0.1:{runner.addresses[-1][1]}{path}'])
+    return runner, tiers
+
+
+async def sequential(torrent_data, statistics, http_client) -> float:
+    started = time.perf_counter()
+    for [url] in torrent_data.tiers:
+        tracker = HttpTrackerClient(url, INFO_HASH, '-PC0001-000000000000', 6881, statistics, http_client)
+        try:
+            await asyncio.wait_for(tracker.make_request(TrackerEvent.STARTED), STARTUP_TIMEOUT)
+            if not tracker.new_peers.empty():
+                return time.perf_counter() - started
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+
+
+async def concurrent(torrent_data, statistics, http_client) -> float:
+    started = time.perf_counter()
+    manager = TrackerManager(torrent_data, statistics, 6881, http_client=http_client)
+    await manager.__aenter__()
+    elapsed = time.perf_counter() - started
+    for task in list(manager.update_tasks):
+        task.cancel()
+    for timer in manager._announce_timers.values():
+        timer.cancel()
+    assert len(manager.peer_store)
+    return elapsed
+
+
+async def main():
+    configuration.TRACKER_STARTUP_TIMEOUT = STARTUP_TIMEOUT
+    runner, tiers = await run_trackers()
+    torrent_data = MagicMock(torrent_name='bench', info_hash=INFO_HASH, total_segments=8, tiers=tiers)
+    statistics = MagicMock(downloaded=0, uploaded=0, left=100)
+    http_client = HttpClient()
+    try:
+        print(f'{DEAD_TRACKERS} dead and {SLOW_TRACKERS} slow trackers before the good one, '
+              f'{STARTUP_TIMEOUT} s startup timeout')
+        elapsed = await sequential(torrent_data, statistics, http_client)
+        print(f'Sequential announces: first peer after {elapsed:.3f} s')
+        elapsed = await concurrent(torrent_data, statistics, http_client)
+        print(f'Concurrent announces: first peer after {elapsed:.3f} s')
+    finally:
+        await http_client.close()
+        await runner.cleanup()
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
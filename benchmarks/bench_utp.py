@@ -0,0 +1,136 @@
+"""
+Loopback bulk transfer over TCP and over uTP (LEDBAT): throughput and the queuing delay the transfer
+induces, measured as the round trip of small UDP probes sent while the transfer runs.
+Run from the project root: python -m benchmarks.bench_utp
+"""
+import asyncio
+import statistics
+import time
+
+from utp import UtpSocket
+
+TRANSFER_BYTES = 32 * 2 ** 20
+CHUNK = 2 ** 16
+PROBE_INTERVAL = .005
+
+
+class EchoProtocol(asyncio.DatagramProtocol):
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def datagram_received(self, data, address):
+        self.transport.sendto(data, address)
+
+
+class ProbeProtocol(asyncio.DatagramProtocol):
+    def __init__(self):
+        self.sent = {}
+        self.rtts = []
+
+    def datagram_received(self, data, address):
+        sent_at = self.sent.pop(data, None)
+        if sent_at is not None:
+            self.rtts.append(time.perf_counter() - sent_at)
+
+
+async def probe(done: asyncio.Event) -> list[float]:
+    loop = asyncio.get_running_loop()
+    echo, _ = await loop.create_datagram_endpoint(EchoProtocol, local_addr=('127.0.0.1', 0))
+    transport, prober = await loop.create_datagram_endpoint(ProbeProtocol,
+                                                            remote_addr=echo.get_extra_info('sockname'))
+    sequence = 0
+    while not done.is_set():
+        payload = sequence.to_bytes(4, 'big')
+        prober.sent[payload] = time.perf_counter()
+        transport.sendto(payload)
+        sequence += 1
+        await asyncio.sleep(PROBE_INTERVAL)
+    transport.close()
+    echo.close()
+    return prober.rtts
+
+
+async def transfer(open_connection):
+    done = asyncio.Event()
+    probes = asyncio.create_task(probe(done))
+    await asyncio.sleep(.1)
+
+    reader, writer = await open_connection()
+    chunk = bytes(CHUNK)
+    ledbat_delays = []
+    started = time.perf_counter()
+    for _ in range(TRANSFER_BYTES // CHUNK):
+        writer.write(chunk)
+        await writer.drain()
+        if hasattr(writer, 'queuing_delay'):
+            ledbat_delays.append(writer.queuing_delay)
+    writer.write_eof()
+    received = await reader.read()
+    writer.close()
+    elapsed = time.perf_counter() - started
+
+    done.set()
+    rtts = await probes
+    return int(received), elapsed, rtts, max(ledbat_delays, default=None)
+
+
+async def bench_tcp():
+    async def sink(reader, writer):
+        received = 0
+        while chunk := await reader.read(CHUNK):
+            received += len(chunk)
+        writer.write(str(received).encode())
+        writer.close()
+
+    server = await asyncio.start_server(sink, '127.0.0.1', 0)
+    port = server.sockets[0].getsockname()[1]
+
+    result = await transfer(lambda: asyncio.open_connection('127.0.0.1', port))
+    server.close()
+    return result
+
+
+async def bench_utp():
+    async def sink(reader, writer):
+        received = 0
+        while chunk := await reader.read(CHUNK):
+            received += len(chunk)
+        writer.write(str(received).encode())
+        writer.close()
+
+    server = await UtpSocket.create('127.0.0.1', 0)
+    server.start_server(sink)
+    client = await UtpSocket.create('127.0.0.1', 0)
+
+    result = await transfer(lambda: client.open_connection('127.0.0.1', server.port))
+    client.close()
+    server.close()
+    client.timers.close()
+    server.timers.close()
+    return result
+
+
+def report(name, received, elapsed, rtts, ledbat_delay):
+    rtts = sorted(rtts) or [0]
+    line = (f"{name:>4}: {received / elapsed / 2 ** 20:8.1f} MiB/s, "
+            f"probe RTT median {statistics.median(rtts) * 1000:6.2f} ms, "
+            f"p95 {rtts[int(len(rtts) * .95) - 1] * 1000:6.2f} ms")
+    if ledbat_delay is not None:
+        line += f", LEDBAT queuing delay max {ledbat_delay * 1000:6.2f} ms"
+    print(line)
+
+
+async def main():
+    idle = asyncio.Event()
+    idle_probes = asyncio.create_task(probe(idle))
+    await asyncio.sleep(1)
+    idle.set()
+    rtts = sorted(await idle_probes)
+    print(f"idle: probe RTT median {statistics.median(rtts) * 1000:6.2f} ms")
+
+    report('tcp', *await bench_tcp())
+    report('utp', *await bench_utp())
+
+
+if __name__ == '__main__':
+    asyncio.run(main())
@@ -0,0 +1,130 @@
+import configuration
+
+from array import array
+
+
+class BlockTable:
+    """
+    Block bookkeeping of one in-flight piece, kept in flat arrays instead of per-block objects.
+    Every block has max_requests request slots (more than one is used only in endgame),
+    a slot holds the requester id (0 - free), the request time and the request deadline.
+    The id of the requester that delivered a block is kept in senders.
+    """
+
+    MISSING = 0
+    PENDING = 1
+    RECEIVED = 2
+
+    def __init__(self, blocks_count, max_requests=configuration.ENDGAME_MAX_REQUESTS_PER_BLOCK):
+        self.blocks_count = blocks_count
+        self.max_requests = max_requests
+
+        slots_count = blocks_count * max_requests
+        self.states = array('B', bytes(blocks_count))
+        self.senders = array('H', bytes(2 * blocks_count))
+        self.requesters = array('H', bytes(2 * slots_count))
+        self.requested_at = array('d', bytes(8 * slots_count))
+        self.deadlines = array('d', bytes(8 * slots_count))
+
+        self.missing_count = blocks_count
+        self.received_count = 0
+        self._missing_cursor = 0
+
+    def reset(self):
+        for table in (self.states, self.senders, self.requesters, self.requested_at, self.deadlines):
+            memoryview(table).cast('B')[:] = bytes(len(table) * table.itemsize)
+        self.missing_count = self.blocks_count
+        self.received_count = 0
+        self._missing_cursor = 0
+
+    @property
+    def is_complete(self) -> bool:
+        return self.received_count == self.blocks_count
+
+    def next_missing(self) -> int | None:
+        while self._missing_cursor < self.blocks_count and self.states[self._missing_cursor] != self.MISSING:
+            self._missing_cursor += 1
+        return self._missing_cursor if self._missing_cursor < self.blocks_count else None
+
+    def pending(self) -> list[int]:
+        return [index for index in range(self.blocks_count) if self.states[index] == self.PENDING]
+
+    def requesters_of(self, index) -> list[int]:
+        base = index * self.max_requests
+        return [requester for requester in self.requesters[base:base + self.max_requests] if requester]
+
+    def requests_of(self, requester) -> list[int]:
+        return [slot // self.max_requests for slot in range(len(self.requesters))
+                if self.requesters[slot] == requester]
+
+    def add_request(self, index, requester, now, timeout) -> bool:
+        if self.states[index] == self.RECEIVED or self._find(index, requester) is not None:
+            return False
+        slot = self._find(index, 0)
+        if slot is None:
+            return False
+
+        self.requesters[slot] = requester
+        self.requested_at[slot] = now
+        self.deadlines[slot] = now + timeout
+        if self.states[index] == self.MISSING:
+            self.states[index] = self.PENDING
+            self.missing_count -= 1
+        return True
+
+    def remove_request(self, index, requester) -> float | None:
+        """Returns the request time or None if the block was not requested from requester"""
+        slot = self._find(index, requester)
+        if slot is None:
+            return None
+        requested_at = self.requested_at[slot]
+        self._clear(slot)
+        if self.states[index] == self.PENDING and not self.requesters_of(index):
+            self._set_missing(index)
+        return requested_at
+
+    def remove_requester(self, requester) -> list[int]:
+        indexes = self.requests_of(requester)
+        for index in indexes:
+            self.remove_request(index, requester)
+        return indexes
+
+    def mark_received(self, index, sender=0) -> list[int]:
+        """Returns the other requesters of the block, their requests became redundant"""
+        if self.states[index] == self.RECEIVED:
+            return []
+        requesters = [requester for requester in self.requesters_of(index) if requester != sender]
+        base = index * self.max_requests
+        for slot in range(base, base + self.max_requests):
+            self._clear(slot)
+        if self.states[index] == self.MISSING:
+            self.missing_count -= 1
+        self.states[index] = self.RECEIVED
+        self.senders[index] = sender
+        self.received_count += 1
+        return requesters
+
+    def expired(self, now) -> list[tuple[int, int]]:
+        return [(slot // self.max_requests, self.requesters[slot]) for slot in range(len(self.requesters))
+                if self.requesters[slot] and self.deadlines[slot] <= now]
+
+    def next_deadline(self) -> float | None:
+        deadlines = [self.deadlines[slot] for slot in range(len(self.requesters)) if self.requesters[slot]]
+        return min(deadlines, default=None)
+
+    def _find(self, index, requester) -> int | None:
+        base = index * self.max_requests
+        for slot in range(base, base + self.max_requests):
+            if self.requesters[slot] == requester:
+                return slot
+        return None
+
+    def _clear(self, slot):
+        self.requesters[slot] = 0
+        self.requested_at[slot] = 0
+        self.deadlines[slot] = 0
+
+    def _set_missing(self, index):
+        self.states[index] = self.MISSING
+        self.missing_count += 1
+        self._missing_cursor = min(self._missing_cursor, index)
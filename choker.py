@@ -0,0 +1,112 @@
+import asyncio
+import logging
+import math
+import random
+import time
+import configuration
+import Message
+
+from peer_connection import PeerConnection
+from timer_scheduler import TimerScheduler
+
+
+class Choker:
+    """
+    Tit-for-tat choker (BEP 3) of one torrent.
+    Every RECHOKE_INTERVAL the interested peers with the best rate get the upload slots, one more slot
+    is given to a random peer every OPTIMISTIC_UNCHOKE_INTERVAL. Peers are ranked by download rate from them
+    while downloading and by upload rate to them while seeding.
+    """
+
+    def __init__(self, peers: list[PeerConnection], timers: TimerScheduler, is_seeding,
+                 upload_slots=configuration.UPLOAD_SLOTS):
+        self.peers = peers
+        self.timers = timers
+        self.is_seeding = is_seeding
+        self.upload_slots = upload_slots
+
+        self.optimistic_peer = None
+        self.rates = {}
+        self.upload_rate = 0
+
+        self._transferred = {}
+        self._last_rechoke = None
+        self._rounds = 0
+        self._timer = None
+
+    @property
+    def slots(self) -> int:
+        if self.upload_slots is not None:
+            return self.upload_slots
+        auto_slots = int(math.sqrt(self.upload_rate / 1024 * 0.6))
+        return min(max(auto_slots, configuration.MIN_UPLOAD_SLOTS), configuration.MAX_UPLOAD_SLOTS)
+
+    def start(self):
+        if self._timer is None:
+            self._schedule()
+
+    def _schedule(self):
+        self._timer = self.timers.call_later(configuration.RECHOKE_INTERVAL, self._on_rechoke_deadline)
+
+    def _on_rechoke_deadline(self):
+        self._schedule()
+        self.rechoke()
+
+    def rechoke(self):
+        optimistic_round = self._rounds % (configuration.OPTIMISTIC_UNCHOKE_INTERVAL // configuration.RECHOKE_INTERVAL)
+        self._rounds += 1
+        self.update_rates()
+
+        candidates = [peer for peer in self.peers if peer.is_active and peer.peer_interested]
+        candidates.sort(key=lambda peer: self.rates.get(peer, 0), reverse=True)
+        regular_slots = max(self.slots - 1, 0)
+        unchoked = set(candidates[:regular_slots])
+
+        if optimistic_round == 0 or self.optimistic_peer not in candidates:
+            self.optimistic_peer = self.pick_optimistic(candidates[regular_slots:])
+        if self.optimistic_peer is not None:
+            unchoked.add(self.optimistic_peer)
+
+        for peer in self.peers:
+            self.set_choked(peer, peer not in unchoked)
+
+    def pick_optimistic(self, candidates) -> PeerConnection | None:
+        if not candidates:
+            return None
+        return random.choice(candidates)
+
+    def update_rates(self):
+        now = time.monotonic()
+        elapsed = now - self._last_rechoke if self._last_rechoke is not None else configuration.RECHOKE_INTERVAL
+        self._last_rechoke = now
+
+        seeding = self.is_seeding()
+        transferred = {peer: (peer.downloaded, peer.uploaded) for peer in self.peers}
+        self.rates = {}
+        total_uploaded = 0
+        for peer, (downloaded, uploaded) in transferred.items():
+            last_downloaded, last_uploaded = self._transferred.get(peer, (0, 0))
+            self.rates[peer] = ((uploaded - last_uploaded) if seeding else (downloaded - last_downloaded)) / elapsed
+            total_uploaded += uploaded - last_uploaded
+        self._transferred = transferred
+        self.upload_rate = total_uploaded / elapsed if elapsed > 0 else 0
+
+    def set_choked(self, peer: PeerConnection, choked: bool):
+        if peer.choked == choked:
+            return
+        logging.debug(f"{'Choking' if choked else 'Unchoking'} peer {peer.ip}")
+        peer.choked = choked
+        message = Message.ChokedMessage() if choked else Message.UnChokedMessage()
+        asyncio.create_task(peer.send_message_to_peer(message))
+
+    def on_interest_changed(self, peer: PeerConnection):
+        if not peer.peer_interested:
+            return
+        unchoked = sum(1 for other in self.peers if not other.choked and other.peer_interested)
+        if unchoked < self.slots:
+            self.set_choked(peer, False)
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
@@ -2,19 +2,141 @@ import logging
 
 LOGGING_LEVEL = logging.INFO
 
-USE_LOCAL_PEERS = False
+USE_LOCAL_PEERS = True
 USE_HTTP_PEERS = True
 
+LSD_ANNOUNCE_INTERVAL = 5 * 60
+LSD_MIN_ANNOUNCE_INTERVAL = 60
+LSD_MULTICAST_TTL = 1
+
 MAX_PEER_COUNT = 50
 MAX_PEER_PEERS_PER_SEGMENT = 1
 MAX_SEGMENTS_DOWNLOADING_SIMULTANEOUSLY = 5
 
+BLOCK_LENGTH = 2 ** 14
+
 MAX_STRIKES_PER_PEER = 5
-MAX_PENDING_BLOCKS = 5
+MIN_PIPELINE_DEPTH = 2
+MAX_PIPELINE_DEPTH = 250
+PIPELINE_BDP_FACTOR = 2
+PIPELINE_RATE_WINDOW = 1
+
+INITIAL_BLOCK_TIMEOUT = 5
+MIN_BLOCK_TIMEOUT = 1
+MAX_BLOCK_TIMEOUT = 60
+MAX_BLOCK_TIMEOUT_BACKOFF = 8
+
+UNCHOKE_TIMEOUT = 10
+KEEP_ALIVE_INTERVAL = 90
+PEER_IDLE_TIMEOUT = 180
+
+ENDGAME_MAX_PEERS_PER_SEGMENT = 4
+ENDGAME_MAX_REQUESTS_PER_BLOCK = 2
+
+FAST_EXTENSION = True
+ALLOWED_FAST_COUNT = 10
+
+EXTENSION_PROTOCOL = True
+CLIENT_VERSION = 'PyTorrent 1.0'
+PEX_INTERVAL = 60
+PEX_MAX_PEERS = 50
+
+PRUNE_INTERVAL = 30
+UNINTERESTED_PEER_TIMEOUT = 120
+PRUNED_PEER_RECONNECT_DELAY = 600
+
+SUPER_SEEDING = False
+
+HTTP_MAX_CONNECTIONS = 100
+HTTP_MAX_CONNECTIONS_PER_HOST = 4
+HTTP_KEEPALIVE_TIMEOUT = 60
+HTTP_DNS_CACHE_TTL = 10 * 60
+HTTP_MAX_RESPONSE_SIZE = 2 ** 20
+HTTP_TIMEOUT = 30
+
+WEB_SEED_CONNECTIONS = 2
+WEB_SEED_TIMEOUT = 30
+WEB_SEED_MAX_RUN = 4
+WEB_SEED_RETRY_DELAY = 5
+WEB_SEED_MAX_FAILURES = 5
+
+RECHOKE_INTERVAL = 10
+OPTIMISTIC_UNCHOKE_INTERVAL = 30
+UPLOAD_SLOTS = None
+MIN_UPLOAD_SLOTS = 4
+MAX_UPLOAD_SLOTS = 20
+
+MAX_UPLOAD_REQUESTS_PER_PEER = 250
+MAX_UPLOAD_REQUEST_LENGTH = 2 ** 17
+
+MAX_HASH_FAILURES_PER_PEER = 3
+MAX_FAILED_PIECE_RECORDS = 2
+
+HASH_WORKERS = 2
+HASH_MAX_PENDING = 8
+HASH_USE_PROCESSES = False
+INLINE_HASH_LIMIT = 2 ** 16
+PIECE_POOL_BYTES = 2 ** 26
+
+USE_UTP = False
+UTP_CONNECT_TIMEOUT = 10
+UTP_PACKET_SIZE = 1380
+UTP_INITIAL_WINDOW = 2 * UTP_PACKET_SIZE
+UTP_MIN_WINDOW = 2 * UTP_PACKET_SIZE
+UTP_MAX_WINDOW = 2 ** 22
+UTP_RECV_WINDOW = 2 ** 20
+UTP_WRITE_HIGH_WATER = 2 ** 16
+UTP_TARGET_DELAY = 0.1
+UTP_MAX_WINDOW_INCREASE = 3000
+UTP_BASE_DELAY_INTERVAL = 60
+UTP_BASE_DELAY_HISTORY = 2
+UTP_INITIAL_RTO = 1
+UTP_MIN_RTO = 0.5
+UTP_MAX_RTO = 60
+UTP_MAX_RETRANSMISSIONS = 6
+UTP_DUPLICATE_ACKS = 3
+UTP_REORDER_LIMIT = 2 ** 12
 
 WRITE_BUFFER_LENGTH = 2 ** 13
 FILES_BUFFER_LENGTH = 10
 
-MAX_PEERS_PENDING = 100
+USE_DHT = True
+DHT_PORT = 52657
+DHT_BOOTSTRAP_NODES = [('router.bittorrent.com', 6881), ('dht.transmissionbt.com', 6881),
+                       ('router.utorrent.com', 6881)]
+DHT_STATE_FILENAME = 'dht_state.pickle'
+DHT_BUCKET_SIZE = 8
+DHT_ALPHA = 3
+DHT_QUERY_TIMEOUT = 2
+DHT_NODE_TIMEOUT = 15 * 60
+DHT_MAX_NODE_FAILURES = 3
+DHT_REFRESH_INTERVAL = 15 * 60
+DHT_TOKEN_ROTATION = 5 * 60
+DHT_PEER_TTL = 30 * 60
+DHT_MAX_PEERS_PER_TORRENT = 1000
+DHT_MAX_VALUES = 50
+DHT_ANNOUNCE_INTERVAL = 15 * 60
+
+UDP_TRACKER_TIMEOUT = 15
+UDP_TRACKER_MAX_RETRIES = 3
+UDP_TRACKER_CONNECTION_TTL = 60
+
+TRACKER_MIN_INTERVAL = 5 * 60
+TRACKER_STARTUP_TIMEOUT = 5
+TRACKER_RETRY_DELAY = 30
+TRACKER_MAX_RETRY_DELAY = 30 * 60
+ANNOUNCE_LOW_PEERS = 10
+ANNOUNCE_JITTER = 0.1
+ANNOUNCE_SPACING = 0.5
+
+MAX_PEER_CANDIDATES = 2000
+PEER_RECONNECT_DELAY = 60
+PEER_CACHE_DIRECTORY = 'peer_cache'
+PEER_CACHE_MAX_AGE = 7 * 24 * 3600
+MAX_HALF_OPEN_CONNECTIONS = 20
+CONNECT_TIMEOUT = 5
+HANDSHAKE_TIMEOUT = 10
+MAX_CONNECT_ATTEMPTS = 3
+CONNECT_RETRY_DELAY = 15
 
 PICKLE_FILENAME = 'current_torrents.pickle'
@@ -0,0 +1,81 @@
+import logging
+import configuration
+
+from event_bus import Event
+from hash_verifier import HashVerifier
+from piece_buffer import PieceBuffer
+
+
+class CorruptionTracker:
+    """
+    Attributes hash failures of one torrent to the peers that sent the data (smart ban).
+    A failed piece is remembered as per-block digests and senders. The only sender of a failed piece
+    and the senders of blocks that differ from the verified copy are proven corrupt and banned,
+    other senders of a failed piece are only suspected and get banned after repeated failures.
+    """
+
+    def __init__(self, verifier: HashVerifier, max_failures=configuration.MAX_HASH_FAILURES_PER_PEER,
+                 max_records=configuration.MAX_FAILED_PIECE_RECORDS):
+        self.verifier = verifier
+        self.max_failures = max_failures
+        self.max_records = max_records
+
+        self.corruption = {}  # ip: proven corrupt pieces
+        self.failures = {}  # ip: failed pieces the peer contributed to
+        self.banned = set()
+        self.ban_event = Event()  # args: ip
+
+        self._failed_pieces = {}  # segment id: [(block digests, block senders)]
+
+    def corruption_count(self, peer) -> int:
+        return self.corruption.get(peer.ip, 0)
+
+    def is_banned(self, peer) -> bool:
+        return peer.ip in self.banned
+
+    def is_suspect(self, segment_id, peer) -> bool:
+        return any(peer in senders for _, senders in self._failed_pieces.get(segment_id, ()))
+
+    async def on_piece_failed(self, segment_id, piece: PieceBuffer, senders: list):
+        contributors = {peer for peer in senders if peer is not None}
+        if not contributors:
+            return
+        if len(contributors) == 1:
+            self._blame(contributors.pop(), segment_id)
+            return
+
+        digests = await self.verifier.block_digests(piece)
+        records = self._failed_pieces.setdefault(segment_id, [])
+        records.append((digests, senders))
+        del records[:-self.max_records]
+
+        for peer in contributors:
+            self.failures[peer.ip] = self.failures.get(peer.ip, 0) + 1
+            if self.failures[peer.ip] >= self.max_failures:
+                logging.info(f"Peer {peer.ip} took part in {self.failures[peer.ip]} failed pieces")
+                self.ban(peer.ip)
+
+    async def on_piece_passed(self, segment_id, piece: PieceBuffer):
+        records = self._failed_pieces.pop(segment_id, None)
+        if not records:
+            return
+
+        digests = await self.verifier.block_digests(piece)
+        culprits = set()
+        for failed_digests, senders in records:
+            culprits.update(senders[index] for index, digest in enumerate(failed_digests)
+                            if digest != digests[index] and senders[index] is not None)
+        for peer in culprits:
+            self._blame(peer, segment_id)
+
+    def _blame(self, peer, segment_id):
+        self.corruption[peer.ip] = self.corruption.get(peer.ip, 0) + 1
+        logging.info(f"Peer {peer.ip} sent corrupt data for segment {segment_id}")
+        self.ban(peer.ip)
+
+    def ban(self, ip):
+        if ip in self.banned:
+            return
+        logging.info(f"Peer {ip} was banned")
+        self.banned.add(ip)
+        self.ban_event.emit(ip)
@@ -0,0 +1,467 @@
+import asyncio
+import hashlib
+import logging
+import os
+import pickle
+import random
+import socket
+import time
+import bencode
+import configuration
+
+from pathlib import Path
+from peer_exchange import encode_compact_peers, decode_compact_peers
+from event_bus import Event
+from timer_scheduler import TimerScheduler
+from tracker_client import TrackerEvent
+
+ID_LENGTH = 20
+ID_SPACE = 2 ** (8 * ID_LENGTH)
+COMPACT_NODE_LENGTH = ID_LENGTH + 6
+
+_raw_bencode = bencode.Bencode(encoding=None)  # ids, tokens and compact strings must stay bytes
+
+
+class DhtError(Exception):
+    pass
+
+
+def distance(first: bytes, second: bytes) -> int:
+    return int.from_bytes(first, 'big') ^ int.from_bytes(second, 'big')
+
+
+def encode_compact_nodes(nodes) -> bytes:
+    return b''.join(node.id + encode_compact_peers([node.address]) for node in nodes)
+
+
+def decode_compact_nodes(data: bytes) -> list[tuple[bytes, str, int]]:
+    nodes = []
+    for i in range(0, len(data) - len(data) % COMPACT_NODE_LENGTH, COMPACT_NODE_LENGTH):
+        (ip, port), = decode_compact_peers(data[i + ID_LENGTH:i + COMPACT_NODE_LENGTH])
+        nodes.append((data[i:i + ID_LENGTH], ip, port))
+    return nodes
+
+
+class Node:
+    __slots__ = ('id', 'ip', 'port', 'last_seen', 'failures')
+
+    def __init__(self, node_id, ip, port, last_seen=None):
+        self.id = node_id
+        self.ip = ip
+        self.port = port
+        self.last_seen = last_seen if last_seen is not None else time.monotonic()
+        self.failures = 0
+
+    @property
+    def address(self):
+        return self.ip, self.port
+
+    def is_good(self, now) -> bool:
+        return not self.failures and now - self.last_seen < configuration.DHT_NODE_TIMEOUT
+
+
+class KBucket:
+    __slots__ = ('low', 'high', 'nodes', 'last_changed')
+
+    def __init__(self, low, high):
+        self.low = low
+        self.high = high
+        self.nodes = []  # least recently seen first
+        self.last_changed = time.monotonic()
+
+    def covers(self, node_id: bytes) -> bool:
+        return self.low <= int.from_bytes(node_id, 'big') < self.high
+
+
+class RoutingTable:
+    """
+    Kademlia routing table: buckets of at most k nodes covering the id space, only the bucket
+    with our own id is split. A full bucket takes a new node only in place of one that stopped responding.
+    """
+
+    def __init__(self, own_id: bytes, k=configuration.DHT_BUCKET_SIZE):
+        self.own_id = own_id
+        self.k = k
+        self.buckets = [KBucket(0, ID_SPACE)]
+
+    def __len__(self):
+        return sum(len(bucket.nodes) for bucket in self.buckets)
+
+    def nodes(self) -> list[Node]:
+        return [node for bucket in self.buckets for node in bucket.nodes]
+
+    def bucket_for(self, node_id: bytes) -> KBucket:
+        return next(bucket for bucket in self.buckets if bucket.covers(node_id))
+
+    def get(self, node_id: bytes) -> Node | None:
+        return next((node for node in self.bucket_for(node_id).nodes if node.id == node_id), None)
+
+    def add(self, node_id: bytes, ip, port, last_seen=None) -> bool:
+        if len(node_id) != ID_LENGTH or node_id == self.own_id or not 0 < port < 2 ** 16:
+            return False
+        bucket = self.bucket_for(node_id)
+        now = time.monotonic()
+        node = self.get(node_id)
+        if node is not None:
+            if last_seen is None:
+                node.last_seen, node.failures = now, 0
+            bucket.nodes.remove(node)
+            bucket.nodes.append(node)
+            bucket.last_changed = now
+            return True
+
+        if len(bucket.nodes) < self.k:
+            bucket.nodes.append(Node(node_id, ip, port, last_seen))
+            bucket.last_changed = now
+            return True
+        if bucket.covers(self.own_id) and bucket.high - bucket.low > self.k:
+            self.split(bucket)
+            return self.add(node_id, ip, port, last_seen)
+
+        stale = [node for node in bucket.nodes if not node.is_good(now)]
+        if not stale:
+            return False
+        worst = max(stale, key=lambda node: (node.failures, -node.last_seen))
+        bucket.nodes.remove(worst)
+        bucket.nodes.append(Node(node_id, ip, port, last_seen))
+        bucket.last_changed = now
+        return True
+
+    def split(self, bucket: KBucket):
+        middle = (bucket.low + bucket.high) // 2
+        lower, upper = KBucket(bucket.low, middle), KBucket(middle, bucket.high)
+        for node in bucket.nodes:
+            (lower if lower.covers(node.id) else upper).nodes.append(node)
+        index = self.buckets.index(bucket)
+        self.buckets[index:index + 1] = [lower, upper]
+
+    def on_failure(self, node_id: bytes):
+        node = self.get(node_id)
+        if node is None:
+            return
+        node.failures += 1
+        if node.failures >= configuration.DHT_MAX_NODE_FAILURES:
+            self.bucket_for(node_id).nodes.remove(node)
+
+    def closest(self, target: bytes, count=None) -> list[Node]:
+        return sorted(self.nodes(), key=lambda node: distance(node.id, target))[:count or self.k]
+
+    def stale_buckets(self, now) -> list[KBucket]:
+        return [bucket for bucket in self.buckets if now - bucket.last_changed >= configuration.DHT_REFRESH_INTERVAL]
+
+
+class TokenManager:
+    """announce_peer tokens: a hash of the querying ip and a secret rotated every DHT_TOKEN_ROTATION seconds"""
+
+    def __init__(self):
+        self._secrets = [os.urandom(8), os.urandom(8)]
+        self._rotated_at = time.monotonic()
+
+    def _rotate(self):
+        if time.monotonic() - self._rotated_at >= configuration.DHT_TOKEN_ROTATION:
+            self._secrets = [os.urandom(8), self._secrets[0]]
+            self._rotated_at = time.monotonic()
+
+    @staticmethod
+    def _make(secret, ip) -> bytes:
+        return hashlib.sha1(secret + ip.encode()).digest()[:8]
+
+    def token(self, ip) -> bytes:
+        self._rotate()
+        return self._make(self._secrets[0], ip)
+
+    def check(self, ip, token) -> bool:
+        self._rotate()
+        return any(token == self._make(secret, ip) for secret in self._secrets)
+
+
+class DhtNode(asyncio.DatagramProtocol):
+    """
+    Mainline DHT (BEP 5) node speaking KRPC over UDP.
+    Answers ping, find_node, get_peers and announce_peer, finds peers with iterative get_peers lookups
+    and keeps its id and routing table between sessions for a fast bootstrap.
+    """
+
+    def __init__(self, node_id: bytes = None, timers: TimerScheduler = None, path: Path = None,
+                 bootstrap_nodes=configuration.DHT_BOOTSTRAP_NODES):
+        self.id = node_id if node_id is not None else os.urandom(ID_LENGTH)
+        self.timers = timers if timers is not None else TimerScheduler()
+        self.path = path
+        self.bootstrap_nodes = bootstrap_nodes
+        self.table = RoutingTable(self.id)
+        self.tokens = TokenManager()
+        self.peers = {}  # info_hash: {(ip, port): expiration time}
+        self.transport = None
+
+        self._pending = {}  # transaction id: future
+        self._transaction = random.randrange(2 ** 16)
+        self._refresh_timer = None
+        self._bootstrap_lock = asyncio.Lock()
+
+    @classmethod
+    async def create(cls, host='0.0.0.0', port=0, timers: TimerScheduler = None, path: Path = None,
+                     **kwargs) -> 'DhtNode':
+        node = cls(timers=timers, path=path, **kwargs)
+        node.load()
+        await asyncio.get_running_loop().create_datagram_endpoint(lambda: node, local_addr=(host, port))
+        node.schedule_refresh()
+        return node
+
+    @property
+    def port(self) -> int:
+        return self.transport.get_extra_info('sockname')[1]
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def error_received(self, exc):
+        logging.error(f"DHT socket error: {exc}")
+
+    def _send(self, message: dict, address):
+        if self.transport is not None:
+            self.transport.sendto(bencode.encode(message), address)
+
+    def datagram_received(self, data, address):
+        try:
+            message = _raw_bencode.decode(data)
+        except bencode.BencodeDecodeError:
+            return
+        if not isinstance(message, dict) or not isinstance(message.get(b't'), bytes):
+            return
+
+        kind = message.get(b'y')
+        if kind == b'q':
+            self._handle_query(message, address)
+        elif kind in (b'r', b'e'):
+            future = self._pending.get(message[b't'])
+            if future is None or future.done():
+                return
+            response = message.get(b'r')
+            if kind == b'r' and isinstance(response, dict):
+                future.set_result(response)
+            else:
+                future.set_exception(DhtError(f"KRPC error from {address}: {message.get(b'e')}"))
+
+    async def query(self, address, method: bytes, arguments: dict) -> dict:
+        self._transaction = (self._transaction + 1) % 2 ** 16
+        transaction = self._transaction.to_bytes(2, 'big')
+        future = asyncio.get_running_loop().create_future()
+        self._pending[transaction] = future
+        self._send({b't': transaction, b'y': b'q', b'q': method, b'a': {b'id': self.id, **arguments}}, address)
+        try:
+            response = await asyncio.wait_for(future, configuration.DHT_QUERY_TIMEOUT)
+        finally:
+            self._pending.pop(transaction, None)
+
+        node_id = response.get(b'id')
+        if isinstance(node_id, bytes):
+            self.table.add(node_id, *address)
+        return response
+
+    def _handle_query(self, message, address):
+        arguments = message.get(b'a')
+        if not isinstance(arguments, dict) or not isinstance(arguments.get(b'id'), bytes):
+            return self._send_error(message, address, 203, 'Protocol Error')
+        ip = address[0]
+
+        match message.get(b'q'):
+            case b'ping':
+                response = {}
+            case b'find_node':
+                target = arguments.get(b'target')
+                if not isinstance(target, bytes) or len(target) != ID_LENGTH:
+                    return self._send_error(message, address, 203, 'Protocol Error')
+                response = {b'nodes': encode_compact_nodes(self.table.closest(target))}
+            case b'get_peers':
+                info_hash = arguments.get(b'info_hash')
+                if not isinstance(info_hash, bytes) or len(info_hash) != ID_LENGTH:
+                    return self._send_error(message, address, 203, 'Protocol Error')
+                response = {b'token': self.tokens.token(ip)}
+                values = self.stored_peers(info_hash)[:configuration.DHT_MAX_VALUES]
+                if values:
+                    response[b'values'] = [encode_compact_peers([peer]) for peer in values]
+                else:
+                    response[b'nodes'] = encode_compact_nodes(self.table.closest(info_hash))
+            case b'announce_peer':
+                info_hash, token = arguments.get(b'info_hash'), arguments.get(b'token')
+                port = address[1] if arguments.get(b'implied_port') else arguments.get(b'port')
+                if not isinstance(info_hash, bytes) or len(info_hash) != ID_LENGTH or not isinstance(port, int):
+                    return self._send_error(message, address, 203, 'Protocol Error')
+                if not self.tokens.check(ip, token):
+                    return self._send_error(message, address, 203, 'Bad token')
+                self.store_peer(info_hash, ip, port)
+                response = {}
+            case _:
+                return self._send_error(message, address, 204, 'Method Unknown')
+
+        self.table.add(arguments[b'id'], *address)
+        self._send({b't': message[b't'], b'y': b'r', b'r': {b'id': self.id, **response}}, address)
+
+    def _send_error(self, message, address, code, text):
+        self._send({b't': message[b't'], b'y': b'e', b'e': [code, text]}, address)
+
+    def store_peer(self, info_hash, ip, port):
+        if not 0 < port < 2 ** 16:
+            return
+        peers = self.peers.setdefault(info_hash, {})
+        if (ip, port) not in peers and len(peers) >= configuration.DHT_MAX_PEERS_PER_TORRENT:
+            return
+        peers[(ip, port)] = time.monotonic() + configuration.DHT_PEER_TTL
+
+    def stored_peers(self, info_hash) -> list[tuple[str, int]]:
+        now = time.monotonic()
+        peers = self.peers.get(info_hash, {})
+        for address in [address for address, expires in peers.items() if expires <= now]:
+            del peers[address]
+        return random.sample(list(peers), len(peers))
+
+    async def lookup(self, target: bytes, method=b'find_node', on_values=None):
+        """
+        Iterative lookup, returns the k closest responding nodes, peers found and tokens by node id.
+        `on_values` is called with the peers of every get_peers response as they arrive
+        """
+        shortlist = {node.id: node.address for node in self.table.closest(target)}
+        queried, responded = set(), set()
+        values, tokens = set(), {}
+
+        async def ask(node_id):
+            queried.add(node_id)
+            argument = b'target' if method == b'find_node' else b'info_hash'
+            try:
+                response = await self.query(shortlist[node_id], method, {argument: target})
+            except (DhtError, asyncio.TimeoutError):
+                self.table.on_failure(node_id)
+                return
+            responded.add(node_id)
+            if isinstance(response.get(b'token'), bytes):
+                tokens[node_id] = response[b'token']
+            if isinstance(response.get(b'values'), list):
+                found = set()
+                for value in response[b'values']:
+                    if isinstance(value, bytes) and len(value) == 6:
+                        found.update(decode_compact_peers(value))
+                values.update(found)
+                if found and on_values is not None:
+                    on_values(found)
+            if isinstance(response.get(b'nodes'), bytes):
+                for found_id, ip, port in decode_compact_nodes(response[b'nodes']):
+                    if found_id != self.id and port:
+                        shortlist.setdefault(found_id, (ip, port))
+
+        while True:
+            closest = sorted((node_id for node_id in shortlist if node_id not in queried or node_id in responded),
+                             key=lambda node_id: distance(node_id, target))[:self.table.k]
+            pending = [node_id for node_id in closest if node_id not in queried][:configuration.DHT_ALPHA]
+            if not pending:
+                break
+            await asyncio.gather(*(ask(node_id) for node_id in pending))
+
+        closest = sorted(responded, key=lambda node_id: distance(node_id, target))[:self.table.k]
+        return [(node_id, shortlist[node_id]) for node_id in closest], values, tokens
+
+    async def get_peers(self, info_hash: bytes) -> set[tuple[str, int]]:
+        _, values, _ = await self.lookup(info_hash, b'get_peers')
+        return values
+
+    async def announce(self, info_hash: bytes, port: int, on_values=None) -> set[tuple[str, int]]:
+        closest, values, tokens = await self.lookup(info_hash, b'get_peers', on_values)
+        announces = [self.query(address, b'announce_peer', {b'info_hash': info_hash, b'port': port,
+                                                            b'token': tokens[node_id]})
+                     for node_id, address in closest if node_id in tokens]
+        results = await asyncio.gather(*announces, return_exceptions=True)
+        announced = sum(1 for result in results if not isinstance(result, BaseException))
+        logging.info(f"DHT: announced to {announced} nodes, found {len(values)} peers")
+        return values
+
+    async def bootstrap(self):
+        async with self._bootstrap_lock:
+            if len(self.table) < self.table.k:
+                loop = asyncio.get_running_loop()
+                for host, port in self.bootstrap_nodes:
+                    try:
+                        addresses = await loop.getaddrinfo(host, port, family=socket.AF_INET, type=socket.SOCK_DGRAM)
+                        await self.query(addresses[0][4][:2], b'find_node', {b'target': self.id})
+                    except (OSError, DhtError, asyncio.TimeoutError) as e:
+                        logging.info(f"DHT bootstrap node {host}:{port} is unavailable: {e}")
+            await self.lookup(self.id)
+            logging.info(f"DHT: {len(self.table)} nodes in routing table")
+
+    def schedule_refresh(self):
+        self._refresh_timer = self.timers.call_later(configuration.DHT_REFRESH_INTERVAL, self._on_refresh_deadline)
+
+    def _on_refresh_deadline(self):
+        self.schedule_refresh()
+        for bucket in self.table.stale_buckets(time.monotonic()):
+            target = random.randrange(bucket.low, bucket.high).to_bytes(ID_LENGTH, 'big')
+            asyncio.create_task(self.lookup(target))
+
+    def save(self):
+        if self.path is None:
+            return
+        nodes = [(node.id, node.ip, node.port) for node in self.table.nodes() if not node.failures]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'wb') as f:
+            pickle.dump({'id': self.id, 'nodes': nodes}, f)
+
+    def load(self):
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                state = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logging.error(f"Unable to load DHT state {self.path}: {e}")
+            return
+
+        self.id = state['id']
+        self.table = RoutingTable(self.id, self.table.k)
+        for node_id, ip, port in state['nodes']:
+            self.table.add(node_id, ip, port, last_seen=0)
+        logging.info(f"Loaded {len(self.table)} DHT nodes")
+
+    def close(self):
+        if self._refresh_timer is not None:
+            self._refresh_timer.cancel()
+            self._refresh_timer = None
+        for future in self._pending.values():
+            future.cancel()
+        self.save()
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+
+class DhtTracker:
+    """Peer source for TrackerManager: announces the torrent to the DHT and reports the peers found"""
+
+    def __init__(self, dht: DhtNode, info_hash, port):
+        self.url = 'dht'
+        self.dht = dht
+        self.info_hash = info_hash
+        self.port = port
+        self.new_peers = asyncio.Queue()
+        self.request_interval = configuration.DHT_ANNOUNCE_INTERVAL
+        self.found_event = Event()  # args: dht_tracker
+        self._peers = set()
+
+    async def make_request(self, event):
+        if event == TrackerEvent.STOPPED:
+            return
+        if len(self.dht.table) < self.dht.table.k:
+            await self.dht.bootstrap()
+        if not len(self.dht.table):
+            raise ConnectionError('DHT has no reachable nodes')
+
+        self.on_peers(await self.dht.announce(self.info_hash, self.port, self.on_peers))
+
+    def on_peers(self, peers):
+        new_peers = peers - self._peers
+        if not new_peers:
+            return
+        self._peers |= new_peers
+        for peer in new_peers:
+            self.new_peers.put_nowait(peer)
+        self.found_event.emit(self)
+
+    async def close(self):
+        pass
@@ -0,0 +1,54 @@
+import types
+import weakref
+
+
+class _StrongRef:
+    __slots__ = ('callback',)
+
+    def __init__(self, callback):
+        self.callback = callback
+
+    def __call__(self):
+        return self.callback
+
+
+class Event:
+    """
+    In-process notification channel owned by one object (a peer, a segment downloader, ...).
+    Bound methods are held weakly and dropped together with their owner, other callables are held strongly.
+    """
+
+    __slots__ = ('_listeners', '__weakref__')
+
+    def __init__(self):
+        self._listeners = ()
+
+    def subscribe(self, callback) -> None:
+        if callback in self:
+            return
+        if isinstance(callback, types.MethodType):
+            ref = weakref.WeakMethod(callback, self._remove_ref)
+        else:
+            ref = _StrongRef(callback)
+        self._listeners += (ref,)
+
+    def unsubscribe(self, callback) -> None:
+        self._listeners = tuple(ref for ref in self._listeners if ref() != callback)
+
+    def emit(self, *args) -> None:
+        for ref in self._listeners:
+            callback = ref()
+            if callback is not None:
+                callback(*args)
+
+    def clear(self) -> None:
+        self._listeners = ()
+
+    def _remove_ref(self, dead_ref):
+        self._listeners = tuple(ref for ref in self._listeners if ref is not dead_ref)
+
+    def __contains__(self, callback):
+        return any(ref() == callback for ref in self._listeners)
+
+    def __len__(self):
+        return sum(1 for ref in self._listeners if ref() is not None)
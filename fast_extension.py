@@ -0,0 +1,18 @@
+import hashlib
+import ipaddress
+
+
+def allowed_fast_set(ip, info_hash: bytes, pieces_count, k) -> list[int]:
+    """Canonical allowed-fast set (BEP 6) of k pieces for a peer with the given IPv4 address"""
+    k = min(k, pieces_count)
+    allowed = []
+    x = (int(ipaddress.IPv4Address(ip)) & 0xFFFFFF00).to_bytes(4, 'big') + info_hash
+    while len(allowed) < k:
+        x = hashlib.sha1(x).digest()
+        for i in range(0, 20, 4):
+            if len(allowed) >= k:
+                break
+            index = int.from_bytes(x[i:i + 4], 'big') % pieces_count
+            if index not in allowed:
+                allowed.append(index)
+    return allowed
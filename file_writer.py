@@ -141,8 +141,23 @@ class FileWriter:
                 break
         return result
 
-    async def check_segment_download(self, index: int) -> bool:
+    async def read_range(self, segment_id, begin, length):
+        result = b''
+        for file, reading_start, size in self.find_segment_in_files(segment_id):
+            if begin >= size:
+                begin -= size
+                continue
+            self._shift_files_buffer(file)
+            result += await file.read(reading_start + begin, min(size - begin, length - len(result)))
+            begin = 0
+            if len(result) == length:
+                break
+        return result
+
+    async def check_segment_download(self, index: int, verifier=None) -> bool:
         data = await self.read_segment(index)
+        if verifier is not None:
+            return await verifier.verify(data, self.torrent.segments_hash[index])
         if hashlib.sha1(data).digest() != self.torrent.segments_hash[index]:
             return False
         return True
@@ -0,0 +1,123 @@
+import asyncio
+import hashlib
+import logging
+import time
+import configuration
+
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from event_bus import Event
+from piece_buffer import PieceBuffer
+
+
+def _sha1_digest(data) -> bytes:
+    return hashlib.sha1(data).digest()
+
+
+def _block_digests(data, block_length) -> list[bytes]:
+    return [hashlib.sha1(data[offset:offset + block_length]).digest() for offset in range(0, len(data), block_length)]
+
+
+class HashVerifier:
+    """
+    Session-wide SHA-1 verification service running off the event loop.
+    Threads are used by default (hashlib releases the GIL), a process pool can be enabled with use_processes.
+    """
+
+    def __init__(self, max_workers=configuration.HASH_WORKERS, max_pending=configuration.HASH_MAX_PENDING,
+                 use_processes=configuration.HASH_USE_PROCESSES):
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.use_processes = use_processes
+
+        self.capacity_event = Event()  # args: none
+        self.pending = 0
+
+        self.verified_pieces = 0
+        self.failed_pieces = 0
+        self.verified_bytes = 0
+        self.rehashed_pieces = 0  # block digests of failed pieces for smart ban
+        self.rehashed_bytes = 0
+        self.max_latency = 0
+        self._total_latency = 0
+        self._busy_time = 0
+
+        self._executor = None
+        self._slots = asyncio.Semaphore(max_pending)
+
+    @property
+    def has_capacity(self) -> bool:
+        return self.pending < self.max_pending
+
+    @property
+    def average_latency(self) -> float:
+        total = self.verified_pieces + self.failed_pieces + self.rehashed_pieces
+        return self._total_latency / total if total else 0
+
+    @property
+    def throughput(self) -> float:
+        return (self.verified_bytes + self.rehashed_bytes) / self._busy_time if self._busy_time else 0
+
+    async def verify_piece(self, piece: PieceBuffer, expected_hash) -> bool:
+        if not piece.is_complete:
+            return False
+        if self.use_processes:
+            return await self._verify(_sha1_digest, bytes(piece.data), piece.length, expected_hash)
+        if piece.hashed_length == piece.length:
+            return self._account(piece.digest() == expected_hash, piece.length, 0, 0)
+        return await self._verify(piece.digest, None, piece.length, expected_hash)
+
+    async def verify(self, data, expected_hash) -> bool:
+        return await self._verify(_sha1_digest, data, len(data), expected_hash)
+
+    async def block_digests(self, piece: PieceBuffer) -> list[bytes]:
+        data = bytes(piece.data) if self.use_processes else piece.data
+        digests, latency, busy_time = await self._run(_block_digests, data, piece.block_length)
+        self.rehashed_pieces += 1
+        self.rehashed_bytes += piece.length
+        self._record_time(latency, busy_time)
+        logging.debug(f'Hashed blocks of {piece.length} bytes in {latency * 1000:.1f} ms')
+        return digests
+
+    async def _verify(self, function, data, size, expected_hash) -> bool:
+        args = () if data is None else (data,)
+        digest, latency, busy_time = await self._run(function, *args)
+        return self._account(digest == expected_hash, size, latency, busy_time)
+
+    async def _run(self, function, *args):
+        queued_at = time.monotonic()
+        self.pending += 1
+        try:
+            async with self._slots:
+                started_at = time.monotonic()
+                result = await asyncio.get_running_loop().run_in_executor(self._get_executor(), function, *args)
+                finished_at = time.monotonic()
+        finally:
+            self.pending -= 1
+            self.capacity_event.emit()
+        return result, finished_at - queued_at, finished_at - started_at
+
+    def _account(self, result, size, latency, busy_time) -> bool:
+        if result:
+            self.verified_pieces += 1
+            self.verified_bytes += size
+        else:
+            self.failed_pieces += 1
+        self._record_time(latency, busy_time)
+        logging.debug(f'Verified {size} bytes in {latency * 1000:.1f} ms, result: {result}')
+        return result
+
+    def _record_time(self, latency, busy_time):
+        self._total_latency += latency
+        self._busy_time += busy_time
+        self.max_latency = max(self.max_latency, latency)
+
+    def _get_executor(self):
+        if self._executor is None:
+            executor_type = ProcessPoolExecutor if self.use_processes else ThreadPoolExecutor
+            self._executor = executor_type(max_workers=self.max_workers)
+        return self._executor
+
+    def close(self):
+        if self._executor:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
@@ -0,0 +1,69 @@
+import logging
+import time
+import aiohttp
+import configuration
+
+
+class ResponseTooLarge(ConnectionError):
+    pass
+
+
+class HttpClient:
+    """
+    Session-wide pooled HTTP client shared by tracker announces and web seeds.
+    Keep-alive connections are limited per host, DNS lookups are cached, responses may be gzip encoded
+    and bodies are read up to max_response_size bytes. Request latency is tracked per url.
+    """
+
+    def __init__(self, limit=configuration.HTTP_MAX_CONNECTIONS,
+                 limit_per_host=configuration.HTTP_MAX_CONNECTIONS_PER_HOST,
+                 max_response_size=configuration.HTTP_MAX_RESPONSE_SIZE, timeout=configuration.HTTP_TIMEOUT):
+        self.limit = limit
+        self.limit_per_host = limit_per_host
+        self.max_response_size = max_response_size
+        self.timeout = timeout
+
+        self.latency = {}  # url: smoothed request latency in seconds
+        self._session = None
+
+    @property
+    def session(self) -> aiohttp.ClientSession:
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(limit=self.limit, limit_per_host=self.limit_per_host,
+                                             use_dns_cache=True, ttl_dns_cache=configuration.HTTP_DNS_CACHE_TTL,
+                                             keepalive_timeout=configuration.HTTP_KEEPALIVE_TIMEOUT)
+            self._session = aiohttp.ClientSession(connector=connector,
+                                                  timeout=aiohttp.ClientTimeout(total=self.timeout),
+                                                  headers={'Accept-Encoding': 'gzip'}, auto_decompress=True)
+        return self._session
+
+    async def get(self, url, params: str = None, timeout=None) -> tuple[int, bytes]:
+        full_url = url + '?' + params if params else url
+        started = time.monotonic()
+        timeout = timeout if timeout is not None else self.timeout
+        async with self.session.get(full_url, timeout=aiohttp.ClientTimeout(total=timeout)) as response:
+            data = await self.read(response)
+        self.record_latency(url, time.monotonic() - started)
+        return response.status, data
+
+    async def read(self, response: aiohttp.ClientResponse, limit=None) -> bytes:
+        limit = limit if limit is not None else self.max_response_size
+        if response.content_length is not None and response.content_length > limit:
+            raise ResponseTooLarge(f'Response of "{response.url}" is {response.content_length} bytes')
+        chunks, size = [], 0
+        async for chunk in response.content.iter_chunked(2 ** 16):
+            size += len(chunk)
+            if size > limit:
+                raise ResponseTooLarge(f'Response of "{response.url}" exceeds {limit} bytes')
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def record_latency(self, url, latency):
+        previous = self.latency.get(url)
+        self.latency[url] = latency if previous is None else 0.8 * previous + 0.2 * latency
+        logging.info(f'HTTP "{url}" answered in {latency * 1000:.0f} ms (average {self.latency[url] * 1000:.0f} ms)')
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
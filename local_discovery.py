@@ -0,0 +1,146 @@
+import asyncio
+import logging
+import os
+import socket
+import struct
+import time
+import configuration
+
+from event_bus import Event
+from tracker_client import TrackerEvent
+
+LSD_GROUP = '239.192.152.143'
+LSD_PORT = 6771
+
+
+def make_announce(port, info_hashes, cookie) -> bytes:
+    lines = ['BT-SEARCH * HTTP/1.1', f'Host: {LSD_GROUP}:{LSD_PORT}', f'Port: {port}']
+    lines += [f'Infohash: {info_hash.hex()}' for info_hash in info_hashes]
+    lines.append(f'cookie: {cookie}')
+    return ('\r\n'.join(lines) + '\r\n\r\n\r\n').encode('ascii')
+
+
+def parse_announce(data: bytes) -> tuple[int, list[bytes], str | None] | None:
+    try:
+        lines = data.decode('ascii').split('\r\n')
+    except UnicodeDecodeError:
+        return None
+    if not lines[0].startswith('BT-SEARCH * HTTP/1.'):
+        return None
+
+    port, info_hashes, cookie = None, [], None
+    for line in lines[1:]:
+        name, separator, value = line.partition(':')
+        if not separator:
+            continue
+        name, value = name.strip().lower(), value.strip()
+        if name == 'port' and value.isdigit() and 0 < int(value) < 2 ** 16:
+            port = int(value)
+        elif name == 'infohash' and len(value) == 40:
+            try:
+                info_hashes.append(bytes.fromhex(value))
+            except ValueError:
+                continue
+        elif name == 'cookie':
+            cookie = value
+    if port is None or not info_hashes:
+        return None
+    return port, info_hashes, cookie
+
+
+class LocalServiceDiscovery(asyncio.DatagramProtocol):
+    """
+    Local Service Discovery (BEP 14): announces torrents to the LAN multicast group and reports peers announcing
+    the same torrents. A torrent is announced at most once per LSD_MIN_ANNOUNCE_INTERVAL,
+    our own announces are recognized by the cookie.
+    """
+
+    def __init__(self, group=LSD_GROUP, port=LSD_PORT):
+        self.group = group
+        self.port = port
+        self.cookie = os.urandom(8).hex()
+        self.peer_event = Event()  # args: info_hash, (ip, port)
+        self.transport = None
+        self._announced = {}  # info_hash: time of the last announce
+
+    @classmethod
+    async def create(cls, group=LSD_GROUP, port=LSD_PORT) -> 'LocalServiceDiscovery':
+        lsd = cls(group, port)
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM, socket.IPPROTO_UDP)
+        try:
+            sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+            if hasattr(socket, 'SO_REUSEPORT'):
+                sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEPORT, 1)
+            sock.bind(('', port))
+            membership = struct.pack('4s4s', socket.inet_aton(group), socket.inet_aton('0.0.0.0'))
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_ADD_MEMBERSHIP, membership)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_TTL, configuration.LSD_MULTICAST_TTL)
+            sock.setsockopt(socket.IPPROTO_IP, socket.IP_MULTICAST_LOOP, 1)
+            sock.setblocking(False)
+        except OSError:
+            sock.close()
+            raise
+        await asyncio.get_running_loop().create_datagram_endpoint(lambda: lsd, sock=sock)
+        return lsd
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def error_received(self, exc):
+        logging.error(f"LSD socket error: {exc}")
+
+    def announce(self, info_hash: bytes, port: int) -> bool:
+        if self.transport is None:
+            raise ConnectionError('LSD socket is closed')
+        now = time.monotonic()
+        if now - self._announced.get(info_hash, -configuration.LSD_MIN_ANNOUNCE_INTERVAL) \
+                < configuration.LSD_MIN_ANNOUNCE_INTERVAL:
+            return False
+        self._announced[info_hash] = now
+        self.transport.sendto(make_announce(port, [info_hash], self.cookie), (self.group, self.port))
+        return True
+
+    def datagram_received(self, data, address):
+        announce = parse_announce(data)
+        if announce is None:
+            return
+        port, info_hashes, cookie = announce
+        if cookie == self.cookie:
+            return
+        for info_hash in info_hashes:
+            self.peer_event.emit(info_hash, (address[0], port))
+
+    def close(self):
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+
+class LocalPeers:
+    """Peer source for TrackerManager: LAN peers of one torrent found by Local Service Discovery"""
+
+    def __init__(self, lsd: LocalServiceDiscovery, info_hash, port):
+        self.url = 'local'
+        self.lsd = lsd
+        self.info_hash = info_hash
+        self.port = port
+        self.new_peers = asyncio.Queue()
+        self.request_interval = configuration.LSD_ANNOUNCE_INTERVAL
+        self.found_event = Event()  # args: local_peers
+        self._peers = set()
+        lsd.peer_event.subscribe(self.on_peer)
+
+    def on_peer(self, info_hash, address):
+        if info_hash != self.info_hash or address in self._peers:
+            return
+        logging.info(f"LSD: found local peer {address[0]}:{address[1]}")
+        self._peers.add(address)
+        self.new_peers.put_nowait(address)
+        self.found_event.emit(self)
+
+    async def make_request(self, event):
+        if event != TrackerEvent.STOPPED:
+            self.lsd.announce(self.info_hash, self.port)
+
+    async def close(self):
+        self.lsd.peer_event.unsubscribe(self.on_peer)
@@ -6,13 +6,21 @@ import configuration
 
 from parser import TorrentData
 from torrent_statistics import TorrentStatistics
-from tracker_manager import TrackerManager
+from tracker_manager import TrackerManager, BadTorrentTrackers
 from torrent_downloader import Downloader
 from file_writer import FileWriter
 from pathlib import Path
-from priority_queue import PriorityQueue
 from requests_receiver import RequestsReceiver
-from pubsub import pub
+from timer_scheduler import TimerScheduler
+from hash_verifier import HashVerifier
+from piece_pool import PiecePool
+from utp import UtpSocket
+from peer_store import PeerStore
+from dht import DhtNode
+from local_discovery import LocalServiceDiscovery
+from http_client import HttpClient
+from announce_scheduler import AnnounceScheduler
+from tracker_client import UdpTrackerSocket
 
 
 class TorrentApplication:
@@ -23,7 +31,16 @@ class TorrentApplication:
 
         self.request_receiver = RequestsReceiver()
         self.server_started = False
-        pub.subscribe(self.add_peer_by_info_hash, self.request_receiver.NEW_PEER_EVENT)
+        self.timers = TimerScheduler()
+        self.announce_scheduler = AnnounceScheduler(self.timers)
+        self.verifier = HashVerifier()
+        self.pool = PiecePool()
+        self.utp = None
+        self.dht = None
+        self.lsd = None
+        self.http_client = HttpClient()
+        self.udp_trackers = None
+        self.request_receiver.new_peer_event.subscribe(self.add_peer_by_info_hash)
 
     def add_peer_by_info_hash(self, peer, info_hash):
         asyncio.create_task(self._add_peer_coro(peer, info_hash))
@@ -53,40 +70,90 @@ class TorrentApplication:
     async def download(self, torrent_data, destination, torrent_statistics):
         if not self.server_started:
             self.request_receiver.start_server()
+            if configuration.USE_UTP:
+                self.utp = await UtpSocket.create(port=self.request_receiver.port, timers=self.timers)
+                self.request_receiver.start_utp_server(self.utp)
+            if configuration.USE_DHT:
+                self.dht = await DhtNode.create(port=configuration.DHT_PORT, timers=self.timers,
+                                                path=Path(sys.path[0]) / configuration.DHT_STATE_FILENAME)
+            self.udp_trackers = await UdpTrackerSocket.create()
+            if configuration.USE_LOCAL_PEERS:
+                try:
+                    self.lsd = await LocalServiceDiscovery.create()
+                except OSError as e:
+                    logging.error(f"Unable to join the Local Service Discovery group: {e}")
             self.server_started = True
 
         self.torrents.append((torrent_data, destination, torrent_statistics))
         logging.info(
             f"Total length: {torrent_data.total_length}, Segment length: {torrent_data.segment_length}, Total segments {torrent_data.total_segments}")
 
+        peer_store = PeerStore(torrent_data.info_hash, torrent_data.total_segments, self.request_receiver.port,
+                               transport=self.utp, path=self.get_peer_cache_path(torrent_data))
+        peer_store.load()
+
         with FileWriter(torrent_data, destination=destination) as file_writer:
-            async with TrackerManager(torrent_data, torrent_statistics,
-                                      self.request_receiver.port,
-                                      use_local=configuration.USE_LOCAL_PEERS,
-                                      use_http=configuration.USE_HTTP_PEERS) as trackers_manager:
-                trackers_manager.create_peers_update_task()
-
-                logging.info("Created all objects")
-                torrent_downloader = Downloader(torrent_data,
-                                                file_writer,
-                                                torrent_statistics,
-                                                trackers_manager.available_peers)
-                self.torrent_downloaders.append(torrent_downloader)
-                await torrent_downloader.download_torrent()
+            torrent_downloader = Downloader(torrent_data,
+                                            file_writer,
+                                            torrent_statistics,
+                                            peer_store,
+                                            timers=self.timers,
+                                            verifier=self.verifier,
+                                            pool=self.pool,
+                                            http_client=self.http_client)
+            self.torrent_downloaders.append(torrent_downloader)
+            download_task = asyncio.create_task(torrent_downloader.download_torrent())
+
+            try:
+                async with TrackerManager(torrent_data, torrent_statistics,
+                                          self.request_receiver.port,
+                                          use_local=configuration.USE_LOCAL_PEERS,
+                                          use_http=configuration.USE_HTTP_PEERS,
+                                          timers=self.timers,
+                                          peer_store=peer_store,
+                                          dht=self.dht,
+                                          lsd=self.lsd,
+                                          http_client=self.http_client,
+                                          scheduler=self.announce_scheduler,
+                                          udp_socket=self.udp_trackers) as trackers_manager:
+                    trackers_manager.schedule_peers_update()
+                    torrent_downloader.completed_event.subscribe(trackers_manager.on_download_completed)
+                    if not torrent_downloader.segments_left:
+                        trackers_manager.on_download_completed()
+                    logging.info("Created all objects")
+                    await download_task
+            except BadTorrentTrackers:
+                if not peer_store:
+                    download_task.cancel()
+                    raise
+                logging.error("No stable trackers, downloading from cached peers only")
+                await download_task
+            finally:
+                peer_store.save()
+
+    @staticmethod
+    def get_peer_cache_path(torrent_data) -> Path:
+        return Path(sys.path[0]) / configuration.PEER_CACHE_DIRECTORY / f'{torrent_data.info_hash.hex()}.peers'
 
     def close(self):
         self.request_receiver.close()
         for td in self.torrent_downloaders:
             td.close()
-
-    @staticmethod
-    async def queue_update_task(source_queues: list[asyncio.Queue], queue_target: PriorityQueue, priority=True):
-        while True:
-            for index, queue in enumerate(source_queues):
-                if not queue.empty():
-                    queue_target.push(index if priority else 0, queue.get_nowait())
-
-            await asyncio.sleep(.001)
+        if self.utp is not None:
+            self.utp.close()
+        if self.dht is not None:
+            self.dht.close()
+        if self.lsd is not None:
+            self.lsd.close()
+        if self.udp_trackers is not None:
+            self.udp_trackers.close()
+        try:
+            asyncio.get_running_loop().create_task(self.http_client.close())
+        except RuntimeError:
+            logging.error('HTTP client was not closed: no running event loop')
+        self.timers.close()
+        self.verifier.close()
+        self.pool.clear()
 
 
 if __name__ == '__main__':
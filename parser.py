@@ -1,4 +1,5 @@
 import hashlib
+import random
 import bencode
 from math import ceil
 
@@ -9,7 +10,9 @@ class TorrentData:
         with open(torrent_file_path, 'rb') as f:
             raw_data = bencode.bdecode(f.read())
 
-        self.trackers = self._get_announce_list(raw_data)
+        self.tiers = self._get_announce_tiers(raw_data)
+        self.trackers = [url for tier in self.tiers for url in tier]
+        self.url_list = self._get_url_list(raw_data)
         info = raw_data['info']
         self.torrent_name = info['name']
         self.segment_length = info['piece length']
@@ -20,8 +23,18 @@ class TorrentData:
         self.total_length = sum(file_info['length'] for file_info in self.files)
         self.total_segments = ceil(self.total_length / self.segment_length)
 
-    def _get_announce_list(self, data):
-        return [url[0] for url in data['announce-list']] if 'announce-list' in data else [data['announce']]
+    def _get_announce_tiers(self, data):
+        if 'announce-list' not in data:
+            return [[data['announce']]]
+        tiers = [list(tier) for tier in data['announce-list'] if tier]
+        for tier in tiers:
+            random.shuffle(tier)  # BEP 12
+        return tiers
+
+    def _get_url_list(self, data):
+        urls = data.get('url-list', [])
+        urls = [urls] if isinstance(urls, (str, bytes)) else urls
+        return [url.decode() if isinstance(url, bytes) else url for url in urls if url]
 
     def _get_files_list(self, info):
         return info['files'] if 'files' in info else [{'length': info['length'], 'path': [info['name']]}]
@@ -1,43 +1,64 @@
 import struct
+import time
 
 import bitstring
 import logging
 import Message
 import asyncio
-from pubsub import pub
+import bencode
+import configuration
+from event_bus import Event
+from peer_pipeline import PeerPipeline
 from struct import unpack
 
 
 class PeerConnection:
-    ID = 0
-
-    REQUEST_PIECE_EVENT = 'requestPiece'  # + ip + id, args: message, peer
-    RECEIVE_BLOCK_EVENT = 'sendPiece'  # + ip + id, args: request, peer
-    BITFIELD_UPDATE_EVENT = 'bitfieldUpdate'  # + ip + id, args: peer
-    HAVE_MESSAGE_EVENT = 'hasMessage'  # + ip + id, args: index, peer
-
-    def __init__(self, ip, number_of_pieces: int, info_hash, port=6881):
-        PeerConnection.ID += 1
+    EXTENSIONS = {'ut_pex': 1}  # extended message ids we accept (BEP 10)
 
+    def __init__(self, ip, number_of_pieces: int, info_hash, port=6881, transport=None):
         self.ip = ip
         self.port = port
+        self.transport = transport  # uTP socket tried before TCP, if set
         self.number_of_pieces = number_of_pieces
         self.info_hash = info_hash
 
-        self.receive_event = PeerConnection.RECEIVE_BLOCK_EVENT + ip + str(PeerConnection.ID)
-        self.request_event = PeerConnection.REQUEST_PIECE_EVENT + ip + str(PeerConnection.ID)
-        self.bitfield_update_event = PeerConnection.BITFIELD_UPDATE_EVENT + ip + str(PeerConnection.ID)
-        self.have_message_event = PeerConnection.HAVE_MESSAGE_EVENT + ip + str(PeerConnection.ID)
+        self.receive_event = Event()  # args: request, peer
+        self.request_event = Event()  # args: request, peer
+        self.bitfield_update_event = Event()  # args: peer
+        self.have_message_event = Event()  # args: peer, index
+        self.unchoke_event = Event()  # args: peer
+        self.disconnect_event = Event()  # args: peer
+        self.interest_event = Event()  # args: peer
+        self.cancel_event = Event()  # args: request, peer
+        self.reject_event = Event()  # args: request, peer
+        self.suggest_event = Event()  # args: peer, index
+        self.allowed_fast_event = Event()  # args: peer, index
+        self.extended_handshake_event = Event()  # args: peer
+        self.extended_message_event = Event()  # args: peer, name, payload
 
         bitfield_length = number_of_pieces if number_of_pieces % 8 == 0 else number_of_pieces + 8 - number_of_pieces % 8
         self.bitfield = bitstring.BitArray(bitfield_length)
 
         self.handshake = False
-        self.is_active = False
+        self._is_active = False
         self.reader = None
         self.writer = None
         self.buffer = b''
         self.socket_lock = asyncio.Lock()
+        self.pipeline = PeerPipeline()
+        self.last_message_sent = time.monotonic()
+        self.last_message_received = time.monotonic()
+        self.downloaded = 0
+        self.uploaded = 0
+
+        self.supports_fast = False
+        self.allowed_fast = set()  # pieces we may request while choked
+        self.granted_fast = set()  # pieces the peer may request while we choke it
+
+        self.supports_extensions = False
+        self.extensions = {}  # name: extended message id of the peer
+        self.listen_port = port
+        self.client = None
 
         self._peer_interested = False
         self._peer_choked = True
@@ -56,7 +77,10 @@ class PeerConnection:
                           2: Message.InterestedMessage, 3: Message.NotInterestedMessage,
                           4: Message.HaveMessage, 5: Message.PeerSegmentsMessage,
                           6: Message.RequestsMessage, 7: Message.SendPieceMessage,
-                          8: Message.CancelMessage}
+                          8: Message.CancelMessage, 13: Message.SuggestPieceMessage,
+                          14: Message.HaveAllMessage, 15: Message.HaveNoneMessage,
+                          16: Message.RejectRequestMessage, 17: Message.AllowedFastMessage,
+                          20: Message.ExtendedMessage}
 
         if message_id not in messages_by_id:
             logging.error(f'Некорректное сообщение, указан несуществующий id_message: {message_id}')
@@ -65,8 +89,17 @@ class PeerConnection:
             return messages_by_id[message_id].decode(message)
 
     async def connect(self) -> bool:
+        if self.transport is not None:
+            try:
+                self.reader, self.writer = await self.transport.open_connection(self.ip, self.port)
+                self.is_active = True
+                return True
+            except (asyncio.TimeoutError, OSError):
+                logging.info(f'uTP: пир {self.ip}:{self.port} не отвечает, подключение по TCP')
+
         try:
-            self.reader, self.writer = await asyncio.open_connection(self.ip, self.port)
+            self.reader, self.writer = await asyncio.wait_for(asyncio.open_connection(self.ip, self.port),
+                                                              configuration.CONNECT_TIMEOUT)
             self.is_active = True
         except (asyncio.TimeoutError, OSError):
             logging.error(f'Socket error: Пир {self.ip}:{self.port} не может быть подключён')
@@ -76,6 +109,7 @@ class PeerConnection:
     async def send_message_to_peer(self, message: Message.Message) -> bool:
         if isinstance(message, Message.SendPieceMessage):
             logging.info("Sending block")
+            self.uploaded += len(message.data)
         if not self.handshake:
             allowed_messages = (
                 Message.HandshakeMessage, Message.PeerSegmentsMessage, Message.InterestedMessage)
@@ -86,11 +120,23 @@ class PeerConnection:
         try:
             self.writer.write(message)
             await self.writer.drain()
+            self.last_message_sent = time.monotonic()
             return True
         except OSError as e:
             self.is_active = False
             return False
 
+    @property
+    def is_active(self) -> bool:
+        return self._is_active
+
+    @is_active.setter
+    def is_active(self, value: bool) -> None:
+        was_active = self._is_active
+        self._is_active = value
+        if was_active and not value:
+            self.disconnect_event.emit(self)
+
     @property
     def interested(self) -> bool:
         return self._interested
@@ -113,9 +159,10 @@ class PeerConnection:
 
     @peer_interested.setter
     def peer_interested(self, value: bool) -> None:
+        was_interested = self._peer_interested
         self._peer_interested = value
-        if value and self.choked:
-            asyncio.create_task(self.send_message_to_peer(Message.UnChokedMessage()))
+        if was_interested != value:
+            self.interest_event.emit(self)
 
     @property
     def peer_choked(self) -> bool:
@@ -123,44 +170,128 @@ class PeerConnection:
 
     @peer_choked.setter
     def peer_choked(self, value: bool) -> None:
+        was_choked = self._peer_choked
         self._peer_choked = value
+        if was_choked and not value:
+            self.unchoke_event.emit(self)
 
     def check_for_piece(self, index: int) -> bool:
         return self.bitfield[index]
 
+    def can_request(self, index: int) -> bool:
+        return not self.peer_choked or index in self.allowed_fast
+
+    def on_handshake(self, handshake_message):
+        self.handshake = True
+        self.supports_fast = configuration.FAST_EXTENSION and handshake_message.supports_fast
+        self.supports_extensions = configuration.EXTENSION_PROTOCOL and handshake_message.supports_extensions
+
     async def handle_got_piece(self, message) -> None:
         self.bitfield[message.piece_index] = True
-        pub.sendMessage(self.have_message_event, index=message.piece_index, peer=self)
+        self.have_message_event.emit(self, message.piece_index)
         if self.peer_choked and not self.interested:
             await self.send_message_to_peer(Message.InterestedMessage())
             self.interested = True
 
     async def handle_handshake(self):
-        handshake = Message.HandshakeMessage(self.info_hash)
+        reserved = Message.HandshakeMessage.make_reserved(configuration.EXTENSION_PROTOCOL, configuration.FAST_EXTENSION)
+        handshake = Message.HandshakeMessage(self.info_hash, reserved=reserved)
         await self.send_message_to_peer(handshake)
         if self.is_active is False:
             logging.error('Произошла ошибка при handshake-e, пир неактивен')
             return False
         return True
 
+    async def receive_handshake(self) -> bool:
+        """Reads the handshake of the remote side and checks that it is for our torrent"""
+        data = await self.reader.readexactly(68)
+        if data[0] != 19 or data[1:20] != b'BitTorrent protocol':
+            logging.error(f'Пир {self.ip}:{self.port} прислал некорректный handshake')
+            return False
+        handshake_message = Message.HandshakeMessage.decode(data)
+        if handshake_message.info_hash != self.info_hash:
+            logging.error(f'Пир {self.ip}:{self.port} прислал handshake другого торрента')
+            return False
+        self.on_handshake(handshake_message)
+        self.last_message_received = time.monotonic()
+        return True
+
     async def handle_available_piece(self, message) -> None:
-        self.bitfield = message.segments
-        pub.sendMessage(self.bitfield_update_event, peer=self)
+        self.set_bitfield(message.segments)
         if self.peer_choked and not self.interested:
             await self.send_message_to_peer(Message.InterestedMessage())
             self.interested = True
 
+    def set_bitfield(self, bitfield) -> None:
+        self.bitfield = bitfield
+        self.bitfield_update_event.emit(self)
+
     def handle_piece_receive(self, piece_message) -> None:
-        pub.sendMessage(self.receive_event, request=piece_message, peer=self)
+        self.downloaded += len(piece_message.data)
+        self.receive_event.emit(piece_message, self)
 
     def handle_piece_request(self, request) -> None:
-        if not self.peer_choked and self.peer_interested:
-            pub.sendMessage(self.request_event, request=request, peer=self)
+        if (not self.choked and self.peer_interested) or request.index in self.granted_fast:
+            self.request_event.emit(request, self)
+        else:
+            self.reject_request(request)
+
+    def reject_request(self, request) -> None:
+        if self.supports_fast:
+            message = Message.RejectRequestMessage(request.index, request.byte_offset, request.block_len)
+            asyncio.create_task(self.send_message_to_peer(message))
+
+    async def send_extended_handshake(self, listen_port=None) -> bool:
+        handshake = {'m': PeerConnection.EXTENSIONS, 'v': configuration.CLIENT_VERSION}
+        if listen_port:
+            handshake['p'] = listen_port
+        return await self.send_message_to_peer(Message.ExtendedMessage(Message.ExtendedMessage.HANDSHAKE_ID,
+                                                                       bencode.encode(handshake)))
+
+    async def send_extended_message(self, name, payload: bytes) -> bool:
+        if name not in self.extensions:
+            return False
+        return await self.send_message_to_peer(Message.ExtendedMessage(self.extensions[name], payload))
+
+    def handle_extended_message(self, message) -> None:
+        if message.extended_id != Message.ExtendedMessage.HANDSHAKE_ID:
+            for name, extended_id in PeerConnection.EXTENSIONS.items():
+                if extended_id == message.extended_id:
+                    self.extended_message_event.emit(self, name, message.payload)
+                    return
+            logging.error(f'Пир {self.ip} прислал неизвестное расширение: {message.extended_id}')
+            return
+
+        try:
+            handshake = bencode.decode(message.payload)
+        except bencode.BencodeDecodeError:
+            logging.error(f'Пир {self.ip} прислал некорректный extended handshake')
+            return
+        if not isinstance(handshake, dict):
+            return
+        for name, extended_id in handshake.get('m', {}).items():
+            if not isinstance(extended_id, int):
+                continue
+            if extended_id:
+                self.extensions[name] = extended_id
+            else:
+                self.extensions.pop(name, None)
+        if isinstance(handshake.get('p'), int) and 0 < handshake['p'] < 2 ** 16:
+            self.listen_port = handshake['p']
+        if isinstance(handshake.get('v'), (str, bytes)):
+            self.client = handshake['v']
+        self.extended_handshake_event.emit(self)
+
+    def _padded_bitfield(self, value: bool) -> bitstring.BitArray:
+        bitfield = bitstring.BitArray(len(self.bitfield))
+        if value:
+            bitfield.set(True, range(self.number_of_pieces))
+        return bitfield
 
     def handle_handshake_for_buffer(self) -> bool:
         if len(self.buffer) >= 68 and unpack('!B', self.buffer[:1])[0] == 19:
             handshake_message = Message.HandshakeMessage.decode(self.buffer[:68])
-            self.handshake = True
+            self.on_handshake(handshake_message)
             self.buffer = self.buffer[68:]
             return True
         return False
@@ -175,14 +306,17 @@ class PeerConnection:
     async def read_socket(self):
         try:
             data = await self.reader.read(4096)
+            if not data:
+                logging.info(f'Пир {self.ip}:{self.port} закрыл соединение')
+                self.is_active = False
+                return
+            self.last_message_received = time.monotonic()
             self.buffer += data
         except (asyncio.TimeoutError, OSError):
             logging.error('Таймаут чтения с сокета')
             self.is_active = False
 
     async def run(self):
-        self.peer_interested = True
-
         if not self.interested and self.bitfield.any(True):
             await self.send_message_to_peer(Message.InterestedMessage())
             self.interested = True
@@ -205,7 +339,6 @@ class PeerConnection:
                     received_message = self.analyze_message(message)
                     if received_message:
                         await self.handle_message(received_message)
-            await asyncio.sleep(0.1)
 
     async def handle_message(self, new_message):
         match new_message:
@@ -233,11 +366,34 @@ class PeerConnection:
                 self.handle_piece_receive(new_message)
             case Message.CancelMessage():
                 logging.info('got cancel message')
+                self.cancel_event.emit(new_message, self)
+            case Message.HaveAllMessage() if self.supports_fast:
+                await self.handle_available_piece(Message.PeerSegmentsMessage(self._padded_bitfield(True)))
+            case Message.HaveNoneMessage() if self.supports_fast:
+                self.set_bitfield(self._padded_bitfield(False))
+            case Message.RejectRequestMessage() if self.supports_fast:
+                self.reject_event.emit(new_message, self)
+            case Message.SuggestPieceMessage() if self.supports_fast:
+                self.suggest_event.emit(self, new_message.piece_index)
+            case Message.AllowedFastMessage() if self.supports_fast:
+                if new_message.piece_index < self.number_of_pieces:
+                    self.allowed_fast.add(new_message.piece_index)
+                    self.allowed_fast_event.emit(self, new_message.piece_index)
+            case Message.ExtendedMessage() if self.supports_extensions:
+                self.handle_extended_message(new_message)
             case _:
                 logging.error(f'Такого типа сообщения нет: {type(new_message)}')
 
+    def clear_events(self):
+        for event in (self.receive_event, self.request_event, self.bitfield_update_event, self.have_message_event,
+                      self.unchoke_event, self.disconnect_event, self.interest_event,
+                      self.cancel_event, self.reject_event, self.suggest_event, self.allowed_fast_event,
+                      self.extended_handshake_event, self.extended_message_event):
+            event.clear()
+
     async def close(self):
         self.is_active = False
+        self.clear_events()
         if self.writer:
             self.writer.close()
         if self.reader:
@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import configuration
+
+from event_bus import Event
+from peer_connection import PeerConnection
+from timer_scheduler import TimerScheduler
+
+
+class PeerConnector:
+    """
+    Opens outgoing peer connections concurrently.
+    At most max_half_open attempts are in flight, each one is bounded by a connect and a handshake timeout
+    and succeeds only if the remote handshake carries our info_hash.
+    A failed address is retried with exponential backoff, up to max_attempts times.
+    """
+
+    def __init__(self, timers: TimerScheduler, max_half_open=configuration.MAX_HALF_OPEN_CONNECTIONS,
+                 max_attempts=configuration.MAX_CONNECT_ATTEMPTS):
+        self.timers = timers
+        self.max_half_open = max_half_open
+        self.max_attempts = max_attempts
+
+        self.connected_event = Event()  # args: peer
+        self.failed_event = Event()  # args: peer, retrying
+
+        self.pending = 0
+        self.failures = {}  # (ip, port): failed attempts
+
+        self._slots = asyncio.Semaphore(max_half_open)
+        self._tasks = set()
+        self._retry_timers = {}
+
+    @staticmethod
+    def address(peer: PeerConnection):
+        return peer.ip, peer.port
+
+    def connect(self, peer: PeerConnection):
+        self._retry_timers.pop(self.address(peer), None)
+        self.pending += 1
+        task = asyncio.create_task(self._attempt(peer))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _attempt(self, peer: PeerConnection):
+        try:
+            async with self._slots:
+                connected = await self._open(peer)
+        finally:
+            self.pending -= 1
+
+        if connected:
+            self.failures.pop(self.address(peer), None)
+            self.connected_event.emit(peer)
+        else:
+            await peer.close()
+            self.failed_event.emit(peer, self._schedule_retry(peer))
+
+    async def _open(self, peer: PeerConnection) -> bool:
+        peer.buffer = b''
+        try:
+            if not await peer.connect():  # bounded per transport by UTP_CONNECT_TIMEOUT and CONNECT_TIMEOUT
+                return False
+            return await asyncio.wait_for(self._exchange_handshake(peer), configuration.HANDSHAKE_TIMEOUT)
+        except (asyncio.TimeoutError, OSError, EOFError):
+            logging.info(f'Пир {peer.ip}:{peer.port} не ответил вовремя')
+            return False
+
+    @staticmethod
+    async def _exchange_handshake(peer: PeerConnection) -> bool:
+        return await peer.handle_handshake() and await peer.receive_handshake()
+
+    def _schedule_retry(self, peer: PeerConnection) -> bool:
+        address = self.address(peer)
+        failures = self.failures.get(address, 0) + 1
+        self.failures[address] = failures
+        if failures >= self.max_attempts:
+            logging.info(f'Пир {peer.ip}:{peer.port} недоступен после {failures} попыток')
+            del self.failures[address]
+            return False
+
+        delay = configuration.CONNECT_RETRY_DELAY * 2 ** (failures - 1)
+        self._retry_timers[address] = self.timers.call_later(delay, self.connect, peer)
+        return True
+
+    def close(self):
+        for timer in self._retry_timers.values():
+            timer.cancel()
+        self._retry_timers.clear()
+        for task in self._tasks:
+            task.cancel()
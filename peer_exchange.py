@@ -0,0 +1,141 @@
+import asyncio
+import ipaddress
+import logging
+import time
+import bencode
+import configuration
+
+from peer_connection import PeerConnection
+from peer_store import PeerStore
+from requests_receiver import PeerReceiver
+from timer_scheduler import TimerScheduler
+
+SEED_FLAG = 0x02
+CONNECTABLE_FLAG = 0x10
+
+_raw_bencode = bencode.Bencode(encoding=None)  # compact peer strings must stay bytes
+
+
+def encode_compact_peers(addresses) -> bytes:
+    return b''.join(ipaddress.IPv4Address(ip).packed + port.to_bytes(2, 'big') for ip, port in addresses)
+
+
+def decode_compact_peers(data: bytes) -> list[tuple[str, int]]:
+    return [(str(ipaddress.IPv4Address(data[i:i + 4])), int.from_bytes(data[i + 4:i + 6], 'big'))
+            for i in range(0, len(data) - len(data) % 6, 6)]
+
+
+class PeerExchange:
+    """
+    ut_pex (BEP 11) of one torrent.
+    Every PEX_INTERVAL each peer that supports ut_pex gets the changes in our connected peers since
+    its previous message, at most PEX_MAX_PEERS added and dropped addresses at a time.
+    Addresses received from peers go to the peer store, a peer sending more often than once per interval is ignored.
+    """
+
+    def __init__(self, peers: list[PeerConnection], peer_store: PeerStore, timers: TimerScheduler,
+                 interval=configuration.PEX_INTERVAL, max_peers=configuration.PEX_MAX_PEERS):
+        self.peers = peers
+        self.peer_store = peer_store
+        self.timers = timers
+        self.interval = interval
+        self.max_peers = max_peers
+
+        self.sent = {}  # peer: addresses the peer has learned from us
+        self.received = {}  # peer: time of the last accepted message
+        self._timer = None
+
+    def start(self):
+        if self._timer is None:
+            self._schedule()
+
+    def _schedule(self):
+        self._timer = self.timers.call_later(self.interval, self._on_pex_deadline)
+
+    def _on_pex_deadline(self):
+        self._schedule()
+        asyncio.create_task(self.send_updates())
+
+    @staticmethod
+    def advertised_address(peer: PeerConnection) -> tuple[str, int] | None:
+        if not peer.is_active or not peer.listen_port:
+            return None
+        try:
+            ipaddress.IPv4Address(peer.ip)
+        except ValueError:
+            return None
+        return peer.ip, peer.listen_port
+
+    def connected(self) -> dict[tuple[str, int], int]:
+        addresses = {}
+        for peer in self.peers:
+            address = self.advertised_address(peer)
+            if address is None:
+                continue
+            flags = 0 if isinstance(peer, PeerReceiver) else CONNECTABLE_FLAG
+            bits = peer.bitfield[:peer.number_of_pieces]
+            if peer.number_of_pieces and bits.all(True):
+                flags |= SEED_FLAG
+            addresses[address] = flags
+        return addresses
+
+    def make_message(self, peer: PeerConnection, connected: dict[tuple[str, int], int]) -> bytes | None:
+        known = self.sent.setdefault(peer, set())
+        own_address = self.advertised_address(peer)
+        added = [address for address in connected if address not in known and address != own_address]
+        dropped = [address for address in known if address not in connected]
+        added, dropped = added[:self.max_peers], dropped[:self.max_peers]
+        if not added and not dropped:
+            return None
+
+        known.update(added)
+        known.difference_update(dropped)
+        return bencode.encode({'added': encode_compact_peers(added),
+                               'added.f': bytes(connected[address] for address in added),
+                               'dropped': encode_compact_peers(dropped)})
+
+    async def send_updates(self):
+        for peer in list(self.sent):
+            if peer not in self.peers:
+                del self.sent[peer]
+                self.received.pop(peer, None)
+
+        connected = self.connected()
+        for peer in list(self.peers):
+            if not peer.is_active or 'ut_pex' not in peer.extensions:
+                continue
+            message = self.make_message(peer, connected)
+            if message is not None:
+                await peer.send_extended_message('ut_pex', message)
+
+    def on_message(self, peer: PeerConnection, name, payload: bytes):
+        if name != 'ut_pex':
+            return
+        now = time.monotonic()
+        if now - self.received.get(peer, -self.interval) < self.interval / 2:
+            logging.info(f'Пир {peer.ip} присылает PEX слишком часто')
+            return
+        self.received[peer] = now
+
+        try:
+            message = _raw_bencode.decode(payload)
+        except bencode.BencodeDecodeError:
+            logging.error(f'Пир {peer.ip} прислал некорректное PEX сообщение')
+            return
+        added = message.get(b'added') if isinstance(message, dict) else None
+        if not isinstance(added, bytes):
+            return
+
+        new_peers = 0
+        for ip, port in decode_compact_peers(added)[:self.max_peers]:
+            if not port or (ip, port) == (self.peer_store.own_ip, self.peer_store.port):
+                continue
+            if self.peer_store.add(ip, port, 'pex'):
+                new_peers += 1
+        if new_peers:
+            logging.info(f'PEX: пир {peer.ip} сообщил о {new_peers} новых пирах')
+
+    def close(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
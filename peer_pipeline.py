@@ -0,0 +1,74 @@
+import math
+import time
+import configuration
+
+
+class PeerPipeline:
+    """
+    Per-peer request queue controller.
+    Depth follows the bandwidth-delay product, block timeout follows the smoothed response time (RFC 6298).
+    """
+
+    RTT_ALPHA = 1 / 8
+    RTT_BETA = 1 / 4
+    RATE_ALPHA = 1 / 4
+
+    def __init__(self):
+        self.srtt = None
+        self.rttvar = None
+        self.min_rtt = None
+        self.rate = 0
+
+        self._backoff = 1
+        self._window_start = None
+        self._window_bytes = 0
+
+    @property
+    def timeout(self) -> float:
+        if self.srtt is None:
+            timeout = configuration.INITIAL_BLOCK_TIMEOUT
+        else:
+            timeout = self.srtt + 4 * self.rttvar
+        timeout *= self._backoff
+        return min(max(timeout, configuration.MIN_BLOCK_TIMEOUT), configuration.MAX_BLOCK_TIMEOUT)
+
+    @property
+    def depth(self) -> int:
+        if self.min_rtt is None or not self.rate:
+            return configuration.MIN_PIPELINE_DEPTH
+        bdp_blocks = math.ceil(self.rate * self.min_rtt * configuration.PIPELINE_BDP_FACTOR / configuration.BLOCK_LENGTH)
+        return min(max(bdp_blocks, configuration.MIN_PIPELINE_DEPTH), configuration.MAX_PIPELINE_DEPTH)
+
+    def on_block_received(self, size, rtt, now=None):
+        now = time.monotonic() if now is None else now
+        self._update_rtt(rtt)
+        self._update_rate(size, now)
+        self._backoff = 1
+
+    def on_timeout(self):
+        self._backoff = min(self._backoff * 2, configuration.MAX_BLOCK_TIMEOUT_BACKOFF)
+
+    def _update_rtt(self, rtt):
+        if self.srtt is None:
+            self.srtt = rtt
+            self.rttvar = rtt / 2
+        else:
+            self.rttvar = (1 - self.RTT_BETA) * self.rttvar + self.RTT_BETA * abs(self.srtt - rtt)
+            self.srtt = (1 - self.RTT_ALPHA) * self.srtt + self.RTT_ALPHA * rtt
+        self.min_rtt = rtt if self.min_rtt is None else min(self.min_rtt, rtt)
+
+    def _update_rate(self, size, now):
+        if self._window_start is None:
+            self._window_start = now - self.min_rtt
+        self._window_bytes += size
+
+        elapsed = now - self._window_start
+        if elapsed < configuration.PIPELINE_RATE_WINDOW and self.rate:
+            return
+        if elapsed <= 0:
+            return
+
+        sample = self._window_bytes / elapsed
+        self.rate = sample if not self.rate else (1 - self.RATE_ALPHA) * self.rate + self.RATE_ALPHA * sample
+        self._window_start = now
+        self._window_bytes = 0
@@ -0,0 +1,233 @@
+import asyncio
+import ipaddress
+import logging
+import pickle
+import time
+import configuration
+
+from pathlib import Path
+from peer_connection import PeerConnection
+
+
+def _make_crc32c_table() -> list[int]:
+    table = []
+    for byte in range(256):
+        crc = byte
+        for _ in range(8):
+            crc = (crc >> 1) ^ 0x82F63B78 if crc & 1 else crc >> 1
+        table.append(crc)
+    return table
+
+
+_CRC32C_TABLE = _make_crc32c_table()
+
+
+def crc32c(data: bytes) -> int:
+    crc = 0xFFFFFFFF
+    for byte in data:
+        crc = _CRC32C_TABLE[(crc ^ byte) & 0xFF] ^ (crc >> 8)
+    return crc ^ 0xFFFFFFFF
+
+
+def canonical_priority(first, second) -> int:
+    """BEP 40 priority of the connection between two IPv4 endpoints (ip, port)"""
+    first_ip, second_ip = ipaddress.IPv4Address(first[0]).packed, ipaddress.IPv4Address(second[0]).packed
+    if first_ip == second_ip:
+        return crc32c(b''.join(sorted(port.to_bytes(2, 'big') for port in (first[1], second[1]))))
+
+    if first_ip[:3] == second_ip[:3]:
+        mask = b'\xff\xff\xff\xff'
+    elif first_ip[:2] == second_ip[:2]:
+        mask = b'\xff\xff\xff\x55'
+    else:
+        mask = b'\xff\xff\x55\x55'
+    masked = sorted(bytes(octet & mask_octet for octet, mask_octet in zip(ip, mask)) for ip in (first_ip, second_ip))
+    return crc32c(b''.join(masked))
+
+
+class PeerCandidate:
+    __slots__ = ('ip', 'port', 'source', 'failures', 'throughput', 'banned', 'last_seen', 'retry_at',
+                 'connected_at', 'in_use')
+
+    def __init__(self, ip, port, source, failures=0, throughput=0, banned=False, last_seen=None):
+        self.ip = ip
+        self.port = port
+        self.source = source
+        self.failures = failures
+        self.throughput = throughput
+        self.banned = banned
+        self.last_seen = last_seen if last_seen is not None else time.time()
+        self.retry_at = 0
+        self.connected_at = None
+        self.in_use = False
+
+    @property
+    def address(self):
+        return self.ip, self.port
+
+
+class PeerStore:
+    """
+    Connection candidates of one torrent, merged from all peer sources and the previous session.
+    get() hands out the best idle candidate: peers with measured throughput first, then fresh ones
+    in BEP 40 priority order, peers with failed connects last and only after their retry delay.
+    """
+
+    def __init__(self, info_hash, number_of_pieces, port=0, transport=None, path: Path = None,
+                 max_candidates=configuration.MAX_PEER_CANDIDATES):
+        self.info_hash = info_hash
+        self.number_of_pieces = number_of_pieces
+        self.port = port
+        self.transport = transport
+        self.path = path
+        self.max_candidates = max_candidates
+
+        self.candidates = {}  # (ip, port): PeerCandidate
+        self.own_ip = None
+        self._ranks = {}
+        self._changed = asyncio.Event()
+
+    def __len__(self):
+        return len(self.candidates)
+
+    def __contains__(self, address):
+        return address in self.candidates
+
+    @property
+    def active(self) -> int:
+        return sum(candidate.in_use for candidate in self.candidates.values())
+
+    def add(self, ip, port, source='tracker') -> bool:
+        candidate = self.candidates.get((ip, port))
+        if candidate is not None:
+            candidate.last_seen = time.time()
+            return False
+
+        self.candidates[(ip, port)] = PeerCandidate(ip, port, source)
+        if len(self.candidates) > self.max_candidates:
+            self._evict()
+        self._changed.set()
+        return True
+
+    def ban(self, ip):
+        for candidate in self.candidates.values():
+            if candidate.ip == ip:
+                candidate.banned = True
+
+    def set_own_ip(self, ip):
+        if ip != self.own_ip:
+            self.own_ip = ip
+            self._ranks.clear()
+
+    def rank(self, candidate: PeerCandidate) -> int:
+        if self.own_ip is None:
+            return 0
+        if candidate.address not in self._ranks:
+            try:
+                self._ranks[candidate.address] = canonical_priority((self.own_ip, self.port), candidate.address)
+            except ValueError:
+                self._ranks[candidate.address] = 0
+        return self._ranks[candidate.address]
+
+    def sort_key(self, candidate: PeerCandidate):
+        return candidate.failures, -candidate.throughput, -self.rank(candidate)
+
+    def is_available(self, candidate: PeerCandidate, now) -> bool:
+        return not candidate.banned and not candidate.in_use and candidate.retry_at <= now
+
+    def next_candidate(self) -> PeerCandidate | None:
+        now = time.monotonic()
+        available = [candidate for candidate in self.candidates.values() if self.is_available(candidate, now)]
+        return min(available, key=self.sort_key, default=None)
+
+    def _next_retry_delay(self) -> float | None:
+        now = time.monotonic()
+        retries = [candidate.retry_at - now for candidate in self.candidates.values()
+                   if not candidate.banned and not candidate.in_use and candidate.retry_at > now]
+        return min(retries, default=None)
+
+    async def get(self) -> PeerConnection:
+        while True:
+            candidate = self.next_candidate()
+            if candidate is not None:
+                candidate.in_use = True
+                return PeerConnection(candidate.ip, self.number_of_pieces, self.info_hash, candidate.port,
+                                      transport=self.transport)
+
+            self._changed.clear()
+            try:
+                await asyncio.wait_for(self._changed.wait(), self._next_retry_delay())
+            except asyncio.TimeoutError:
+                pass
+
+    def release(self, peer: PeerConnection, retry_after=0):
+        candidate = self.candidates.get((peer.ip, peer.port))
+        if candidate is None:
+            return
+        candidate.in_use = False
+        candidate.retry_at = time.monotonic() + retry_after
+        self._changed.set()
+
+    def on_connected(self, peer: PeerConnection):
+        candidate = self.candidates.get((peer.ip, peer.port))
+        if candidate is None:
+            return
+        if self.own_ip is None and peer.writer is not None:
+            sockname = peer.writer.get_extra_info('sockname')
+            if isinstance(sockname, tuple):
+                self.set_own_ip(sockname[0])
+        candidate.failures = 0
+        candidate.last_seen = time.time()
+        candidate.connected_at = time.monotonic()
+
+    def on_connect_failed(self, peer: PeerConnection, final=True):
+        candidate = self.candidates.get((peer.ip, peer.port))
+        if candidate is None:
+            return
+        candidate.failures += 1
+        if final:
+            self.release(peer, configuration.CONNECT_RETRY_DELAY * 2 ** candidate.failures)
+
+    def on_disconnected(self, peer: PeerConnection, retry_after=configuration.PEER_RECONNECT_DELAY):
+        candidate = self.candidates.get((peer.ip, peer.port))
+        if candidate is None:
+            return
+        if candidate.connected_at is not None:
+            duration = max(time.monotonic() - candidate.connected_at, 1)
+            candidate.throughput = peer.downloaded / duration
+            candidate.connected_at = None
+        self.release(peer, retry_after)
+
+    def _evict(self):
+        idle = [candidate for candidate in self.candidates.values() if not candidate.in_use]
+        if not idle:
+            return
+        worst = max(idle, key=lambda candidate: (not candidate.banned, self.sort_key(candidate),
+                                                 -candidate.last_seen))
+        del self.candidates[worst.address]
+
+    def save(self):
+        if self.path is None:
+            return
+        records = [(candidate.ip, candidate.port, candidate.failures, candidate.throughput, candidate.banned,
+                    candidate.last_seen) for candidate in self.candidates.values()]
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        with open(self.path, 'wb') as f:
+            pickle.dump(records, f)
+
+    def load(self):
+        if self.path is None or not self.path.exists():
+            return
+        try:
+            with open(self.path, 'rb') as f:
+                records = pickle.load(f)
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logging.error(f"Unable to load peer cache {self.path}: {e}")
+            return
+
+        oldest = time.time() - configuration.PEER_CACHE_MAX_AGE
+        for ip, port, failures, throughput, banned, last_seen in records:
+            if last_seen >= oldest and (ip, port) not in self.candidates:
+                self.candidates[(ip, port)] = PeerCandidate(ip, port, 'cache', failures, throughput, banned, last_seen)
+        logging.info(f"Loaded {len(self.candidates)} cached peers")
+        self._changed.set()
@@ -0,0 +1,86 @@
+import hashlib
+import math
+import configuration
+
+
+class PieceBuffer:
+    """
+    Assembly buffer of one in-flight piece.
+    Blocks are copied once into a preallocated bytearray and SHA-1 advances as the contiguous prefix grows.
+    A prefix jump larger than inline_hash_limit is left for digest(), which HashVerifier runs off the loop.
+    """
+
+    def __init__(self, length, block_length=configuration.BLOCK_LENGTH, inline_hash_limit=configuration.INLINE_HASH_LIMIT):
+        self.length = length
+        self.block_length = block_length
+        self.blocks_count = math.ceil(length / block_length)
+        self.inline_hash_limit = inline_hash_limit
+
+        self._buffer = bytearray(length)
+        self._view = memoryview(self._buffer)
+        self._received = bytearray(self.blocks_count)
+        self._received_count = 0
+        self._contiguous_blocks = 0
+        self._hashed_blocks = 0
+        self._hash = hashlib.sha1()
+
+    def reset(self):
+        self._received[:] = bytes(self.blocks_count)
+        self._received_count = 0
+        self._contiguous_blocks = 0
+        self._hashed_blocks = 0
+        self._hash = hashlib.sha1()
+
+    def expected_length(self, offset) -> int:
+        return min(self.block_length, self.length - offset)
+
+    def has_block(self, offset) -> bool:
+        return bool(self._received[offset // self.block_length])
+
+    def write(self, offset, data) -> bool:
+        if offset % self.block_length or not 0 <= offset < self.length or len(data) != self.expected_length(offset):
+            return False
+
+        index = offset // self.block_length
+        if self._received[index]:
+            return False
+
+        self._view[offset:offset + len(data)] = data
+        self._received[index] = 1
+        self._received_count += 1
+        self._advance_hash()
+        return True
+
+    def _advance_hash(self):
+        while self._contiguous_blocks < self.blocks_count and self._received[self._contiguous_blocks]:
+            self._contiguous_blocks += 1
+        if (self._contiguous_blocks - self._hashed_blocks) * self.block_length <= self.inline_hash_limit:
+            self._hash_contiguous_prefix()
+
+    def _hash_contiguous_prefix(self):
+        if self._contiguous_blocks == self._hashed_blocks:
+            return
+        self._hash.update(self._view[self._hashed_blocks * self.block_length:
+                                     min(self._contiguous_blocks * self.block_length, self.length)])
+        self._hashed_blocks = self._contiguous_blocks
+
+    @property
+    def is_complete(self) -> bool:
+        return self._received_count == self.blocks_count
+
+    @property
+    def hashed_length(self) -> int:
+        return min(self._hashed_blocks * self.block_length, self.length)
+
+    @property
+    def data(self) -> memoryview:
+        return self._view
+
+    def digest(self) -> bytes:
+        if not self.is_complete:
+            raise ValueError('Piece is not complete')
+        self._hash_contiguous_prefix()
+        return self._hash.digest()
+
+    def verify(self, expected_hash) -> bool:
+        return self.is_complete and self.digest() == expected_hash
@@ -0,0 +1,38 @@
+import configuration
+
+from block_table import BlockTable
+from piece_buffer import PieceBuffer
+
+
+class PiecePool:
+    """
+    Free list of piece buffers and block tables shared by all segment downloaders of the session.
+    Records are grouped by piece length, at most max_free_bytes of buffers are kept idle.
+    """
+
+    def __init__(self, max_free_bytes=configuration.PIECE_POOL_BYTES):
+        self.max_free_bytes = max_free_bytes
+        self.free_bytes = 0
+        self._free = {}
+
+    def acquire(self, length) -> tuple[PieceBuffer, BlockTable]:
+        free = self._free.get(length)
+        if not free:
+            piece = PieceBuffer(length)
+            return piece, BlockTable(piece.blocks_count)
+
+        piece, blocks = free.pop()
+        self.free_bytes -= length
+        piece.reset()
+        blocks.reset()
+        return piece, blocks
+
+    def release(self, piece: PieceBuffer, blocks: BlockTable):
+        if self.free_bytes + piece.length > self.max_free_bytes:
+            return
+        self._free.setdefault(piece.length, []).append((piece, blocks))
+        self.free_bytes += piece.length
+
+    def clear(self):
+        self._free.clear()
+        self.free_bytes = 0
@@ -1,7 +1,7 @@
 import asyncio
 import logging
 import socket
-from pubsub import pub
+from event_bus import Event
 import bitstring
 import Message
 
@@ -10,13 +10,14 @@ from struct import unpack
 
 
 class PeerReceiver(PeerConnection):
-    GOT_HANDSHAKE_EVENT = 'gotHandshakeMessage'  # + ip + port, args: handshakeMessage
 
-    def __init__(self, sock, address):
+    def __init__(self, sock, address, streams=None):
         PeerConnection.__init__(self, address[0], 0, '', address[1])
+        self.listen_port = None  # known only from the extended handshake
         self.sock = sock
+        self.streams = streams  # (reader, writer) of an already accepted uTP connection
         logging.info(address)
-        self.got_handshake_event = PeerReceiver.GOT_HANDSHAKE_EVENT + address[0] + str(PeerConnection.ID)
+        self.got_handshake_event = Event()  # args: handshake_message
 
         self.already_connected = False
         self.already_running = False
@@ -38,8 +39,8 @@ class PeerReceiver(PeerConnection):
     def handle_handshake_for_buffer(self) -> bool:
         if len(self.buffer) >= 68 and unpack('!B', self.buffer[:1])[0] == 19:
             handshake_message = Message.HandshakeMessage.decode(self.buffer[:68])
-            pub.sendMessage(topicName=self.got_handshake_event, handshake_message=handshake_message)
-            self.handshake = True
+            self.got_handshake_event.emit(handshake_message)
+            self.on_handshake(handshake_message)
             self.buffer = self.buffer[68:]
             return True
         return False
@@ -48,7 +49,7 @@ class PeerReceiver(PeerConnection):
         await self.connect()
 
         self.run_task = asyncio.create_task(self.run())
-        pub.subscribe(self._get_handshake, self.got_handshake_event)
+        self.got_handshake_event.subscribe(self._get_handshake)
         for _ in range(1000):
             await asyncio.sleep(.01)
             if self.info_hash:
@@ -63,19 +64,23 @@ class PeerReceiver(PeerConnection):
 
     async def initiate_bitfield(self, number_of_pieces, our_bitfield: bitstring.BitArray):
         bitfield_length = number_of_pieces if number_of_pieces % 8 == 0 else number_of_pieces + 8 - number_of_pieces % 8
+        self.number_of_pieces = number_of_pieces
         self.bitfield = bitstring.BitArray(bitfield_length)
 
-    def close(self):
+    async def close(self):
         if self.run_task:
             self.run_task.cancel()
-        PeerConnection.close(self)
+        await PeerConnection.close(self)
 
     async def connect(self) -> bool:
         if self.already_connected:
             return True
 
         try:
-            self.reader, self.writer = await asyncio.open_connection(sock=self.sock)
+            if self.streams is not None:
+                self.reader, self.writer = self.streams
+            else:
+                self.reader, self.writer = await asyncio.open_connection(sock=self.sock)
             self.is_active = True
         except (asyncio.TimeoutError, OSError):
             logging.error(f'Socket error: Пир {self.ip}:{self.port} не может быть подключён')
@@ -85,10 +90,10 @@ class PeerReceiver(PeerConnection):
 
 
 class RequestsReceiver:
-    NEW_PEER_EVENT = 'newPeerReceived1213u213'
     ACCEPT_TIMEOUT = .1
 
     def __init__(self):
+        self.new_peer_event = Event()  # args: peer, info_hash
         self.sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.available_peers = asyncio.Queue()
         self.sock.bind(('', 52656))
@@ -106,6 +111,9 @@ class RequestsReceiver:
     def start_server(self):
         self._task = asyncio.create_task(self._run_server())
 
+    def start_utp_server(self, utp_socket):
+        utp_socket.start_server(self.add_utp_peer)
+
     async def _run_server(self):
         self.sock.listen(1)
         self.sock.setblocking(False)
@@ -122,9 +130,15 @@ class RequestsReceiver:
 
     async def add_peer(self, sock, address):
         logging.info(f"Incoming connection from {address}")
-        peer = PeerReceiver(sock, address)
+        await self._receive_peer(PeerReceiver(sock, address))
+
+    async def add_utp_peer(self, reader, writer):
+        await self._receive_peer(PeerReceiver(None, writer.get_extra_info('peername'), streams=(reader, writer)))
+
+    async def _receive_peer(self, peer):
         info_hash = await peer.get_info_hash()
         if not info_hash:
+            await peer.close()
             return
 
-        pub.sendMessage(topicName=RequestsReceiver.NEW_PEER_EVENT, peer=peer, info_hash=info_hash)
+        self.new_peer_event.emit(peer, info_hash)
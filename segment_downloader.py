@@ -2,14 +2,17 @@ import logging
 import asyncio
 import Message
 import parser
-import math
-import hashlib
+import time
 import configuration
 
 from enum import Enum
-from pubsub import pub
+from event_bus import Event
 from peer_connection import PeerConnection
-from block import Block
+from block_table import BlockTable
+from piece_pool import PiecePool
+from hash_verifier import HashVerifier
+from corruption_tracker import CorruptionTracker
+from timer_scheduler import TimerScheduler
 
 
 class SegmentDownloadStatus(Enum):
@@ -37,6 +40,8 @@ class Segment:
         self._status = value
 
     def add_peer(self, peer):
+        if peer in self.peers:
+            return
         self.peers.append(peer)
         self.peers_count += 1
 
@@ -47,36 +52,44 @@ class Segment:
 
 class SegmentDownloader:
 
-    PEER_DELETION_EVENT = 'peerDeleted'  # + segment.id, args: segment_downloader
-    DOWNLOADING_STOPPED_EVENT = 'downloadingStopped'  # + segment.id, args: segment_downloader
-
     def __init__(self, segment, torrent_data: parser.TorrentData,
-                 file_writer, torrent_statistics, peers: list[PeerConnection]):
+                 file_writer, torrent_statistics, peers: list[PeerConnection], timers: TimerScheduler = None,
+                 verifier: HashVerifier = None, pool: PiecePool = None, corruption: CorruptionTracker = None):
         self.torrent_data = torrent_data
+        self.timers = timers if timers is not None else TimerScheduler()
+        self.verifier = verifier if verifier is not None else HashVerifier()
+        self.pool = pool if pool is not None else PiecePool()
+        self.corruption = corruption if corruption is not None else CorruptionTracker(self.verifier)
         self.file_writer = file_writer
         self.torrent_stat = torrent_statistics
         self.segment = segment
         self.download_result = SegmentDownloadStatus.PENDING
 
-        self.peer_deletion_event = SegmentDownloader.PEER_DELETION_EVENT + str(segment.id)
-        self.downloading_stopped_event = SegmentDownloader.DOWNLOADING_STOPPED_EVENT + str(segment.id)
-
-        segment_length = torrent_data.segment_length if segment.id != torrent_data.total_segments - 1 \
-            else torrent_data.total_length % torrent_data.segment_length
+        self.peer_deletion_event = Event()  # args: segment_downloader
+        self.downloading_stopped_event = Event()  # args: segment_downloader
 
-        self.blocks_count = math.ceil(segment_length / Block.BLOCK_LENGTH)
+        segment_length = min(torrent_data.segment_length,
+                             torrent_data.total_length - segment.id * torrent_data.segment_length)
+        self.piece, self.blocks = self.pool.acquire(segment_length)
+        self.blocks_count = self.blocks.blocks_count
 
-        self.downloaded_blocks = set()
-        self.missing_blocks = ([Block(self.segment.id, i * Block.BLOCK_LENGTH) for i in range(self.blocks_count - 1)] +
-                               [Block(self.segment.id, (self.blocks_count - 1) * Block.BLOCK_LENGTH,
-                                      segment_length % Block.BLOCK_LENGTH)])
+        self.in_flight = {}
+        self.peers_strikes = {}
+        self._choked_since = {}
+        self._requester_ids = {}
+        self._requesters = {}
+        self._last_requester_id = 0
 
-        self.tasks = {peer: set() for peer in peers}
-        self.peers_strikes = {peer: 0 for peer in peers}
         self.downloading_task = None
+        self._finishing = False  # the piece is being hashed or written, worker threads may read the buffer
+        self.endgame = False
+        self._update_event = asyncio.Event()
+        self._timeout_timer = None
+        self._timeout_deadline = None
+        self._choke_timer = None
 
         for peer in peers:
-            pub.subscribe(self.on_receive_block, peer.receive_event)
+            self.add_peer(peer)
 
     def download_segment(self):
         self.downloading_task = asyncio.create_task(self._download_segment())
@@ -84,59 +97,166 @@ class SegmentDownloader:
     async def _download_segment(self):
         logging.info('Starting downloading segment')
 
-        while len(self.downloaded_blocks) != self.blocks_count:
-            self.check_tasks_completion()
+        while not self.piece.is_complete:
             await self.check_peers_connection()
+            await self.request_missing_blocks()
 
-            while (any(self.tasks) and any(self.missing_blocks)
-                   and sum(len(self.tasks[peer]) for peer in self.tasks) < configuration.MAX_PENDING_BLOCKS):
-                lazy_peer = min(list(self.tasks), key=lambda peer: len(self.tasks[peer]))
-                block = self.missing_blocks.pop()
-                await self.request_block(block, lazy_peer)
+            if self.endgame and not self.blocks.missing_count:
+                await self.request_endgame_blocks()
 
-            await asyncio.sleep(.01)
+            await self.wait_for_update()
 
-        data = self.assemble_segment()
-        if hashlib.sha1(data).digest() != self.torrent_data.segments_hash[self.segment.id]:
+        self.release_peers()
+        self._finishing = True
+        if not await self.verifier.verify_piece(self.piece, self.torrent_data.segments_hash[self.segment.id]):
             self.segment.status = SegmentDownloadStatus.FAILED
-            pub.sendMessage(self.downloading_stopped_event, downloader=self)
+            await self.corruption.on_piece_failed(self.segment.id, self.piece, self.block_senders())
+        else:
+            await self.corruption.on_piece_passed(self.segment.id, self.piece)
+            self.torrent_stat.update_downloaded(self.piece.length)
+            self.segment.status = SegmentDownloadStatus.SUCCESS
+            await self.file_writer.write_segment(self.segment.id, self.piece.data)
+
+        self.release_piece()
+        self.downloading_stopped_event.emit(self)
+
+    async def wait_for_update(self):
+        await self._update_event.wait()
+        self._update_event.clear()
+
+    def block_offset(self, index) -> int:
+        return index * configuration.BLOCK_LENGTH
+
+    def block_length(self, index) -> int:
+        return self.piece.expected_length(self.block_offset(index))
+
+    def block_senders(self) -> list:
+        return [self._requesters.get(sender) for sender in self.blocks.senders]
+
+    async def request_missing_blocks(self):
+        failed_peers = set()
+        while self.blocks.missing_count:
+            ready_peers = [peer for peer in self.in_flight
+                           if peer not in failed_peers and self.in_flight[peer] < peer.pipeline.depth
+                           and peer.can_request(self.segment.id)]
+            if not ready_peers:
+                return
+            lazy_peer = min(ready_peers, key=lambda peer: self.in_flight[peer] / peer.pipeline.depth)
+            if not await self.request_block(self.blocks.next_missing(), lazy_peer):
+                failed_peers.add(lazy_peer)
+
+    def on_peer_disconnected(self, peer):
+        self._update_event.set()
+
+    def on_peer_unchoked(self, peer):
+        self._update_event.set()
+
+    def _on_choke_deadline(self):
+        self._choke_timer = None
+        self._update_event.set()
+
+    def on_block_timeout(self, index, peer):
+        if peer not in self.in_flight or self.blocks.remove_request(index, self._requester_ids[peer]) is None:
             return
-
-        self.torrent_stat.update_downloaded(len(data))
-        self.segment.status = SegmentDownloadStatus.SUCCESS
-        await self.file_writer.write_segment(self.segment.id, data)
-        pub.sendMessage(self.downloading_stopped_event, downloader=self)
-
-    def check_tasks_completion(self):
-        for peer in self.tasks:
-            for block in self.tasks[peer].copy():
-                if block.status == Block.Missing:
-                    logging.info(f"Striked peer: {peer.ip}")
-                    self.peers_strikes[peer] += 1
-                    self.tasks[peer].remove(block)
-                    self.missing_blocks.append(block)
-                elif block.status == Block.Retrieved:
-                    logging.info(f'Deleted {peer.ip}')
-                    self.tasks[peer].remove(block)
-                    self.downloaded_blocks.add(block)
+        logging.info(f"Striked peer: {peer.ip}, block timeout {peer.pipeline.timeout:.2f}s")
+        self.peers_strikes[peer] += 1
+        self.in_flight[peer] -= 1
+        peer.pipeline.on_timeout()
+        self._update_event.set()
+
+    def on_reject_block(self, request, peer):
+        if request.index != self.segment.id or peer not in self.in_flight:
+            return
+        index, remainder = divmod(request.byte_offset, configuration.BLOCK_LENGTH)
+        if remainder or index >= self.blocks_count:
+            return
+        if self.blocks.remove_request(index, self._requester_ids[peer]) is None:
+            return
+        logging.info(f"Peer {peer.ip} rejected block {request.byte_offset} of segment {self.segment.id}")
+        self.in_flight[peer] -= 1
+        self._update_event.set()
+
+    def _arm_timeout(self, deadline):
+        if self._timeout_timer is not None:
+            if self._timeout_deadline <= deadline:
+                return
+            self._timeout_timer.cancel()
+        self._timeout_deadline = deadline
+        self._timeout_timer = self.timers.call_later(max(deadline - time.monotonic(), 0), self._on_timeout_deadline)
+
+    def _on_timeout_deadline(self):
+        self._timeout_timer = None
+        for index, requester in self.blocks.expired(time.monotonic()):
+            self.on_block_timeout(index, self._requesters[requester])
+
+        deadline = self.blocks.next_deadline()
+        if deadline is not None:
+            self._arm_timeout(deadline)
 
     async def check_peers_connection(self):
+        now = time.monotonic()
         for peer in list(self.peers_strikes):
             if not peer.is_active or self.peers_strikes[peer] > configuration.MAX_STRIKES_PER_PEER:
                 logging.info(f"Peer was too slow, it got soft ban {peer.ip}")
-                del self.peers_strikes[peer]
-                del self.tasks[peer]
+                self.remove_peer(peer)
                 await peer.close()
-                pub.sendMessage(self.peer_deletion_event, segment_downloader=self)
-
-    async def request_block(self, block, peer):
-        message = Message.RequestsMessage(block.segment_id, block.offset, block.length)
-        if await peer.send_message_to_peer(message):
-            block.status = Block.Pending
-            self.tasks[peer].add(block)
-            block.change_status_to_missing(delay=2)
-        else:
-            self.missing_blocks.append(block)
+                self.peer_deletion_event.emit(self)
+            elif peer.can_request(self.segment.id):
+                self._choked_since.pop(peer, None)
+            elif now - self._choked_since.setdefault(peer, now) >= configuration.UNCHOKE_TIMEOUT:
+                logging.info(f"Peer {peer.ip} keeps choking us, replacing it for segment {self.segment.id}")
+                self.remove_peer(peer)
+                self.peer_deletion_event.emit(self)
+            elif self._choke_timer is None:
+                delay = self._choked_since[peer] + configuration.UNCHOKE_TIMEOUT - now
+                self._choke_timer = self.timers.call_later(delay, self._on_choke_deadline)
+
+    async def request_block(self, index, peer) -> bool:
+        requester = self._requester_ids[peer]
+        now = time.monotonic()
+        timeout = peer.pipeline.timeout
+        if not self.blocks.add_request(index, requester, now, timeout):
+            return False
+
+        message = Message.RequestsMessage(self.segment.id, self.block_offset(index), self.block_length(index))
+        if not await peer.send_message_to_peer(message):
+            self.blocks.remove_request(index, requester)
+            return False
+
+        if peer in self.in_flight:
+            self.in_flight[peer] += 1
+            self._arm_timeout(now + timeout)
+        return True
+
+    def enter_endgame(self, peers):
+        self.endgame = True
+        for peer in peers:
+            self.add_peer(peer)
+
+    async def request_endgame_blocks(self):
+        for index in self.blocks.pending():
+            requesters = self.blocks.requesters_of(index)
+            if len(requesters) >= self.blocks.max_requests:
+                continue
+
+            candidates = [peer for peer in self.in_flight
+                          if self._requester_ids[peer] not in requesters and self.in_flight[peer] < peer.pipeline.depth
+                          and peer.can_request(self.segment.id)]
+            if not candidates:
+                continue
+
+            lazy_peer = min(candidates, key=lambda peer: self.in_flight[peer])
+            logging.info(f"Endgame: requesting block {self.block_offset(index)} of segment {self.segment.id} "
+                         f"from {lazy_peer.ip}")
+            if await self.request_block(index, lazy_peer):
+                self.torrent_stat.update_duplicate_requests()
+
+    def cancel_duplicate_requests(self, index, requesters):
+        message = Message.CancelMessage(self.segment.id, self.block_offset(index), self.block_length(index))
+        for requester in requesters:
+            peer = self._requesters[requester]
+            self.in_flight[peer] -= 1
+            asyncio.create_task(peer.send_message_to_peer(message))
 
     def on_receive_block(self, request=None, peer=None):
         if not request:
@@ -145,33 +265,85 @@ class SegmentDownloader:
         if not peer:
             logging.error('Не указан пир')
             return
+        if request.index != self.segment.id or peer not in self.in_flight:
+            return
 
-        block = Block(request.index, request.byte_offset, len(request.data))
-        if block not in self.tasks[peer]:
+        index, remainder = divmod(request.byte_offset, configuration.BLOCK_LENGTH)
+        if remainder or index >= self.blocks_count:
+            logging.error(f"Получен блок с некорректным смещением: {request.byte_offset}")
+            return
+        if self.blocks.states[index] == BlockTable.RECEIVED:
+            logging.info(f"Got duplicate block {request.byte_offset} of segment {self.segment.id} from {peer.ip}")
+            self.torrent_stat.update_wasted(len(request.data))
+            return
+
+        requested_at = self.blocks.remove_request(index, self._requester_ids[peer])
+        if requested_at is None:
             logging.error("Получен блок, который не был запрошен")
             return
-        self.tasks[peer].remove(block)
-        block.data = request.data
-        self.downloaded_blocks.add(block)
+        self.in_flight[peer] -= 1
+        peer.pipeline.on_block_received(len(request.data), time.monotonic() - requested_at)
 
-    def assemble_segment(self) -> bytes:
-        result = b''.join([block.data for block in sorted(self.downloaded_blocks, key=lambda block: block.offset)])
-        return result
+        if not self.piece.write(request.byte_offset, request.data):
+            logging.error(f"Получен блок некорректной длины: {len(request.data)}, offset {request.byte_offset}")
+        else:
+            self.cancel_duplicate_requests(index, self.blocks.mark_received(index, self._requester_ids[peer]))
+        self._update_event.set()
 
     def add_peer(self, peer):
+        if peer in self.in_flight:
+            return
+        self._last_requester_id += 1
+        self._requester_ids[peer] = self._last_requester_id
+        self._requesters[self._last_requester_id] = peer
         self.peers_strikes[peer] = 0
-        self.tasks[peer] = set()
+        self.in_flight[peer] = 0
 
-        pub.subscribe(self.on_receive_block, peer.receive_event)
+        peer.receive_event.subscribe(self.on_receive_block)
+        peer.disconnect_event.subscribe(self.on_peer_disconnected)
+        peer.reject_event.subscribe(self.on_reject_block)
+        peer.unchoke_event.subscribe(self.on_peer_unchoked)
+        self._update_event.set()
+
+    def remove_peer(self, peer):
+        requester = self._requester_ids.pop(peer)
+        del self.peers_strikes[peer]
+        del self.in_flight[peer]
+        self._choked_since.pop(peer, None)
+        self.blocks.remove_requester(requester)
+
+        peer.receive_event.unsubscribe(self.on_receive_block)
+        peer.disconnect_event.unsubscribe(self.on_peer_disconnected)
+        peer.reject_event.unsubscribe(self.on_reject_block)
+        peer.unchoke_event.unsubscribe(self.on_peer_unchoked)
 
     @property
     def peers(self):
         return list(self.peers_strikes)
 
-    def close(self):
-        for peer in self.tasks:
-            for block in self.tasks[peer].copy():
-                if block.status == Block.Pending:
-                    block.close()
+    def release_peers(self):
+        for peer in self.in_flight:
+            peer.receive_event.unsubscribe(self.on_receive_block)
+            peer.disconnect_event.unsubscribe(self.on_peer_disconnected)
+            peer.reject_event.unsubscribe(self.on_reject_block)
+            peer.unchoke_event.unsubscribe(self.on_peer_unchoked)
+        if self._timeout_timer is not None:
+            self._timeout_timer.cancel()
+            self._timeout_timer = None
+        if self._choke_timer is not None:
+            self._choke_timer.cancel()
+            self._choke_timer = None
+
+    def release_piece(self):
+        if self.piece is None:
+            return
+        self.pool.release(self.piece, self.blocks)
+        self.piece = self.blocks = None
 
-        self.downloading_task.cancel()
+    def close(self):
+        self.release_peers()
+        if self.downloading_task is not None:
+            self.downloading_task.cancel()
+        if self._finishing:
+            self.piece = self.blocks = None  # not reusable while a worker thread may still read it
+        self.release_piece()
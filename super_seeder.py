@@ -0,0 +1,73 @@
+import asyncio
+import logging
+import Message
+
+from peer_connection import PeerConnection
+from segment_downloader import Segment
+
+
+class SuperSeeder:
+    """
+    Super-seeding (BEP 16) for a torrent we are the initial seed of.
+    Peers get an empty bitfield and one piece at a time is revealed to each of them with a HAVE message.
+    The next piece is revealed to a peer only after its current piece has been announced by another peer
+    (or the peer itself, when no other connected peer lacks it).
+    """
+
+    def __init__(self, segments: list[Segment]):
+        self.segments = segments
+
+        self.current = {}  # peer: index of the revealed piece
+        self.revealed = {}  # peer: indexes of all pieces revealed to the peer
+        self.propagated = 0
+
+    def can_upload(self, peer, index) -> bool:
+        return index in self.revealed.get(peer, ())
+
+    def add_peer(self, peer: PeerConnection):
+        self.revealed.setdefault(peer, set())
+        self.offer(peer)
+
+    def remove_peer(self, peer: PeerConnection):
+        self.current.pop(peer, None)
+        self.revealed.pop(peer, None)
+
+    def on_bitfield(self, peer: PeerConnection):
+        if peer in self.current and peer.check_for_piece(self.current[peer]):
+            self.offer(peer)
+
+    def on_have(self, peer: PeerConnection, index):
+        for receiver, revealed_index in list(self.current.items()):
+            if revealed_index != index:
+                continue
+            if receiver is not peer:
+                self.propagated += 1
+                logging.info(f"Super-seeding: piece {index} propagated from {receiver.ip} to {peer.ip}")
+                self.offer(receiver)
+            elif all(other.check_for_piece(index) for other in self.revealed if other is not peer):
+                self.offer(receiver)
+
+    def pick_piece(self, peer: PeerConnection) -> int | None:
+        pending = {}
+        for index in self.current.values():
+            pending[index] = pending.get(index, 0) + 1
+
+        candidates = [segment for segment in self.segments
+                      if not peer.check_for_piece(segment.id) and segment.id not in self.revealed.get(peer, ())]
+        if not candidates:
+            return None
+        rarest = min(candidates, key=lambda segment: (segment.peers_count + pending.get(segment.id, 0), segment.id))
+        return rarest.id
+
+    def offer(self, peer: PeerConnection):
+        if peer not in self.revealed:
+            return
+        self.current.pop(peer, None)
+        index = self.pick_piece(peer)
+        if index is None:
+            return
+
+        self.current[peer] = index
+        self.revealed[peer].add(index)
+        logging.info(f"Super-seeding: revealing piece {index} to {peer.ip}")
+        asyncio.create_task(peer.send_message_to_peer(Message.HaveMessage(index)))
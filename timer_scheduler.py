@@ -0,0 +1,114 @@
+import asyncio
+import heapq
+import logging
+import itertools
+
+
+class Timer:
+    def __init__(self, scheduler, when, callback, args):
+        self.when = when
+        self.callback = callback
+        self.args = args
+        self.cancelled = False
+        self._scheduler = scheduler
+
+    def cancel(self):
+        if self.cancelled:
+            return
+        self.cancelled = True
+        if self._scheduler:
+            self._scheduler._on_timer_cancelled()
+            self._scheduler = None
+
+
+class TimerScheduler:
+    """
+    Session-wide deadline scheduler: a heap of timers served by a single loop.call_at handle.
+    Callbacks run on the event loop and must not block.
+    """
+
+    COMPACTION_THRESHOLD = 64
+
+    def __init__(self):
+        self._heap = []
+        self._counter = itertools.count()
+        self._handle = None
+        self._handle_when = None
+        self._loop = None
+        self._cancelled_count = 0
+
+    def time(self) -> float:
+        return self._get_loop().time()
+
+    def call_later(self, delay, callback, *args) -> Timer:
+        return self.call_at(self.time() + delay, callback, *args)
+
+    def call_at(self, when, callback, *args) -> Timer:
+        timer = Timer(self, when, callback, args)
+        heapq.heappush(self._heap, (when, next(self._counter), timer))
+        if self._handle_when is None or when < self._handle_when:
+            self._arm()
+        return timer
+
+    def __len__(self):
+        return len(self._heap) - self._cancelled_count
+
+    def close(self):
+        if self._handle:
+            self._handle.cancel()
+        self._handle = None
+        self._handle_when = None
+        for _, _, timer in self._heap:
+            timer._scheduler = None
+        self._heap.clear()
+        self._cancelled_count = 0
+
+    def _on_timer_cancelled(self):
+        self._cancelled_count += 1
+        if self._cancelled_count > self.COMPACTION_THRESHOLD and self._cancelled_count * 2 > len(self._heap):
+            self._heap = [entry for entry in self._heap if not entry[2].cancelled]
+            heapq.heapify(self._heap)
+            self._cancelled_count = 0
+
+    def _pop(self):
+        _, _, timer = heapq.heappop(self._heap)
+        if timer.cancelled:
+            self._cancelled_count -= 1
+        else:
+            timer._scheduler = None
+        return timer
+
+    def _get_loop(self):
+        if self._loop is None or self._loop.is_closed():
+            self._loop = asyncio.get_running_loop()
+        return self._loop
+
+    def _arm(self):
+        while self._heap and self._heap[0][2].cancelled:
+            self._pop()
+
+        if self._handle:
+            self._handle.cancel()
+            self._handle = None
+            self._handle_when = None
+
+        if self._heap:
+            self._handle_when = self._heap[0][0]
+            self._handle = self._get_loop().call_at(self._handle_when, self._run_expired)
+
+    def _run_expired(self):
+        self._handle = None
+        self._handle_when = None
+
+        end_time = self.time() + self._get_loop()._clock_resolution
+        while self._heap and self._heap[0][0] <= end_time:
+            timer = self._pop()
+            if timer.cancelled:
+                continue
+            try:
+                timer.callback(*timer.args)
+            except Exception as e:
+                logging.exception(f'Timer callback {timer.callback} failed: {e}')
+
+        if self._handle is None:
+            self._arm()
@@ -1,96 +1,180 @@
 import asyncio
+import bitstring
 import logging
+import time
 import configuration
 import Message
+from event_bus import Event
 from segment_downloader import SegmentDownloader, SegmentDownloadStatus, Segment
 from peer_connection import PeerConnection
-from pubsub import pub
 from priority_queue import PriorityQueue
 from requests_receiver import PeerReceiver
+from timer_scheduler import TimerScheduler
+from hash_verifier import HashVerifier
+from piece_pool import PiecePool
+from corruption_tracker import CorruptionTracker
+from choker import Choker
+from upload_queue import UploadQueue
+from super_seeder import SuperSeeder
+from web_seed import WebSeed, WebSeedError
+from peer_connector import PeerConnector
+from peer_store import PeerStore
+from fast_extension import allowed_fast_set
+from peer_exchange import PeerExchange
+from http_client import HttpClient
 
 
 class Downloader:
 
-    def __init__(self, torrent, file_writer, torrent_statistics, peer_queue: asyncio.Queue):
+    def __init__(self, torrent, file_writer, torrent_statistics, peer_store: PeerStore,
+                 timers: TimerScheduler = None, verifier: HashVerifier = None, pool: PiecePool = None,
+                 http_client: HttpClient = None):
         self.torrent = torrent
+        self.timers = timers if timers is not None else TimerScheduler()
+        self.verifier = verifier if verifier is not None else HashVerifier()
+        self.verifier.capacity_event.subscribe(self.wake_up)
+        self.pool = pool if pool is not None else PiecePool()
+        self.corruption = CorruptionTracker(self.verifier)
+        self.corruption.ban_event.subscribe(self.ban_peer)
         self.file_writer = file_writer
         self.torrent_statistics = torrent_statistics
-        self.peer_queue = peer_queue
+        self.peer_store = peer_store
 
         self.active_peers = []
+        self.choker = Choker(self.active_peers, self.timers, is_seeding=lambda: not self.segments_left)
         self.peer_update_tasks = []
+        self.upload_queues = {}
+        self.connector = PeerConnector(self.timers)
+        self.connector.connected_event.subscribe(self.register_peer)
+        self.connector.failed_event.subscribe(self._on_connect_failed)
+        self.pex = PeerExchange(self.active_peers, self.peer_store, self.timers)
 
         self._peer_connection_task = None
+        self._unchoke_timers = {}
+        self._keep_alive_timers = {}
+        self._prune_timer = None
+        self._uninterested_since = {}
+        self.pruned_peers = {}  # ip: time until which the peer is not reconnected
 
         self.available_segments = [Segment(i) for i in range(torrent.total_segments)]
+        self.super_seeder = SuperSeeder(self.available_segments)
         self.available_segments_lock = asyncio.Lock()
 
         self._segment_heap = PriorityQueue()
         self._segment_downloaders = []
+        self.segments_left = torrent.total_segments
+
+        self.web_seeds = [WebSeed(url, torrent, http_client=http_client) for url in torrent.url_list]
+        self._web_seed_tasks = []
+        self._segment_released = asyncio.Event()
+
+        self._wakeup = asyncio.Event()
+        self._peer_slot_freed = asyncio.Event()
+        self.completed_event = Event()  # args: downloader
 
         self.bitfield_active = False
 
     async def download_torrent(self, seed=True):
         await self.get_downloaded_segments()
         self._peer_connection_task = asyncio.create_task(self.peer_connection_task())
+        self.choker.start()
+        self.schedule_pruning()
+        self.pex.start()
+        self._web_seed_tasks = [asyncio.create_task(self.web_seed_task(web_seed)) for web_seed in self.web_seeds]
+
+        while self.segments_left:
+            self._wakeup.clear()
+            self.start_segment_downloads()
+            if self.is_endgame():
+                self.start_endgame()
+            await self._wakeup.wait()
+        self.completed_event.emit(self)
 
-        while any(segment.status != SegmentDownloadStatus.SUCCESS for segment in self.available_segments):
-            await asyncio.sleep(.1)
+        if seed:
+            while True:
+                await asyncio.sleep(1000)
 
-            if len(self._segment_downloaders) < configuration.MAX_SEGMENTS_DOWNLOADING_SIMULTANEOUSLY:
-                segment_id, finding_result = await self.try_find_rarest_segment()
-                if not finding_result:
-                    continue
+    @property
+    def super_seeding(self) -> bool:
+        return configuration.SUPER_SEEDING and not self.segments_left
 
-                peers_with_segment = self.available_segments[segment_id].peers
-                peers = peers_with_segment[:configuration.MAX_PEER_PEERS_PER_SEGMENT]
+    def wake_up(self):
+        self._wakeup.set()
 
-                for peer in peers:
-                    await self.remove_peer_from_available_segments(peer)
+    def start_segment_downloads(self):
+        while len(self._segment_downloaders) < configuration.MAX_SEGMENTS_DOWNLOADING_SIMULTANEOUSLY:
+            if not self.verifier.has_capacity:
+                logging.debug('Hash verification is saturated, postponing new segments')
+                return
+            segment_id, finding_result = self.try_find_rarest_segment()
+            if not finding_result:
+                return
 
-                self.available_segments[segment_id].status = SegmentDownloadStatus.PENDING
-                self._segment_downloaders.append(self.start_segment_download(self.available_segments[segment_id],
-                                                                             peers))
+            peers = self.trusted_first(segment_id, self.ready_peers(self.available_segments[segment_id]))
+            peers = peers[:configuration.MAX_PEER_PEERS_PER_SEGMENT]
+            for peer in peers:
+                self.remove_peer_from_available_segments(peer)
 
-            await asyncio.sleep(.1)
+            self.available_segments[segment_id].status = SegmentDownloadStatus.PENDING
+            self._segment_downloaders.append(self.start_segment_download(self.available_segments[segment_id], peers))
 
-        if seed:
-            while True:
-                await asyncio.sleep(1000)
+    def trusted_first(self, segment_id, peers) -> list[PeerConnection]:
+        return sorted(peers, key=lambda peer: self.corruption.is_suspect(segment_id, peer))
+
+    @staticmethod
+    def ready_peers(segment) -> list[PeerConnection]:
+        return [peer for peer in segment.peers if peer.is_active and peer.can_request(segment.id)]
 
     async def get_downloaded_segments(self):
         for i in range(self.torrent.total_segments):
-            if await self.file_writer.check_segment_download(i):
-                segment_length = self.torrent.segment_length if i != self.torrent.total_segments - 1 \
-                    else self.torrent.total_length % self.torrent.segment_length
+            if await self.file_writer.check_segment_download(i, self.verifier):
+                segment_length = min(self.torrent.segment_length,
+                                     self.torrent.total_length - i * self.torrent.segment_length)
                 self.torrent_statistics.update_downloaded(segment_length)
 
                 self.available_segments[i].status = SegmentDownloadStatus.SUCCESS
                 self.torrent_statistics.update_bitfield(i, True)
+                self.segments_left -= 1
         logging.info(self.torrent_statistics.bitfield.bin)
 
-    async def try_find_rarest_segment(self) -> (int, bool):
-        if not self._segment_heap:
-            return None, False
-
-        count, rarest_index = self._segment_heap.pop()
-        segment = self.available_segments[rarest_index]
-        if (segment.status == SegmentDownloadStatus.NOT_STARTED
-                and segment.peers_count > 0):
-            logging.info(f"Found not yet downloaded segment! Next segment is: {rarest_index}")
-            return rarest_index, True
-        else:
-            self._segment_heap.push(count, rarest_index)
-            return None, False
+    def try_find_rarest_segment(self) -> (int, bool):
+        while self._segment_heap:
+            count, rarest_index = self._segment_heap.pop()
+            segment = self.available_segments[rarest_index]
+            if segment.status == SegmentDownloadStatus.NOT_STARTED and any(self.ready_peers(segment)):
+                logging.info(f"Found not yet downloaded segment! Next segment is: {rarest_index}")
+                return rarest_index, True
+        return None, False
+
+    def is_endgame(self) -> bool:
+        return (any(self._segment_downloaders)
+                and all(segment.status != SegmentDownloadStatus.NOT_STARTED for segment in self.available_segments))
+
+    def start_endgame(self):
+        for downloader in self._segment_downloaders:
+            free_slots = configuration.ENDGAME_MAX_PEERS_PER_SEGMENT - len(downloader.peers)
+            if free_slots <= 0:
+                continue
+            candidates = [peer for peer in self.active_peers
+                          if peer.is_active and peer.can_request(downloader.segment.id)
+                          and peer.check_for_piece(downloader.segment.id) and peer not in downloader.peers]
+            if candidates or not downloader.endgame:
+                extra_peers = candidates[:free_slots]
+                logging.info(f"Endgame for segment {downloader.segment.id}, extra peers: {len(extra_peers)}")
+                downloader.enter_endgame(extra_peers)
 
     def start_segment_download(self, segment, peers) -> SegmentDownloader:
         downloader = SegmentDownloader(segment, torrent_data=self.torrent,
                                        file_writer=self.file_writer,
                                        torrent_statistics=self.torrent_statistics,
-                                       peers=peers)
+                                       peers=peers,
+                                       timers=self.timers,
+                                       verifier=self.verifier,
+                                       pool=self.pool,
+                                       corruption=self.corruption)
 
-        pub.subscribe(self.replace_peer, downloader.peer_deletion_event)
-        pub.subscribe(self.on_download_end, downloader.downloading_stopped_event)
+        downloader.peer_deletion_event.subscribe(self.replace_peer)
+        downloader.downloading_stopped_event.subscribe(self.on_download_end)
 
         downloader.download_segment()
         return downloader
@@ -98,20 +182,92 @@ class Downloader:
     def on_download_end(self, downloader):
         segment = downloader.segment
         logging.info(f"Segment {segment.id} download was canceled...")
-        if segment.status == SegmentDownloadStatus.SUCCESS:
-            logging.info("Because it downloaded correctly!!!")
-            self.torrent_statistics.update_bitfield(segment.segment_id, True)
-            self.send_have_message_to_peers(segment.segment_id)
-        elif segment.status == SegmentDownloadStatus.FAILED:
-            logging.error("Because it failed :(")
-            segment.status = SegmentDownloadStatus.NOT_STARTED
-            self._segment_heap.push(self.available_segments[segment.id].peers_count, segment.id)
+        self.finish_segment(segment)
 
         if downloader in self._segment_downloaders:
             self._segment_downloaders.remove(downloader)
             logging.info(f"Removing downloader: {downloader}")
         for peer in downloader.peers:
-            self.get_bitfield_from_peer(peer)
+            if peer in self.active_peers:
+                self.get_bitfield_from_peer(peer)
+        self.wake_up()
+
+    def finish_segment(self, segment):
+        if segment.status == SegmentDownloadStatus.SUCCESS:
+            logging.info("Because it downloaded correctly!!!")
+            self.torrent_statistics.update_bitfield(segment.id, True)
+            self.segments_left -= 1
+            self.send_have_message_to_peers(segment.id)
+            if not self.segments_left:
+                self._segment_released.set()
+                self.prune_peers()
+        elif segment.status == SegmentDownloadStatus.FAILED:
+            logging.error("Because it failed :(")
+            self.release_segment(segment)
+
+    def release_segment(self, segment):
+        segment.status = SegmentDownloadStatus.NOT_STARTED
+        self._segment_heap.push(segment.peers_count, segment.id)
+        self._segment_released.set()
+
+    def take_segment_run(self, max_length=configuration.WEB_SEED_MAX_RUN, exclude=frozenset()) -> list[Segment]:
+        not_started = [segment for segment in self.available_segments
+                       if segment.status == SegmentDownloadStatus.NOT_STARTED and segment.id not in exclude]
+        if not not_started:
+            return []
+
+        first = min(not_started, key=lambda segment: (segment.peers_count, segment.id)).id
+        run = []
+        for segment in self.available_segments[first:first + max_length]:
+            if segment.status != SegmentDownloadStatus.NOT_STARTED or segment.id in exclude:
+                break
+            segment.status = SegmentDownloadStatus.PENDING
+            run.append(segment)
+        return run
+
+    async def web_seed_task(self, web_seed: WebSeed):
+        logging.info(f"Started web seed task for {web_seed.url}")
+        try:
+            while self.segments_left and web_seed.failures < configuration.WEB_SEED_MAX_FAILURES:
+                run = self.take_segment_run(exclude=web_seed.corrupt_segments)
+                if not run:
+                    self._segment_released.clear()
+                    await self._segment_released.wait()
+                    continue
+                if not await self.download_from_web_seed(web_seed, run):
+                    await asyncio.sleep(configuration.WEB_SEED_RETRY_DELAY * 2 ** (web_seed.failures - 1))
+        finally:
+            await web_seed.close()
+
+    async def download_from_web_seed(self, web_seed: WebSeed, run: list[Segment]) -> bool:
+        try:
+            data = memoryview(await web_seed.fetch_segments(run[0].id, len(run)))
+        except WebSeedError as e:
+            logging.error(e)
+            web_seed.failures += 1
+            for segment in run:
+                self.release_segment(segment)
+            self.wake_up()
+            return False
+
+        all_verified = True
+        for segment in run:
+            offset = (segment.id - run[0].id) * self.torrent.segment_length
+            segment_data = data[offset:offset + self.torrent.segment_length]
+            if await self.verifier.verify(segment_data, self.torrent.segments_hash[segment.id]):
+                web_seed.failures = 0
+                self.torrent_statistics.update_downloaded(len(segment_data))
+                segment.status = SegmentDownloadStatus.SUCCESS
+                await self.file_writer.write_segment(segment.id, segment_data)
+            else:
+                logging.error(f"Web seed {web_seed.url} sent corrupt segment {segment.id}")
+                web_seed.failures += 1
+                web_seed.corrupt_segments.add(segment.id)
+                segment.status = SegmentDownloadStatus.FAILED
+                all_verified = False
+            self.finish_segment(segment)
+        self.wake_up()
+        return all_verified
 
     def send_have_message_to_peers(self, index):
         asyncio.create_task(self._send_have_message_to_peers_task(index))
@@ -124,109 +280,293 @@ class Downloader:
     async def peer_connection_task(self):
         logging.info("Started peer connection task")
         while True:
-            if len(self.active_peers) < configuration.MAX_PEER_COUNT:
-                result = True
-                while result:
-                    result = await self._add_peer_from_queue()
-            await asyncio.sleep(.01)
+            if len(self.active_peers) + self.connector.pending >= configuration.MAX_PEER_COUNT:
+                self._peer_slot_freed.clear()
+                await self._peer_slot_freed.wait()
+                continue
+            await self._add_peer_from_store()
+
+    async def _add_peer_from_store(self):
+        peer = await self.peer_store.get()
+        if self.corruption.is_banned(peer):
+            logging.info(f"Skipping banned peer {peer.ip}")
+            self.peer_store.ban(peer.ip)
+            return False
+        if self.is_pruned(peer):
+            logging.info(f"Skipping pruned peer {peer.ip}")
+            self.peer_store.release(peer, self.reconnect_delay(peer))
+            return False
+        self.connector.connect(peer)
+        return True
 
-    async def _add_peer_from_queue(self):
-        peer = await self.peer_queue.get()
-        await self.add_peer(peer)
+    def _on_connect_failed(self, peer, retrying):
+        self.peer_store.on_connect_failed(peer, final=not retrying)
+        self._peer_slot_freed.set()
 
     async def add_peer(self, peer):
+        if self.corruption.is_banned(peer):
+            logging.info(f"Skipping banned peer {peer.ip}")
+            await peer.close()
+            return False
+        if self.is_pruned(peer):
+            logging.info(f"Skipping pruned peer {peer.ip}")
+            await peer.close()
+            return False
         connect = await peer.connect()
         if connect:
             if await peer.handle_handshake():
-                logging.info(f"Connected new peer: ({peer.ip}, {peer.port})")
-                self.active_peers.append(peer)
-                self.peer_update_tasks.append(asyncio.create_task(peer.run()))
-                pub.subscribe(self.get_have_message_from_peer, peer.have_message_event)
-                pub.subscribe(self.get_bitfield_from_peer, peer.bitfield_update_event)
-                pub.subscribe(self.on_request_piece, peer.request_event)
-                self.send_bitfield_to_peer(peer)
-                if not isinstance(peer, PeerReceiver):
-                    self.check_for_unchoked(peer)
-                return True
+                return self.register_peer(peer)
         logging.error('Возникли проблемы с установлением соединения с пиром')
         return False
 
+    def register_peer(self, peer) -> bool:
+        if len(self.active_peers) >= configuration.MAX_PEER_COUNT:
+            logging.info(f"Peer limit reached, dropping peer {peer.ip}")
+            self.peer_store.release(peer, configuration.PEER_RECONNECT_DELAY)
+            asyncio.create_task(peer.close())
+            return False
+
+        logging.info(f"Connected new peer: ({peer.ip}, {peer.port})")
+        self.peer_store.on_connected(peer)
+        self.active_peers.append(peer)
+        self.peer_update_tasks.append(asyncio.create_task(peer.run()))
+        peer.have_message_event.subscribe(self.get_have_message_from_peer)
+        peer.bitfield_update_event.subscribe(self.get_bitfield_from_peer)
+        peer.request_event.subscribe(self.on_request_piece)
+        peer.cancel_event.subscribe(self.on_cancel_request)
+        peer.unchoke_event.subscribe(self.on_peer_unchoked)
+        peer.disconnect_event.subscribe(self.on_peer_lost)
+        peer.interest_event.subscribe(self.choker.on_interest_changed)
+        peer.suggest_event.subscribe(self.on_suggest_piece)
+        peer.allowed_fast_event.subscribe(self.on_allowed_fast)
+        peer.extended_message_event.subscribe(self.pex.on_message)
+        self.send_bitfield_to_peer(peer)
+        self.schedule_keep_alive(peer)
+        if not isinstance(peer, PeerReceiver):
+            self.check_for_unchoked(peer)
+        return True
+
     def send_bitfield_to_peer(self, peer):
         asyncio.create_task(self._send_bitfield_to_peer_task(peer))
 
     async def _send_bitfield_to_peer_task(self, peer:  PeerConnection):
-        message = Message.PeerSegmentsMessage(self.torrent_statistics.bitfield)
+        if self.super_seeding:
+            if peer.supports_fast:
+                await peer.send_message_to_peer(Message.HaveNoneMessage())
+            else:
+                empty_bitfield = bitstring.BitArray(len(self.torrent_statistics.bitfield))
+                await peer.send_message_to_peer(Message.PeerSegmentsMessage(empty_bitfield))
+            self.super_seeder.add_peer(peer)
+            return
+        if peer.supports_fast and not self.segments_left:
+            message = Message.HaveAllMessage()
+        elif peer.supports_fast and self.segments_left == self.torrent.total_segments:
+            message = Message.HaveNoneMessage()
+        else:
+            message = Message.PeerSegmentsMessage(self.torrent_statistics.bitfield)
         await peer.send_message_to_peer(message)
+        if peer.supports_fast:
+            await self.send_allowed_fast(peer)
+        if peer.supports_extensions:
+            await peer.send_extended_handshake(self.peer_store.port)
+
+    async def send_allowed_fast(self, peer: PeerConnection):
+        try:
+            pieces = allowed_fast_set(peer.ip, self.torrent.info_hash, self.torrent.total_segments,
+                                      configuration.ALLOWED_FAST_COUNT)
+        except ValueError:
+            return
+        for index in pieces:
+            if self.torrent_statistics.bitfield[index] and index not in peer.granted_fast:
+                peer.granted_fast.add(index)
+                await peer.send_message_to_peer(Message.AllowedFastMessage(index))
 
     def on_request_piece(self, request=None, peer=None):
         if request is None:
             logging.error('Тело запроса пусто')
         elif peer is None:
             logging.error('Не указан пир, запросивший сегмент')
+        elif self.super_seeding and not self.super_seeder.can_upload(peer, request.index):
+            logging.info(f"Super-seeding: peer {peer.ip} requested unrevealed piece {request.index}")
+            peer.reject_request(request)
         else:
-            asyncio.create_task(self._on_request_piece(request, peer))
+            if peer not in self.upload_queues:
+                self.upload_queues[peer] = UploadQueue(peer, self.file_writer, self.torrent_statistics)
+            if not self.upload_queues[peer].push(request):
+                peer.reject_request(request)
 
-    async def _on_request_piece(self, request, peer):
-        piece_index, byte_offset, block_length = request.index, request.byte_offset, request.block_len
-        block = (await self.file_writer.read_segment(piece_index))[byte_offset: byte_offset + block_length]
-        await peer.send_message_to_peer(Message.SendPieceMessage(piece_index, byte_offset, block))
+    def on_cancel_request(self, request, peer):
+        if peer in self.upload_queues:
+            self.upload_queues[peer].cancel(request)
 
     def check_for_unchoked(self, peer):
-        _was_unchoked = asyncio.create_task(self._check_for_unchoked_task(peer, 10))
+        self._unchoke_timers[peer] = self.timers.call_later(configuration.UNCHOKE_TIMEOUT,
+                                                            self._on_unchoke_deadline, peer)
 
-    async def _check_for_unchoked_task(self, peer: PeerConnection, delay):
-        await asyncio.sleep(delay)
-        if peer.peer_choked is True:
+    def _on_unchoke_deadline(self, peer: PeerConnection):
+        self._unchoke_timers.pop(peer, None)
+        if peer.peer_choked is True and not peer.allowed_fast and peer in self.active_peers:
             logging.info(f'Пир {peer.ip} был отключён - не отправил unchoked messagе')
-            if peer in self.active_peers:
-                self.active_peers.remove(peer)
-            await peer.close()
+            asyncio.create_task(self.block_peer(peer))
+
+    def schedule_keep_alive(self, peer: PeerConnection):
+        deadline = min(peer.last_message_sent + configuration.KEEP_ALIVE_INTERVAL,
+                       peer.last_message_received + configuration.PEER_IDLE_TIMEOUT)
+        self._keep_alive_timers[peer] = self.timers.call_later(max(deadline - time.monotonic(), 0),
+                                                               self._on_keep_alive_deadline, peer)
+
+    def _on_keep_alive_deadline(self, peer: PeerConnection):
+        self._keep_alive_timers.pop(peer, None)
+        if peer not in self.active_peers:
+            return
+
+        now = time.monotonic()
+        if now - peer.last_message_received >= configuration.PEER_IDLE_TIMEOUT:
+            logging.info(f'Пир {peer.ip} был отключён - не отвечал {configuration.PEER_IDLE_TIMEOUT} секунд')
+            asyncio.create_task(self.block_peer(peer))
+            return
+        if now - peer.last_message_sent >= configuration.KEEP_ALIVE_INTERVAL:
+            peer.last_message_sent = now
+            asyncio.create_task(peer.send_message_to_peer(Message.ContinueConnectionMessage()))
+        self.schedule_keep_alive(peer)
+
+    def schedule_pruning(self):
+        self._prune_timer = self.timers.call_later(configuration.PRUNE_INTERVAL, self._on_prune_deadline)
+
+    def _on_prune_deadline(self):
+        self.schedule_pruning()
+        self.prune_peers()
+
+    def is_seed(self, peer: PeerConnection) -> bool:
+        bits = peer.bitfield[:self.torrent.total_segments]
+        return len(bits) == self.torrent.total_segments and bits.all(True)
+
+    def has_wanted_segments(self, peer: PeerConnection) -> bool:
+        return any(peer.bitfield[segment.id] for segment in self.available_segments
+                   if segment.status != SegmentDownloadStatus.SUCCESS and segment.id < len(peer.bitfield))
+
+    def prune_peers(self):
+        now = time.monotonic()
+        for peer in list(self.active_peers):
+            wanted = self.has_wanted_segments(peer)
+            if not wanted and peer.interested:
+                peer.interested = False
+                asyncio.create_task(peer.send_message_to_peer(Message.NotInterestedMessage()))
+
+            if not self.segments_left and self.is_seed(peer):
+                self.prune_peer(peer, 'соединение seed-seed')
+            elif wanted or peer.peer_interested:
+                self._uninterested_since.pop(peer, None)
+            elif now - self._uninterested_since.setdefault(peer, now) >= configuration.UNINTERESTED_PEER_TIMEOUT:
+                self.prune_peer(peer, f'нет взаимного интереса {configuration.UNINTERESTED_PEER_TIMEOUT} секунд')
+
+    def prune_peer(self, peer: PeerConnection, reason):
+        logging.info(f'Пир {peer.ip} был отключён - {reason}')
+        self.pruned_peers[peer.ip] = time.monotonic() + configuration.PRUNED_PEER_RECONNECT_DELAY
+        asyncio.create_task(self.block_peer(peer))
+
+    def reconnect_delay(self, peer: PeerConnection) -> float:
+        pruned_until = self.pruned_peers.get(peer.ip, 0)
+        return max(pruned_until - time.monotonic(), configuration.PEER_RECONNECT_DELAY)
+
+    def is_pruned(self, peer: PeerConnection) -> bool:
+        until = self.pruned_peers.get(peer.ip)
+        if until is None:
+            return False
+        if until <= time.monotonic():
+            del self.pruned_peers[peer.ip]
             return False
         return True
 
     def get_bitfield_from_peer(self, peer):
-        asyncio.create_task(self._get_bitfield_from_peer_task(peer))
-
-    async def _get_bitfield_from_peer_task(self, peer):
         for segment in self.available_segments:
             if peer.bitfield[segment.id] == 1:
                 segment.add_peer(peer)
-                self._segment_heap.push(segment.peers_count, segment.id)
+                if segment.status == SegmentDownloadStatus.NOT_STARTED:
+                    self._segment_heap.push(segment.peers_count, segment.id)
+        if self.super_seeding:
+            self.super_seeder.on_bitfield(peer)
         self.bitfield_active = True
+        self.wake_up()
 
     def get_have_message_from_peer(self, peer, index):
-        asyncio.create_task(self._get_have_message_from_peer_task(peer, index))
-
-    async def _get_have_message_from_peer_task(self, peer, index):
         segment = self.available_segments[index]
         segment.add_peer(peer)
-        self._segment_heap.push(segment.peers_count, index)
+        if segment.status == SegmentDownloadStatus.NOT_STARTED:
+            self._segment_heap.push(segment.peers_count, index)
+        if self.super_seeding:
+            self.super_seeder.on_have(peer, index)
         self.bitfield_active = True
+        self.wake_up()
+
+    def on_suggest_piece(self, peer, index):
+        if index >= len(self.available_segments) or not peer.check_for_piece(index):
+            return
+        segment = self.available_segments[index]
+        if segment.status == SegmentDownloadStatus.NOT_STARTED:
+            self._segment_heap.push(0, index)
+            self.wake_up()
+
+    def on_allowed_fast(self, peer, index):
+        if index < len(self.available_segments) and peer.check_for_piece(index):
+            self.available_segments[index].add_peer(peer)
+            self.wake_up()
+
+    def on_peer_unchoked(self, peer):
+        logging.info(f"Peer {peer.ip} unchoked us")
+        self.get_bitfield_from_peer(peer)
+
+    def on_peer_lost(self, peer):
+        if peer in self.active_peers:
+            logging.info(f"Lost connection with peer {peer.ip}")
+            asyncio.create_task(self.block_peer(peer))
+
+    def ban_peer(self, ip):
+        self.peer_store.ban(ip)
+        for peer in self.active_peers:
+            if peer.ip == ip:
+                asyncio.create_task(self.block_peer(peer))
 
     async def block_peer(self, peer):
+        for timers in (self._unchoke_timers, self._keep_alive_timers):
+            if peer in timers:
+                timers.pop(peer).cancel()
+        if peer in self.upload_queues:
+            self.upload_queues.pop(peer).close()
+        self._uninterested_since.pop(peer, None)
+        self.super_seeder.remove_peer(peer)
         if peer in self.active_peers:
             self.active_peers.remove(peer)
-            await self.remove_peer_from_available_segments(peer)
+            self.peer_store.on_disconnected(peer, self.reconnect_delay(peer))
+            self.remove_peer_from_available_segments(peer)
             await peer.close()
+            self._peer_slot_freed.set()
+            self.wake_up()
 
-    async def remove_peer_from_available_segments(self, peer):
+    def remove_peer_from_available_segments(self, peer):
         for segment in self.available_segments:
             if peer in segment.peers:
                 segment.remove_peer(peer)
-                self._segment_heap.push(segment.peers_count, segment.id)
+                if segment.status == SegmentDownloadStatus.NOT_STARTED:
+                    self._segment_heap.push(segment.peers_count, segment.id)
 
     def replace_peer(self, segment_downloader: SegmentDownloader):
-        other_peers = self.available_segments[segment_downloader.segment.id].peers
+        segment = segment_downloader.segment
+        other_peers = [peer for peer in self.ready_peers(self.available_segments[segment.id])
+                       if peer not in segment_downloader.peers]
+        other_peers = self.trusted_first(segment.id, other_peers)
         if any(other_peers):
-            logging.info(f"Replacing peer for downloader of segment {segment_downloader.segment.id}")
-            peer = other_peers.pop(0)
-            asyncio.create_task(self.remove_peer_from_available_segments(peer))
+            logging.info(f"Replacing peer for downloader of segment {segment.id}")
+            peer = other_peers[0]
+            self.remove_peer_from_available_segments(peer)
             segment_downloader.add_peer(peer)
-        else:
-            logging.info(
-                f"No new peers were provided for segment {segment_downloader.segment.id}, gonna try again later")
+        elif not segment_downloader.peers:
+            logging.info(f"No new peers were provided for segment {segment.id}, gonna try again later")
+            segment_downloader.close()
+            self.release_segment(segment)
             if segment_downloader in self._segment_downloaders:
                 self._segment_downloaders.remove(segment_downloader)
+        self.wake_up()
 
     def unchoked_peers(self):
         for peer in self.active_peers:
@@ -237,7 +577,20 @@ class Downloader:
     def close(self):
         if self._peer_connection_task:
             self._peer_connection_task.cancel()
+        self.choker.close()
+        self.connector.close()
+        self.pex.close()
+        if self._prune_timer is not None:
+            self._prune_timer.cancel()
+        for task in self._web_seed_tasks:
+            task.cancel()
+        for upload_queue in self.upload_queues.values():
+            upload_queue.close()
         for task in self.peer_update_tasks:
             task.cancel()
+        for timer in list(self._unchoke_timers.values()) + list(self._keep_alive_timers.values()):
+            timer.cancel()
+        for peer in self.active_peers:
+            peer.clear_events()
         for segment_downloader in self._segment_downloaders:
             segment_downloader.close()
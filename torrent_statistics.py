@@ -8,6 +8,8 @@ class TorrentStatistics:
         self._downloaded = downloaded
         self._uploaded = uploaded
         self._left = left
+        self._wasted = 0
+        self._duplicate_requests = 0
         self._bitfield = bitstring.BitArray(total_segments)
 
     def update_downloaded(self, size):
@@ -17,6 +19,12 @@ class TorrentStatistics:
     def update_uploaded(self, size):
         self._uploaded += size
 
+    def update_wasted(self, size):
+        self._wasted += size
+
+    def update_duplicate_requests(self, count=1):
+        self._duplicate_requests += count
+
     def update_bitfield(self, index: int, value: bool):
         self._bitfield[index] = value
 
@@ -32,6 +40,14 @@ class TorrentStatistics:
     def uploaded(self):
         return self._uploaded
 
+    @property
+    def wasted(self):
+        return self._wasted
+
+    @property
+    def duplicate_requests(self):
+        return self._duplicate_requests
+
     @property
     def bitfield(self):
         return self._bitfield
@@ -1,16 +1,19 @@
 import asyncio
-import re
+import os
+import random
 import socket
 import struct
 import time
 import logging
-import os
 from asyncio import Queue
 from enum import Enum
-from urllib.parse import urlencode
+from urllib.parse import urlencode, urlsplit
 
 import aiohttp
 import bencode
+import configuration
+
+from http_client import HttpClient
 
 
 class TrackerEvent(Enum):
@@ -22,7 +25,7 @@ class TrackerEvent(Enum):
 
 class HttpTrackerClient:
 
-    def __init__(self, url, info_hash, peer_id, port, segment_info):
+    def __init__(self, url, info_hash, peer_id, port, segment_info, http_client: HttpClient = None):
         self._peers = set()
         self.new_peers = Queue()
 
@@ -31,16 +34,15 @@ class HttpTrackerClient:
         self.peer_id = peer_id
         self.port = port
         self.segment_info = segment_info
+        self.http_client = http_client if http_client is not None else HttpClient()
+        self._owns_http_client = http_client is None
 
         self.request_interval = 60
+        self.min_interval = None
         self.tracker_id = 0
         self.last_request_time = -1
 
     async def make_request(self, event):
-        current_time = time.monotonic()
-        time_diff = current_time - self.last_request_time
-        if event and time_diff < self.request_interval:
-            await asyncio.sleep(time_diff)
         self.last_request_time = time.monotonic()
 
         params = {
@@ -57,20 +59,24 @@ class HttpTrackerClient:
         if event != TrackerEvent.CHECK:
             logging.info(f'Making request at "{self.url}" with params: {params}')
 
-        async with aiohttp.ClientSession() as http_client:
-            async with http_client.get(self.url + '?' + urlencode(params), timeout=10) as response:
-                if not response.status == 200:
-                    raise ConnectionError(f'Unable to connect to "{self.url}": status code {response.status}')
-                data = await response.read()
-                self._parse_response(bencode.decode(data))
-                return
+        try:
+            status, data = await self.http_client.get(self.url, urlencode(params), timeout=10)
+        except aiohttp.ClientError as e:
+            raise ConnectionError(f'Unable to connect to "{self.url}": {e}') from e
+        if not status == 200:
+            raise ConnectionError(f'Unable to connect to "{self.url}": status code {status}')
+        self._parse_response(bencode.decode(data))
+
+    @property
+    def latency(self) -> float | None:
+        return self.http_client.latency.get(self.url)
 
     def _parse_response(self, response):
         if 'failure reason' in response:
             raise ConnectionError(f'Unable to connect to "{self.url}: {response["failure reason"]}')
 
         self.request_interval = response.get('interval', self.request_interval)
-        self.request_interval = response.get('min interval', self.request_interval)
+        self.min_interval = response.get('min interval', self.min_interval)
         self.tracker_id = response.get('tracker id', self.tracker_id)
 
         peers = response['peers']
@@ -84,7 +90,8 @@ class HttpTrackerClient:
             self.new_peers.put_nowait(peer)
         self._peers = current_peers
 
-    def _decode_peer_data(self, row_data):
+    @staticmethod
+    def _decode_peer_data(row_data):
         ip = socket.inet_ntoa(row_data[:4])
         port = struct.unpack(">H", row_data[4:6])[0]
         return ip, port
@@ -94,27 +101,183 @@ class HttpTrackerClient:
             await self.make_request(TrackerEvent.STOPPED)
         except asyncio.TimeoutError:
             logging.error('Timeout error while close connection with tracker')
+        except ConnectionError as e:
+            logging.error(f'Unable to send stop event to "{self.url}": {e}')
+        finally:
+            if self._owns_http_client:
+                await self.http_client.close()
 
 
-class LocalConnections:
+class UdpTrackerSocket(asyncio.DatagramProtocol):
+    """
+    One UDP socket for the announces of all UDP trackers (BEP 15) and torrents.
+    Connection ids are cached per tracker address for UDP_TRACKER_CONNECTION_TTL, a request is retransmitted
+    after UDP_TRACKER_TIMEOUT * 2 ** n seconds and a new connection id is obtained on every retransmission.
+    """
 
-    regular_exp = re.compile(r'IPv4.*[0-9]+(?:\.[0-9]+){3}')
-    ip_exp = re.compile(r'[0-9]+(?:\.[0-9]+){2}')
+    PROTOCOL_ID = 0x41727101980
+    CONNECT, ANNOUNCE, SCRAPE, ERROR = range(4)
 
-    def __init__(self):
-        self._peers = set()
-        self.new_peers = asyncio.Queue()
+    def __init__(self, timeout=configuration.UDP_TRACKER_TIMEOUT, max_retries=configuration.UDP_TRACKER_MAX_RETRIES):
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.transport = None
+        self._transactions = {}  # transaction_id: future of the response
+        self._connections = {}  # address: (connection_id, expiration time)
 
-        self.ip_start = self.ip_exp.findall(self.regular_exp.search(os.popen('ipconfig').read()).group())[0]
+    @classmethod
+    async def create(cls, host='0.0.0.0', port=0, **kwargs) -> 'UdpTrackerSocket':
+        udp_socket = cls(**kwargs)
+        await asyncio.get_running_loop().create_datagram_endpoint(lambda: udp_socket, local_addr=(host, port))
+        return udp_socket
 
-    async def make_request(self, _):
-        for i in range(200):
-            await self._add_peer(self.ip_start + '.' + str(i))
+    def connection_made(self, transport):
+        self.transport = transport
 
-    async def _add_peer(self, peer_ip):
-        if peer_ip in self._peers:
+    def error_received(self, exc):
+        logging.error(f"UDP tracker socket error: {exc}")
+
+    def datagram_received(self, data, address):
+        if len(data) < 8:
+            return
+        action, transaction_id = struct.unpack('!II', data[:8])
+        future = self._transactions.get(transaction_id)
+        if future is None or future.done():
             return
-        await self.new_peers.put((peer_ip, 52656))
+        if action == self.ERROR:
+            future.set_exception(ConnectionError(data[8:].decode(errors='replace')))
+        else:
+            future.set_result((action, data[8:]))
+
+    async def request(self, address, action, payload: bytes, retries=None) -> bytes:
+        retries = self.max_retries if retries is None else retries
+        for attempt in range(retries + 1):
+            timeout = self.timeout * 2 ** attempt
+            try:
+                connection_id = await self._connection_id(address, timeout, fresh=attempt > 0)
+                return await self._send(address, connection_id, action, payload, timeout)
+            except asyncio.TimeoutError:
+                logging.info(f"UDP tracker {address[0]}:{address[1]} did not answer in {timeout} s")
+        raise ConnectionError(f'UDP tracker {address[0]}:{address[1]} did not answer')
+
+    async def _connection_id(self, address, timeout, fresh=False) -> int:
+        connection_id, expires = self._connections.get(address, (None, 0))
+        if not fresh and time.monotonic() < expires:
+            return connection_id
+        self._connections.pop(address, None)
+
+        response = await self._send(address, self.PROTOCOL_ID, self.CONNECT, b'', timeout)
+        if len(response) < 8:
+            raise ConnectionError('Malformed UDP tracker connect response')
+        connection_id, = struct.unpack('!Q', response[:8])
+        self._connections[address] = (connection_id, time.monotonic() + configuration.UDP_TRACKER_CONNECTION_TTL)
+        return connection_id
+
+    async def _send(self, address, connection_id, action, payload, timeout) -> bytes:
+        if self.transport is None:
+            raise ConnectionError('UDP tracker socket is closed')
+        transaction_id = random.getrandbits(32)
+        while transaction_id in self._transactions:
+            transaction_id = random.getrandbits(32)
+
+        future = asyncio.get_running_loop().create_future()
+        self._transactions[transaction_id] = future
+        try:
+            self.transport.sendto(struct.pack('!QII', connection_id, action, transaction_id) + payload, address)
+            response_action, response = await asyncio.wait_for(future, timeout)
+        finally:
+            del self._transactions[transaction_id]
+        if response_action != action:
+            raise ConnectionError(f'UDP tracker answered action {response_action} to action {action}')
+        return response
+
+    def close(self):
+        for future in self._transactions.values():
+            future.cancel()
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
+
+
+class UdpTrackerClient:
+    EVENTS = {TrackerEvent.CHECK: 0, TrackerEvent.COMPLETED: 1, TrackerEvent.STARTED: 2, TrackerEvent.STOPPED: 3}
+
+    def __init__(self, url, info_hash, peer_id, port, segment_info, udp_socket: UdpTrackerSocket = None):
+        self._peers = set()
+        self.new_peers = Queue()
+
+        self.url = url
+        self.info_hash = info_hash
+        self.peer_id = peer_id.encode() if isinstance(peer_id, str) else peer_id
+        self.port = port
+        self.segment_info = segment_info
+        self.udp_socket = udp_socket
+        self._owns_udp_socket = udp_socket is None
+        self.key = struct.unpack('!I', os.urandom(4))[0]
+
+        parts = urlsplit(url)
+        if parts.hostname is None or parts.port is None:
+            raise ValueError(f'Bad UDP tracker url "{url}"')
+        self.host, self.tracker_port = parts.hostname, parts.port
+        self._address = None
+
+        self.request_interval = 60
+        self.min_interval = None
+        self.last_request_time = -1
+
+    async def _resolve(self):
+        if self.udp_socket is None:
+            self.udp_socket = await UdpTrackerSocket.create()
+        if self._address is None:
+            try:
+                addresses = await asyncio.get_running_loop().getaddrinfo(self.host, self.tracker_port,
+                                                                         family=socket.AF_INET,
+                                                                         type=socket.SOCK_DGRAM)
+            except socket.gaierror as e:
+                raise ConnectionError(f'Unable to resolve "{self.url}": {e}') from e
+            self._address = addresses[0][4]
+        return self._address
+
+    async def make_request(self, event, retries=None):
+        self.last_request_time = time.monotonic()
+        address = await self._resolve()
+        if event != TrackerEvent.CHECK:
+            logging.info(f'Making request at "{self.url}" with event: {event.name}')
+
+        payload = struct.pack('!20s20sQQQIIIiH', self.info_hash, self.peer_id, self.segment_info.downloaded,
+                              self.segment_info.left, self.segment_info.uploaded, self.EVENTS[event], 0, self.key,
+                              -1, self.port)
+        try:
+            response = await self.udp_socket.request(address, UdpTrackerSocket.ANNOUNCE, payload, retries)
+        except ConnectionError:
+            self._address = None
+            raise
+        self._parse_response(response)
+
+    def _parse_response(self, response):
+        if len(response) < 12:
+            raise ConnectionError(f'Malformed announce response from "{self.url}"')
+        self.request_interval, leechers, seeders = struct.unpack('!III', response[:12])
+
+        current_peers = {HttpTrackerClient._decode_peer_data(response[i:i + 6])
+                         for i in range(12, len(response) - (len(response) - 12) % 6, 6)}
+        for peer in current_peers - self._peers:
+            self.new_peers.put_nowait(peer)
+        self._peers = current_peers
+
+    async def scrape(self) -> tuple[int, int, int]:
+        """Returns seeders, completed and leechers of the torrent"""
+        address = await self._resolve()
+        response = await self.udp_socket.request(address, UdpTrackerSocket.SCRAPE, self.info_hash)
+        if len(response) < 12:
+            raise ConnectionError(f'Malformed scrape response from "{self.url}"')
+        return struct.unpack('!III', response[:12])
 
     async def close(self):
-        pass
+        try:
+            await self.make_request(TrackerEvent.STOPPED, retries=0)
+        except (ConnectionError, asyncio.TimeoutError) as e:
+            logging.error(f'Unable to send stop event to "{self.url}": {e}')
+        finally:
+            if self._owns_udp_socket and self.udp_socket is not None:
+                self.udp_socket.close()
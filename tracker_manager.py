@@ -1,11 +1,16 @@
 import asyncio
 import hashlib
 import logging
-import configuration
+import time
 import bencode
-from asyncio import Queue
-from tracker_client import HttpTrackerClient, TrackerEvent, LocalConnections
-from peer_connection import PeerConnection
+import configuration
+from tracker_client import HttpTrackerClient, UdpTrackerClient, UdpTrackerSocket, TrackerEvent
+from local_discovery import LocalServiceDiscovery, LocalPeers
+from peer_store import PeerStore
+from dht import DhtNode, DhtTracker
+from http_client import HttpClient
+from timer_scheduler import TimerScheduler
+from announce_scheduler import AnnounceScheduler
 from contextlib import suppress
 
 
@@ -16,8 +21,21 @@ class BadTorrentTrackers(Exception):
 
 
 class TrackerManager:
-    def __init__(self, torrent_data, torrent_statistics, port, use_local=False, use_http=True):
+    """
+    Announces one torrent to its peer sources. Trackers of the announce-list are grouped in BEP 12 tiers:
+    only the first tracker of every tier is announced to, a failed tracker hands over to the next one of its tier
+    and a tracker that answered moves to the front of its tier.
+    All tiers are started concurrently, entering the context waits only for the first peers.
+    DHT and LSD are not trackers: they are announced to without a startup timeout and report peers as they find them.
+    """
+
+    def __init__(self, torrent_data, torrent_statistics, port, use_local=False, use_http=True,
+                 timers: TimerScheduler = None, peer_store: PeerStore = None, dht: DhtNode = None,
+                 lsd: LocalServiceDiscovery = None, http_client: HttpClient = None,
+                 scheduler: AnnounceScheduler = None, udp_socket: UdpTrackerSocket = None):
         self.torrent_data = torrent_data
+        self.timers = timers if timers is not None else TimerScheduler()
+        self.scheduler = scheduler if scheduler is not None else AnnounceScheduler(self.timers)
         self.segment_info = torrent_statistics
         self.port = port
 
@@ -25,85 +43,249 @@ class TrackerManager:
         self.tracker_clients = []
         self.info_hash = torrent_data.info_hash
         self.peer_id = self._create_peer_id()
-        self.available_peers = Queue(configuration.MAX_PEERS_PENDING)
-        self._peers = set()
+        self.peer_store = peer_store if peer_store is not None else PeerStore(self.info_hash,
+                                                                              torrent_data.total_segments, port)
 
-        self.update_task = None
+        self.lsd = lsd
+        self.http_client = http_client
+        self.udp_socket = udp_socket
+        self.update_tasks = set()
+        self._announce_timers = {}
+        self._tier_of = {}  # tracker: tier number in the announce-list
+        self._unannounced = set()  # backup trackers that have not got the STARTED event yet
+        self._completed = set()  # trackers that know the download is finished
+        self._failures = {}
+        self._starting = set()  # trackers with a STARTED announce in flight
+        self._peers_found = asyncio.Event()
 
         if use_local:
             self._add_tracker('local')
 
         if use_http:
-            for url in torrent_data.trackers:
-                self._add_tracker(url)
+            tiers = getattr(torrent_data, 'tiers', None) or [[url] for url in torrent_data.trackers]
+            for tier, urls in enumerate(tiers):
+                for url in urls:
+                    self._add_tracker(url, tier)
+
+        if dht is not None:
+            dht_tracker = DhtTracker(dht, self.info_hash, port)
+            dht_tracker.found_event.subscribe(self._collect_peers)
+            self.tracker_clients.append(dht_tracker)
 
     def _create_peer_id(self):
         return '-PC0001-' + hashlib.sha1(self.info_hash).digest().hex()[:12]
 
-    def _add_tracker(self, url):
-        if url.startswith('http'):
-            self.tracker_clients.append(HttpTrackerClient(url,
-                                                          self.info_hash,
-                                                          self.peer_id,
-                                                          self.port,
-                                                          self.segment_info))
+    def _add_tracker(self, url, tier=None):
         if url == 'local':
-            self.tracker_clients.append(LocalConnections())
+            if self.lsd is None:
+                logging.error('Local Service Discovery is not running, local peers are disabled')
+                return
+            local_peers = LocalPeers(self.lsd, self.info_hash, self.port)
+            local_peers.found_event.subscribe(self._collect_peers)
+            self.tracker_clients.append(local_peers)
+            return
+
+        if url.startswith('http'):
+            tracker = HttpTrackerClient(url, self.info_hash, self.peer_id, self.port, self.segment_info,
+                                        self.http_client)
+        elif url.startswith('udp'):
+            try:
+                tracker = UdpTrackerClient(url, self.info_hash, self.peer_id, self.port, self.segment_info,
+                                           self.udp_socket)
+            except ValueError as e:
+                logging.error(e)
+                return
+        else:
+            logging.error(f'Unsupported tracker "{url}"')
+            return
+        self.tracker_clients.append(tracker)
+        if tier is not None:
+            self._tier_of[tracker] = tier
 
     async def __aenter__(self):
         logging.info("Starting trackers")
+        started = time.monotonic()
 
-        bad_trackers = []
-        for tracker in self.tracker_clients:
-            try:
-                await tracker.make_request(TrackerEvent.STARTED)
-            except (ConnectionError, TimeoutError, bencode.BencodeDecodeError) as e:
-                bad_trackers.append(tracker)
-            except asyncio.TimeoutError as e:
-                logging.error(f"Timeout error for tracker: {tracker.url}")
-                bad_trackers.append(tracker)
-
-        for bad_tracker in bad_trackers:
-            self.tracker_clients.remove(bad_tracker)
+        tasks = set()
+        for tier in self.tiers:
+            task = self._spawn(self._start_tier(tier))
+            if not self.is_peer_source(tier[0]):
+                tasks.add(task)
+        peers_found = asyncio.create_task(self._peers_found.wait())
+        while tasks and not peers_found.done():
+            _, tasks = await asyncio.wait(tasks | {peers_found}, return_when=asyncio.FIRST_COMPLETED)
+            tasks.discard(peers_found)
+        peers_found.cancel()
 
-        if not self.tracker_clients:
-            raise BadTorrentTrackers("Torrent file had no stable trackers", bad_trackers)
+        no_tracker_answered = all(tracker in self._unannounced for tracker in self.trackers)
+        if self._peers_found.is_set():
+            logging.info(f"First peers after {time.monotonic() - started:.2f} s, {len(tasks)} tiers still starting")
+        elif no_tracker_answered and not any(isinstance(tracker, DhtTracker) for tracker in self.tracker_clients):
+            for timer in self._announce_timers.values():
+                timer.cancel()
+            self._announce_timers.clear()
+            for task in list(self.update_tasks):
+                task.cancel()
+            raise BadTorrentTrackers("Torrent file had no stable trackers", self.trackers)
+        elif no_tracker_answered:
+            logging.error("No tracker answered, searching for peers in DHT")
 
         return self
 
     async def __aexit__(self, exc_type, exc_val, exc_tb):
-        if self.update_task:
-            self.update_task.cancel()
+        for timer in self._announce_timers.values():
+            timer.cancel()
+        self._announce_timers.clear()
+
+        for task in list(self.update_tasks):
+            task.cancel()
             with suppress(asyncio.CancelledError):
-                await self.update_task
+                await task
 
         for tracker in self.tracker_clients:
             await tracker.close()
         if exc_type is not None:
             logging.error(f'Got exception of type - "{exc_type}", with value - "{exc_val}" while working with trackers')
 
-    async def _update_peers(self):
-        while True:
-            server_requests = [tracker.make_request(TrackerEvent.CHECK)
-                               for tracker in self.tracker_clients]
+    @staticmethod
+    def is_peer_source(tracker) -> bool:
+        return isinstance(tracker, (DhtTracker, LocalPeers))
 
+    @property
+    def trackers(self) -> list:
+        return [tracker for tracker in self.tracker_clients if not self.is_peer_source(tracker)]
+
+    @property
+    def tiers(self) -> list[list]:
+        tiers = {}
+        for tracker in self.tracker_clients:
+            tiers.setdefault(self._tier_of.get(tracker, tracker), []).append(tracker)
+        return list(tiers.values())
+
+    def _tier(self, tracker) -> list:
+        return next((tier for tier in self.tiers if tracker in tier), [tracker])
+
+    def _next_event(self, tracker) -> TrackerEvent:
+        if tracker in self._unannounced:
+            return TrackerEvent.STARTED
+        if self.segment_info.left == 0 and tracker not in self._completed:
+            return TrackerEvent.COMPLETED
+        return TrackerEvent.CHECK
+
+    async def _start_tier(self, tier):
+        self._unannounced.update(tier)
+        for tracker in tier:
+            self._starting.add(tracker)
+            timeout = None if self.is_peer_source(tracker) else configuration.TRACKER_STARTUP_TIMEOUT
             try:
-                await asyncio.gather(*server_requests)
-
-                for tracker in self.tracker_clients:
-                    while not tracker.new_peers.empty():
-                        peer = tracker.new_peers.get_nowait()
-                        if peer in self._peers:
-                            continue
-                        self._peers.add(peer)
-                        peer = PeerConnection(peer[0], self.torrent_data.total_segments, self.info_hash, peer[1])
-                        self.available_peers.put_nowait(peer)
-
-                await asyncio.sleep(1)
-            except asyncio.CancelledError:
-                logging.info("Canceled peers updating task")
-                break
-
-    def create_peers_update_task(self):
-        self.update_task = asyncio.create_task(self._update_peers())
-        logging.info("Created peer updation task")
+                await asyncio.wait_for(tracker.make_request(TrackerEvent.STARTED), timeout)
+            except (ConnectionError, TimeoutError, asyncio.TimeoutError, bencode.BencodeDecodeError) as e:
+                logging.error(f"Start announce failed for tracker {getattr(tracker, 'url', tracker)}: {e!r}")
+                self._failures[tracker] = self._failures.get(tracker, 0) + 1
+                self._demote(tracker)
+                continue
+            finally:
+                self._starting.discard(tracker)
+
+            self._on_announced(tracker)
+            self._collect_peers(tracker)
+            self._schedule_announce(tracker, self._announce_delay(tracker))
+            return
+
+        first = self._tier(tier[0])[0]
+        self._schedule_announce(first, self._retry_delay(first))
+
+    async def _update_peers(self, tracker):
+        try:
+            await tracker.make_request(self._next_event(tracker))
+        except (ConnectionError, TimeoutError, asyncio.TimeoutError, bencode.BencodeDecodeError) as e:
+            logging.error(f"Re-announce failed for tracker {getattr(tracker, 'url', tracker)}: {e}")
+            self._on_announce_failed(tracker)
+            return
+        except asyncio.CancelledError:
+            logging.info("Canceled peers updating task")
+            raise
+
+        self._on_announced(tracker)
+        self._collect_peers(tracker)
+        self._schedule_announce(tracker, self._announce_delay(tracker))
+
+    def _on_announced(self, tracker):
+        self._unannounced.discard(tracker)
+        self._failures.pop(tracker, None)
+        if self.segment_info.left == 0:
+            self._completed.add(tracker)
+
+        tier = self._tier(tracker)
+        if tier[0] is not tracker:
+            self.tracker_clients.remove(tracker)
+            self.tracker_clients.insert(self.tracker_clients.index(tier[0]), tracker)
+
+    def _demote(self, tracker):
+        tier = self._tier(tracker)
+        if tier[-1] is not tracker:
+            position = self.tracker_clients.index(tier[-1])
+            self.tracker_clients.remove(tracker)
+            self.tracker_clients.insert(position, tracker)
+
+    def _on_announce_failed(self, tracker):
+        self._failures[tracker] = self._failures.get(tracker, 0) + 1
+        tier = self._tier(tracker)
+        next_tracker = tier[(tier.index(tracker) + 1) % len(tier)]
+        if next_tracker is not tracker:
+            logging.info(f"Switching from tracker {tracker.url} to {next_tracker.url}")
+
+        self._schedule_announce(next_tracker, self._retry_delay(next_tracker))
+
+    def _retry_delay(self, tracker) -> float:
+        failures = self._failures.get(tracker, 0)
+        if not failures:
+            return 0
+        return min(configuration.TRACKER_RETRY_DELAY * 2 ** (failures - 1), configuration.TRACKER_MAX_RETRY_DELAY)
+
+    def _announce_delay(self, tracker) -> float:
+        interval = tracker.request_interval
+        if self.peer_store.active < configuration.ANNOUNCE_LOW_PEERS:
+            min_interval = getattr(tracker, 'min_interval', None) or configuration.TRACKER_MIN_INTERVAL
+            interval = min(interval, min_interval)
+        return interval
+
+    def _collect_peers(self, tracker):
+        while not tracker.new_peers.empty():
+            ip, port = tracker.new_peers.get_nowait()
+            self.peer_store.add(ip, port, getattr(tracker, 'url', 'local'))
+            self._peers_found.set()
+
+    def _schedule_announce(self, tracker, delay):
+        timer = self._announce_timers.pop(tracker, None)
+        if timer is not None:
+            timer.cancel()
+        self._announce_timers[tracker] = self.scheduler.call_later(delay, self._start_announce, tracker)
+
+    def _start_announce(self, tracker):
+        self._announce_timers.pop(tracker, None)
+        self._spawn(self._update_peers(tracker))
+
+    def _spawn(self, coroutine) -> asyncio.Task:
+        task = asyncio.create_task(coroutine)
+        self.update_tasks.add(task)
+        task.add_done_callback(self.update_tasks.discard)
+        return task
+
+    def schedule_peers_update(self):
+        for tracker in self.tracker_clients:
+            self._collect_peers(tracker)
+        for tier in self.tiers:
+            if not any(tracker in self._announce_timers or tracker in self._starting for tracker in tier):
+                self._schedule_announce(tier[0], self._announce_delay(tier[0]))
+        logging.info("Scheduled tracker re-announces")
+
+    def on_download_completed(self, *args):
+        self._spawn(self.announce_completed())
+
+    async def announce_completed(self):
+        trackers = [tracker for tracker in self._announce_timers
+                    if self._next_event(tracker) == TrackerEvent.COMPLETED]
+        for tracker in trackers:
+            self._announce_timers.pop(tracker).cancel()
+        await asyncio.gather(*(self._update_peers(tracker) for tracker in trackers))
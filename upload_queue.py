@@ -0,0 +1,114 @@
+import asyncio
+import logging
+import configuration
+import Message
+
+from collections import deque
+
+
+class UploadQueue:
+    """
+    Outstanding REQUESTs of one peer, served by a single task.
+    At most max_requests are queued, CANCEL removes queued entries and requests
+    for the same piece are served from one storage read.
+    While the peer is choked only its allowed-fast pieces are served, the rest is rejected.
+    """
+
+    def __init__(self, peer, file_writer, torrent_statistics, max_requests=configuration.MAX_UPLOAD_REQUESTS_PER_PEER):
+        self.peer = peer
+        self.file_writer = file_writer
+        self.torrent_statistics = torrent_statistics
+        self.max_requests = max_requests
+
+        self.requests = deque()
+        self.serving = set()
+        self.rejected = 0
+        self._task = None
+
+    def __len__(self):
+        return len(self.requests)
+
+    def push(self, request) -> bool:
+        key = (request.index, request.byte_offset, request.block_len)
+        if key in self.requests or key in self.serving:
+            return True
+        if not self.is_valid(*key):
+            logging.info(f"Некорректный запрос от пира {self.peer.ip}: {key}")
+            self.rejected += 1
+            return False
+        if len(self.requests) >= self.max_requests:
+            logging.info(f"Очередь запросов пира {self.peer.ip} переполнена")
+            self.rejected += 1
+            return False
+
+        self.requests.append(key)
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self._serve())
+        return True
+
+    def is_valid(self, index, byte_offset, block_len) -> bool:
+        return (0 < block_len <= configuration.MAX_UPLOAD_REQUEST_LENGTH and byte_offset >= 0
+                and index < len(self.torrent_statistics.bitfield) and self.torrent_statistics.bitfield[index])
+
+    def cancel(self, request):
+        key = (request.piece_index, request.byte_offset, request.block_len)
+        if key in self.requests:
+            self.requests.remove(key)
+        self.serving.discard(key)
+
+    def clear(self):
+        self.requests.clear()
+        self.serving.clear()
+
+    def drop_choked(self):
+        for key in [*self.requests, *self.serving]:
+            if key[0] not in self.peer.granted_fast:
+                self.peer.reject_request(Message.RequestsMessage(*key))
+        self.requests = deque(key for key in self.requests if key[0] in self.peer.granted_fast)
+        self.serving = {key for key in self.serving if key[0] in self.peer.granted_fast}
+
+    def take_batch(self) -> list[tuple[int, int, int]]:
+        index = self.requests[0][0]
+        batch = [request for request in self.requests if request[0] == index]
+        self.requests = deque(request for request in self.requests if request[0] != index)
+        self.serving.update(batch)
+        return batch
+
+    async def _serve(self):
+        while self.requests:
+            if not self.peer.is_active:
+                self.clear()
+                return
+            if self.peer.choked:
+                self.drop_choked()
+                if not self.requests:
+                    return
+
+            batch = self.take_batch()
+            index = batch[0][0]
+            begin = min(byte_offset for _, byte_offset, _ in batch)
+            end = max(byte_offset + block_len for _, byte_offset, block_len in batch)
+            data = await self.file_writer.read_range(index, begin, end - begin)
+
+            for request in batch:
+                if self.peer.choked and index not in self.peer.granted_fast:
+                    self.drop_choked()
+                    break
+                if request not in self.serving:
+                    continue
+                self.serving.discard(request)
+                _, byte_offset, block_len = request
+                block = data[byte_offset - begin:byte_offset - begin + block_len]
+                if len(block) != block_len:
+                    logging.error(f"Запрошенный блок выходит за границы сегмента {index}")
+                    continue
+                if not await self.peer.send_message_to_peer(Message.SendPieceMessage(index, byte_offset, block)):
+                    self.clear()
+                    return
+                self.torrent_statistics.update_uploaded(block_len)
+
+    def close(self):
+        self.clear()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
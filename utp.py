@@ -0,0 +1,524 @@
+import asyncio
+import logging
+import random
+import struct
+import time
+import configuration
+
+from collections import deque
+from timer_scheduler import TimerScheduler
+
+ST_DATA, ST_FIN, ST_STATE, ST_RESET, ST_SYN = range(5)
+VERSION = 1
+EXTENSION_SACK = 1
+SEQ_MASK = 0xFFFF
+TIMESTAMP_MASK = 0xFFFFFFFF
+
+HEADER = struct.Struct('!BBHIIIHH')
+
+
+def _timestamp_us() -> int:
+    return int(time.monotonic() * 1_000_000) & TIMESTAMP_MASK
+
+
+def _seq_distance(first, second) -> int:
+    """Signed distance from first to second in the 16-bit sequence space"""
+    distance = (second - first) & SEQ_MASK
+    return distance - 0x10000 if distance >= 0x8000 else distance
+
+
+class Packet:
+    __slots__ = ('type', 'connection_id', 'timestamp', 'timestamp_diff', 'window', 'seq_nr', 'ack_nr', 'sack',
+                 'payload')
+
+    def __init__(self, type, connection_id, seq_nr, ack_nr, window=0, timestamp=0, timestamp_diff=0,
+                 sack=b'', payload=b''):
+        self.type = type
+        self.connection_id = connection_id
+        self.timestamp = timestamp
+        self.timestamp_diff = timestamp_diff
+        self.window = window
+        self.seq_nr = seq_nr
+        self.ack_nr = ack_nr
+        self.sack = sack
+        self.payload = payload
+
+    def encode(self) -> bytes:
+        header = HEADER.pack(self.type << 4 | VERSION, EXTENSION_SACK if self.sack else 0, self.connection_id,
+                             self.timestamp, self.timestamp_diff, self.window, self.seq_nr, self.ack_nr)
+        if self.sack:
+            header += bytes((0, len(self.sack))) + self.sack
+        return header + self.payload
+
+    @classmethod
+    def decode(cls, data: bytes) -> 'Packet':
+        if len(data) < HEADER.size:
+            raise ValueError('Packet is too short')
+        type_version, extension, connection_id, timestamp, timestamp_diff, window, seq_nr, ack_nr = \
+            HEADER.unpack_from(data)
+        if type_version & 0x0F != VERSION or type_version >> 4 > ST_SYN:
+            raise ValueError('Unknown packet type or version')
+
+        sack = b''
+        position = HEADER.size
+        while extension:
+            if len(data) < position + 2:
+                raise ValueError('Truncated extension')
+            next_extension, length = data[position], data[position + 1]
+            if len(data) < position + 2 + length:
+                raise ValueError('Truncated extension')
+            if extension == EXTENSION_SACK:
+                sack = data[position + 2:position + 2 + length]
+            extension = next_extension
+            position += 2 + length
+
+        return cls(type_version >> 4, connection_id, seq_nr, ack_nr, window, timestamp, timestamp_diff, sack,
+                   data[position:])
+
+
+class _OutgoingPacket:
+    __slots__ = ('packet', 'size', 'sent_at', 'transmissions', 'fast_resent')
+
+    def __init__(self, packet: Packet):
+        self.packet = packet
+        self.size = len(packet.payload)
+        self.sent_at = 0
+        self.transmissions = 0
+        self.fast_resent = False
+
+
+class UtpConnection:
+    """
+    One uTP (BEP 29) connection. Also serves as the asyncio StreamWriter of the connection,
+    received data is delivered to an asyncio.StreamReader.
+    Congestion control is LEDBAT: the window follows the one-way queuing delay reported by the other side.
+    """
+
+    SYN_SENT = 0
+    CONNECTED = 1
+    CLOSED = 2
+
+    def __init__(self, socket: 'UtpSocket', address, recv_id, send_id):
+        self.socket = socket
+        self.address = address
+        self.recv_id = recv_id
+        self.send_id = send_id
+        self.state = UtpConnection.SYN_SENT
+
+        self.reader = asyncio.StreamReader()
+        self.connected = asyncio.get_running_loop().create_future()
+
+        self.seq_nr = 1
+        self.ack_nr = 0
+        self.max_window = configuration.UTP_INITIAL_WINDOW
+        self.peer_window = configuration.UTP_RECV_WINDOW
+        self.bytes_in_flight = 0
+        self.rtt = None
+        self.rtt_var = 0
+        self.rto = configuration.UTP_INITIAL_RTO
+        self.queuing_delay = 0
+        self.retransmitted = 0
+
+        self._send_buffer = bytearray()
+        self._in_flight = {}
+        self._reorder_buffer = {}
+        self._reply_micro = 0
+        self._duplicate_acks = 0
+        self._last_ack_nr = None
+        self._loss_seq = None
+        self._base_delays = deque()
+        self._fin_seq = None
+        self._closing = False
+        self._fin_sent = False
+        self._ack_scheduled = False
+        self._drain_waiter = None
+        self._timer = None
+
+    # StreamWriter interface
+
+    def write(self, data):
+        if self._closing or self.state == UtpConnection.CLOSED:
+            raise ConnectionResetError('uTP connection is closed')
+        self._send_buffer += data
+        self._flush()
+
+    async def drain(self):
+        while len(self._send_buffer) > configuration.UTP_WRITE_HIGH_WATER:
+            if self.state == UtpConnection.CLOSED:
+                raise ConnectionResetError('uTP connection is closed')
+            self._drain_waiter = asyncio.get_running_loop().create_future()
+            await self._drain_waiter
+        if self.state == UtpConnection.CLOSED and self._send_buffer:
+            raise ConnectionResetError('uTP connection is closed')
+
+    def close(self):
+        if self._closing or self.state == UtpConnection.CLOSED:
+            return
+        self._closing = True
+        self._flush()
+
+    def can_write_eof(self) -> bool:
+        return True
+
+    def write_eof(self):
+        """FIN only ends our direction, data from the other side is still received"""
+        self.close()
+
+    def is_closing(self) -> bool:
+        return self._closing or self.state == UtpConnection.CLOSED
+
+    async def wait_closed(self):
+        pass
+
+    def get_extra_info(self, name, default=None):
+        return self.address if name == 'peername' else default
+
+    # Connection setup
+
+    def send_syn(self):
+        self._queue_packet(ST_SYN, b'', self.recv_id)
+
+    def accept(self, syn: Packet):
+        self.ack_nr = syn.seq_nr
+        self.seq_nr = random.randint(1, SEQ_MASK)
+        self._reply_micro = (_timestamp_us() - syn.timestamp) & TIMESTAMP_MASK
+        self.state = UtpConnection.CONNECTED
+        self.connected.set_result(True)
+        self._send_state()
+
+    # Incoming packets
+
+    def packet_received(self, packet: Packet):
+        if self.state == UtpConnection.CLOSED:
+            return
+        self._reply_micro = (_timestamp_us() - packet.timestamp) & TIMESTAMP_MASK
+
+        if packet.type == ST_RESET:
+            self._shutdown(ConnectionResetError('uTP connection was reset'))
+            return
+        if packet.type == ST_SYN:
+            if self.state == UtpConnection.CONNECTED and packet.seq_nr == self.ack_nr:
+                self._send_state()
+            return
+
+        if self.state == UtpConnection.SYN_SENT:
+            if packet.type != ST_STATE:
+                return
+            self.ack_nr = (packet.seq_nr - 1) & SEQ_MASK
+            self.state = UtpConnection.CONNECTED
+            if not self.connected.done():
+                self.connected.set_result(True)
+
+        self._process_ack(packet)
+        if packet.type in (ST_DATA, ST_FIN):
+            self._process_data(packet)
+        self._check_finished()
+
+    def _process_data(self, packet: Packet):
+        if packet.type == ST_FIN:
+            self._fin_seq = packet.seq_nr
+
+        distance = _seq_distance(self.ack_nr, packet.seq_nr)
+        if distance == 1:
+            self._deliver(packet)
+            next_seq = (self.ack_nr + 1) & SEQ_MASK
+            while next_seq in self._reorder_buffer:
+                self._deliver(self._reorder_buffer.pop(next_seq))
+                next_seq = (self.ack_nr + 1) & SEQ_MASK
+        elif 1 < distance <= configuration.UTP_REORDER_LIMIT:
+            self._reorder_buffer[packet.seq_nr] = packet
+        self._schedule_ack()
+
+    def _deliver(self, packet: Packet):
+        self.ack_nr = packet.seq_nr
+        if packet.payload:
+            self.reader.feed_data(packet.payload)
+        if packet.seq_nr == self._fin_seq:
+            self.reader.feed_eof()
+
+    def _process_ack(self, packet: Packet):
+        self.peer_window = packet.window
+        acked_bytes = 0
+        now = time.monotonic()
+
+        for seq in list(self._in_flight):
+            if _seq_distance(seq, packet.ack_nr) >= 0:
+                acked_bytes += self._acknowledge(seq, now)
+        if packet.sack:
+            for bit in range(len(packet.sack) * 8):
+                if packet.sack[bit // 8] & (1 << (bit % 8)):
+                    seq = (packet.ack_nr + 2 + bit) & SEQ_MASK
+                    if seq in self._in_flight:
+                        acked_bytes += self._acknowledge(seq, now)
+
+        if packet.type == ST_STATE and not acked_bytes and packet.ack_nr == self._last_ack_nr and self._in_flight:
+            self._duplicate_acks += 1
+        elif acked_bytes:
+            self._duplicate_acks = 0
+        self._last_ack_nr = packet.ack_nr
+        if acked_bytes:
+            self._update_window(packet.timestamp_diff, acked_bytes)
+        self._detect_loss(packet)
+        self._flush()
+        self._arm_timer()
+
+    def _acknowledge(self, seq, now) -> int:
+        outgoing = self._in_flight.pop(seq)
+        self.bytes_in_flight -= outgoing.size
+        if outgoing.transmissions == 1:
+            self._update_rtt(now - outgoing.sent_at)
+        return outgoing.size
+
+    def _detect_loss(self, packet: Packet):
+        if not self._in_flight:
+            return
+        lost_seq = (packet.ack_nr + 1) & SEQ_MASK
+        sacked_after = sum(bin(byte).count('1') for byte in packet.sack)
+        if lost_seq not in self._in_flight or self._in_flight[lost_seq].fast_resent:
+            return
+        if self._duplicate_acks < configuration.UTP_DUPLICATE_ACKS and sacked_after < configuration.UTP_DUPLICATE_ACKS:
+            return
+
+        self._duplicate_acks = 0
+        if self._loss_seq is None or _seq_distance(self._loss_seq, lost_seq) > 0:
+            self._loss_seq = (self.seq_nr - 1) & SEQ_MASK
+            self.max_window = max(self.max_window // 2, configuration.UTP_MIN_WINDOW)
+        self._in_flight[lost_seq].fast_resent = True
+        self._resend(self._in_flight[lost_seq])
+
+    def _update_rtt(self, sample):
+        if self.rtt is None:
+            self.rtt, self.rtt_var = sample, sample / 2
+        else:
+            self.rtt_var += (abs(self.rtt - sample) - self.rtt_var) / 4
+            self.rtt += (sample - self.rtt) / 8
+        self.rto = max(self.rtt + 4 * self.rtt_var, configuration.UTP_MIN_RTO)
+
+    def _update_window(self, delay, acked_bytes):
+        now = time.monotonic()
+        if not self._base_delays or now - self._base_delays[-1][0] >= configuration.UTP_BASE_DELAY_INTERVAL:
+            self._base_delays.append([now, delay])
+            if len(self._base_delays) > configuration.UTP_BASE_DELAY_HISTORY:
+                self._base_delays.popleft()
+        else:
+            self._base_delays[-1][1] = min(self._base_delays[-1][1], delay)
+        base_delay = min(base for _, base in self._base_delays)
+
+        self.queuing_delay = ((delay - base_delay) & TIMESTAMP_MASK) / 1_000_000
+        off_target = (configuration.UTP_TARGET_DELAY - self.queuing_delay) / configuration.UTP_TARGET_DELAY
+        window_factor = min(acked_bytes, self.max_window) / max(self.max_window, acked_bytes)
+        gain = configuration.UTP_MAX_WINDOW_INCREASE * off_target * window_factor
+        self.max_window = min(max(self.max_window + gain, configuration.UTP_MIN_WINDOW), configuration.UTP_MAX_WINDOW)
+
+    # Outgoing packets
+
+    def _flush(self):
+        window = min(self.max_window, self.peer_window)
+        while self._send_buffer and self.state == UtpConnection.CONNECTED:
+            size = min(len(self._send_buffer), configuration.UTP_PACKET_SIZE)
+            if self.bytes_in_flight + size > window and self._in_flight:
+                break
+            payload = bytes(self._send_buffer[:size])
+            del self._send_buffer[:size]
+            self._queue_packet(ST_DATA, payload)
+
+        if self._closing and not self._send_buffer and not self._fin_sent and self.state == UtpConnection.CONNECTED:
+            self._fin_sent = True
+            self._queue_packet(ST_FIN, b'')
+        if self._drain_waiter and len(self._send_buffer) <= configuration.UTP_WRITE_HIGH_WATER:
+            if not self._drain_waiter.done():
+                self._drain_waiter.set_result(None)
+            self._drain_waiter = None
+
+    def _queue_packet(self, packet_type, payload, connection_id=None):
+        packet = Packet(packet_type, self.send_id if connection_id is None else connection_id, self.seq_nr,
+                        self.ack_nr, payload=payload)
+        outgoing = _OutgoingPacket(packet)
+        self._in_flight[self.seq_nr] = outgoing
+        self.bytes_in_flight += outgoing.size
+        self.seq_nr = (self.seq_nr + 1) & SEQ_MASK
+        self._transmit(outgoing)
+        self._arm_timer()
+
+    def _transmit(self, outgoing: _OutgoingPacket):
+        packet = outgoing.packet
+        packet.ack_nr = self.ack_nr
+        packet.timestamp = _timestamp_us()
+        packet.timestamp_diff = self._reply_micro
+        packet.window = self._receive_window()
+        packet.sack = self._selective_ack()
+        outgoing.sent_at = time.monotonic()
+        outgoing.transmissions += 1
+        self.socket.send(packet.encode(), self.address)
+
+    def _resend(self, outgoing: _OutgoingPacket):
+        self.retransmitted += 1
+        self._transmit(outgoing)
+
+    def _receive_window(self) -> int:
+        buffered = sum(len(packet.payload) for packet in self._reorder_buffer.values()) + len(self.reader._buffer)
+        return max(configuration.UTP_RECV_WINDOW - buffered, 0)
+
+    def _selective_ack(self) -> bytes:
+        if not self._reorder_buffer:
+            return b''
+        mask = bytearray(4)
+        for seq in self._reorder_buffer:
+            bit = _seq_distance(self.ack_nr, seq) - 2
+            if bit >= len(mask) * 8:
+                mask += bytes(4 * ((bit - len(mask) * 8) // 32 + 1))
+            mask[bit // 8] |= 1 << (bit % 8)
+        return bytes(mask)
+
+    def _schedule_ack(self):
+        if self._ack_scheduled:
+            return
+        self._ack_scheduled = True
+        asyncio.get_running_loop().call_soon(self._send_delayed_ack)
+
+    def _send_delayed_ack(self):
+        self._ack_scheduled = False
+        if self.state != UtpConnection.CLOSED:
+            self._send_state()
+
+    def _send_state(self):
+        packet = Packet(ST_STATE, self.send_id, self.seq_nr, self.ack_nr)
+        self._transmit(_OutgoingPacket(packet))
+
+    # Timeouts and shutdown
+
+    def _arm_timer(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._in_flight and self.state != UtpConnection.CLOSED:
+            self._timer = self.socket.timers.call_later(self.rto, self._on_timeout)
+
+    def _on_timeout(self):
+        self._timer = None
+        oldest = next(iter(self._in_flight.values()), None)
+        if oldest is None:
+            return
+        if oldest.transmissions > configuration.UTP_MAX_RETRANSMISSIONS:
+            self._shutdown(TimeoutError('uTP connection timed out'))
+            return
+
+        self.max_window = configuration.UTP_MIN_WINDOW
+        self.rto = min(self.rto * 2, configuration.UTP_MAX_RTO)
+        self._resend(oldest)
+        self._arm_timer()
+
+    def _check_finished(self):
+        if self._fin_sent and not self._in_flight and self.reader.at_eof():
+            self._shutdown()
+
+    def _shutdown(self, exception=None):
+        if self.state == UtpConnection.CLOSED:
+            return
+        self.state = UtpConnection.CLOSED
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if not self.connected.done():
+            self.connected.set_exception(exception or ConnectionResetError('uTP connection is closed'))
+        if exception is not None:
+            self.reader.set_exception(exception)
+        elif not self.reader.at_eof():
+            self.reader.feed_eof()
+        if self._drain_waiter and not self._drain_waiter.done():
+            self._drain_waiter.set_result(None)
+        self.socket.remove(self)
+
+    def abort(self):
+        if self.state == UtpConnection.CONNECTED:
+            self.socket.send(Packet(ST_RESET, self.send_id, self.seq_nr, self.ack_nr).encode(), self.address)
+        self._shutdown(ConnectionResetError('uTP connection was aborted'))
+
+
+class UtpSocket(asyncio.DatagramProtocol):
+    """
+    UDP endpoint multiplexing uTP connections. open_connection and start_server mirror
+    asyncio.open_connection and asyncio.start_server, so uTP streams can replace TCP ones.
+    """
+
+    def __init__(self, timers: TimerScheduler = None):
+        self.timers = timers if timers is not None else TimerScheduler()
+        self.connections = {}
+        self.transport = None
+        self._client_connected = None
+
+    @classmethod
+    async def create(cls, host='0.0.0.0', port=0, timers: TimerScheduler = None) -> 'UtpSocket':
+        utp_socket = cls(timers)
+        await asyncio.get_running_loop().create_datagram_endpoint(lambda: utp_socket, local_addr=(host, port))
+        return utp_socket
+
+    @property
+    def port(self) -> int:
+        return self.transport.get_extra_info('sockname')[1]
+
+    def connection_made(self, transport):
+        self.transport = transport
+
+    def start_server(self, client_connected):
+        self._client_connected = client_connected
+
+    async def open_connection(self, host, port):
+        address = (host, port)
+        recv_id = random.randint(0, SEQ_MASK)
+        while (address, recv_id) in self.connections:
+            recv_id = random.randint(0, SEQ_MASK)
+
+        connection = UtpConnection(self, address, recv_id, (recv_id + 1) & SEQ_MASK)
+        self.connections[(address, recv_id)] = connection
+        connection.send_syn()
+        try:
+            await asyncio.wait_for(connection.connected, configuration.UTP_CONNECT_TIMEOUT)
+        except (asyncio.TimeoutError, ConnectionError):
+            connection.abort()
+            raise
+        return connection.reader, connection
+
+    def datagram_received(self, data, address):
+        try:
+            packet = Packet.decode(data)
+        except ValueError:
+            return
+
+        connection = self.connections.get((address, packet.connection_id))
+        if connection is not None:
+            connection.packet_received(packet)
+        elif packet.type == ST_SYN and self._client_connected is not None:
+            self._accept(packet, address)
+
+    def _accept(self, syn: Packet, address):
+        recv_id = (syn.connection_id + 1) & SEQ_MASK
+        connection = self.connections.get((address, recv_id))
+        if connection is not None:
+            connection.packet_received(syn)
+            return
+
+        connection = UtpConnection(self, address, recv_id, syn.connection_id)
+        self.connections[(address, recv_id)] = connection
+        connection.accept(syn)
+        logging.info(f"Incoming uTP connection from {address}")
+        result = self._client_connected(connection.reader, connection)
+        if asyncio.iscoroutine(result):
+            asyncio.create_task(result)
+
+    def send(self, data, address):
+        if self.transport is not None:
+            self.transport.sendto(data, address)
+
+    def remove(self, connection: UtpConnection):
+        self.connections.pop((connection.address, connection.recv_id), None)
+
+    def error_received(self, exc):
+        logging.error(f"uTP socket error: {exc}")
+
+    def close(self):
+        for connection in list(self.connections.values()):
+            connection.abort()
+        if self.transport is not None:
+            self.transport.close()
+            self.transport = None
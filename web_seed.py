@@ -0,0 +1,112 @@
+import logging
+import aiohttp
+import configuration
+
+from http_client import HttpClient
+from urllib.parse import quote
+
+
+class WebSeedError(Exception):
+    pass
+
+
+class WebSeed:
+    """
+    HTTP mirror of a torrent (BEP 19, GetRight style url-list).
+    Byte ranges of the torrent are fetched with Range requests, split at file boundaries,
+    over the session-wide HTTP client if given, otherwise over a keep-alive pool owned by the mirror.
+    """
+
+    def __init__(self, url, torrent, connections=configuration.WEB_SEED_CONNECTIONS,
+                 timeout=configuration.WEB_SEED_TIMEOUT, http_client: HttpClient = None):
+        self.url = url
+        self.torrent = torrent
+        self.connections = connections
+        self.timeout = timeout
+        self.http_client = http_client
+
+        self.failures = 0
+        self.downloaded = 0
+        self.corrupt_segments = set()  # segments this mirror failed to serve intact, left to other sources
+        self._session = None
+
+    def file_url(self, file_info) -> str:
+        if len(self.torrent.files) == 1 and not self.url.endswith('/'):
+            return self.url
+        base = self.url if self.url.endswith('/') else self.url + '/'
+        path = [self.torrent.torrent_name]
+        if len(self.torrent.files) != 1:
+            path += file_info['path']
+        return base + '/'.join(quote(str(part)) for part in path)
+
+    def file_ranges(self, begin, length) -> list[tuple[str, int, int]]:
+        ranges = []
+        file_start = 0
+        for file_info in self.torrent.files:
+            file_end = file_start + file_info['length']
+            start, end = max(begin, file_start), min(begin + length, file_end)
+            if start < end:
+                ranges.append((self.file_url(file_info), start - file_start, end - start))
+            file_start = file_end
+        return ranges
+
+    async def fetch_segments(self, first_segment, count) -> bytes:
+        begin = first_segment * self.torrent.segment_length
+        end = min((first_segment + count) * self.torrent.segment_length, self.torrent.total_length)
+        return await self.fetch(begin, end - begin)
+
+    async def fetch(self, begin, length) -> bytes:
+        chunks = []
+        try:
+            for url, start, size in self.file_ranges(begin, length):
+                chunks.append(await self._fetch_range(url, start, size))
+        except (aiohttp.ClientError, TimeoutError, ConnectionError) as e:
+            raise WebSeedError(f'Web seed "{self.url}" request failed: {e}') from e
+        data = b''.join(chunks)
+        self.downloaded += len(data)
+        return data
+
+    async def _fetch_range(self, url, start, size) -> bytes:
+        headers = {'Range': f'bytes={start}-{start + size - 1}'}
+        async with self._get_session().get(url, headers=headers,
+                                           timeout=aiohttp.ClientTimeout(total=self.timeout)) as response:
+            if response.status == 206:
+                data = await self._read(response, size)
+            elif response.status == 200:
+                logging.info(f'Web seed "{self.url}" ignored Range header')
+                data = await self._read_slice(response, start, size)
+            else:
+                raise WebSeedError(f'Web seed "{url}" responded with status code {response.status}')
+        if len(data) != size:
+            raise WebSeedError(f'Web seed "{url}" returned {len(data)} bytes instead of {size}')
+        return data
+
+    async def _read(self, response, limit) -> bytes:
+        if self.http_client is not None:
+            return await self.http_client.read(response, limit)
+        return await response.read()
+
+    @staticmethod
+    async def _read_slice(response, start, size) -> bytes:
+        chunks, position, end = [], 0, start + size
+        async for chunk in response.content.iter_chunked(2 ** 16):
+            if position + len(chunk) > start:
+                chunks.append(chunk[max(start - position, 0):end - position])
+            position += len(chunk)
+            if position >= end:
+                break
+        return b''.join(chunks)
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        if self.http_client is not None:
+            return self.http_client.session
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.connections),
+                timeout=aiohttp.ClientTimeout(total=self.timeout))
+        return self._session
+
+    async def close(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None